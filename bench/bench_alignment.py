@@ -0,0 +1,90 @@
+#! /usr/bin/env python3
+"""
+Micro-benchmark of MD tokenisation and ``Alignment`` construction on long,
+mismatch-heavy MD strings, such as those of hisat2 spliced reads.
+"""
+
+import argparse, os, random, sys, timeit
+
+sys.path.append(os.path.join(sys.path[0], '../src'))
+
+from alignment import Alignment
+
+def parse_md_replace(md):
+    r"""
+    The ``Alignment._parse_md`` which ``str.replace``\ d each token off the
+    front of the MD string.
+    """
+    md_tokens = []
+    while md != '':
+        if Alignment.RE_MD_MATCH.match(md):
+            matching = Alignment.RE_MD_MATCH.match(md).group()
+            md_tokens.append([Alignment.MD_MATCH, int(matching)])
+            md = md.replace(matching, '', 1)
+        elif Alignment.RE_MD_DELETION.match(md):
+            matching = Alignment.RE_MD_DELETION.match(md).group()
+            md_tokens.append([Alignment.MD_DELETION] + [
+                    b for b in matching if not b in ('^', '0')])
+            md = md.replace(matching, '', 1)
+        elif Alignment.RE_MD_MISMATCH.match(md):
+            matching = Alignment.RE_MD_MISMATCH.match(md).group()
+            md_tokens.append([Alignment.MD_MISMATCH] + [
+                    b for b in matching if not b == '0'])
+            md = md.replace(matching, '', 1)
+        else:
+            raise RuntimeError('Invalid MD string')
+    return md_tokens
+
+def make_spliced_fields(exons, exon_length, mismatch_every, seed=0):
+    r"""
+    CIGAR and MD fields of a spliced read of exons exons, with a mismatch about
+    every mismatch_every bases and a short deletion in every other exon.
+
+    Returns
+    -------
+    tuple of str (cigar) and str (md)
+    """
+    rng = random.Random(seed)
+    cigar, md = [], []
+    matches = 0
+    for exon in range(exons):
+        if exon != 0:
+            cigar.append('{}N'.format(rng.randint(50, 5000)))
+        cigar.append('{}M'.format(exon_length))
+        for _ in range(exon_length):
+            if rng.random() < 1 / mismatch_every:
+                md.append('{}{}'.format(matches, rng.choice('ACGT')))
+                matches = 0
+            else:
+                matches += 1
+        if exon % 2 == 1:
+            cigar.append('2D')
+            md.append('{}^{}'.format(matches, rng.choice('ACGT') * 2))
+            matches = 0
+    md.append(str(matches))
+    return ''.join(cigar), ''.join(md)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--exons', type=int, nargs='+', default=[2, 20, 200])
+    parser.add_argument('--exon-length', type=int, default=75)
+    parser.add_argument('--mismatch-every', type=int, default=4)
+    parser.add_argument('--number', type=int, default=20)
+    args = parser.parse_args()
+
+    print('md_length\treplace_us\tfinditer_us\tspeedup\talignment_us')
+    for exons in args.exons:
+        cigar, md = make_spliced_fields(
+                exons, args.exon_length, args.mismatch_every)
+        assert parse_md_replace(md) == Alignment._parse_md(md)
+        replace_time = min(timeit.repeat(
+                lambda: parse_md_replace(md), number=args.number, repeat=3))
+        finditer_time = min(timeit.repeat(
+                lambda: Alignment._parse_md(md), number=args.number, repeat=3))
+        alignment_time = min(timeit.repeat(
+                lambda: Alignment(1, cigar, md), number=args.number, repeat=3))
+        print('{}\t{:.1f}\t{:.1f}\t{:.1f}x\t{:.1f}'.format(
+                len(md), replace_time / args.number * 1e6,
+                finditer_time / args.number * 1e6,
+                replace_time / finditer_time,
+                alignment_time / args.number * 1e6))
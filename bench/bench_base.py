@@ -0,0 +1,44 @@
+#! /usr/bin/env python3
+"""
+Memory per read and clipping throughput of ``Alignment``, which keeps one
+``Base`` per aligned position.
+"""
+
+import argparse, os, sys, time, tracemalloc
+
+sys.path.append(os.path.join(sys.path[0], '../src'))
+sys.path.append(os.path.join(sys.path[0], '../test'))
+
+from alignment import Alignment
+from test_alignment_cases import bowtie2_fields, hisat2_fields
+
+# The 150 bp reads of the test cases
+FIELDS = list(filter(
+        lambda f: sum(map(lambda t: t[1], filter(lambda t: t[0] in 'MIS=X',
+            Alignment._parse_cigar(f[0])))) == 150,
+        bowtie2_fields + hisat2_fields))
+
+def memory_per_read(reads):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    alignments = [Alignment(1, cigar, md) for cigar, md in reads]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before) / len(alignments)
+
+def clip_throughput(reads, start, stop):
+    begin = time.perf_counter()
+    for cigar, md in reads:
+        Alignment(1, cigar, md).soft_clip(start, stop)
+    return len(reads) / (time.perf_counter() - begin)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--reads', type=int, default=20000)
+    args = parser.parse_args()
+
+    reads = [FIELDS[i % len(FIELDS)] for i in range(args.reads)]
+    print('reads\tbytes_per_read\tclipped_reads_per_s')
+    print('{}\t{:.0f}\t{:.0f}'.format(
+            len(reads), memory_per_read(reads),
+            clip_throughput(reads, 20, 120)))
@@ -0,0 +1,88 @@
+#! /usr/bin/env python3
+"""
+Compare norm.find_boxplot_factor against the loop-based version of
+normalize_profiles it replaces, on large synthetic reactivity profiles.
+"""
+
+import argparse, math, os, sys, timeit
+
+sys.path.append(os.path.join(sys.path[0], '../src'))
+
+import numpy as np
+import norm
+from norm import NormError
+
+def calc_quartile_loop(x, q, qtype=7):
+    y = np.copy(x)
+    n = len(y)
+    a, b, c, d = (1, -1, 0, 1)  # R type 7
+    g, j = math.modf(a + (n + b) * q - 1)
+    if j < 0:
+        return x[0]
+    elif j >= n:
+        return x[n - 1]
+    j = int(math.floor(j))
+    if g == 0:
+        return x[j]
+    else:
+        return y[j] + (y[j + 1] - y[j]) * (c + d * g)
+
+def find_boxplot_factor_loop(array):
+    x, o, a = [], [], 0
+    x = array[np.where(np.isfinite(array))]
+    if x.shape[0] < 10:
+        raise NormError('too few nucleotides')
+    x.sort()
+    ten_pct = len(x) // 10
+    five_pct = len(x) // 20
+    q_limit = 1.5 * abs(
+            calc_quartile_loop(x, 0.25) - calc_quartile_loop(x, 0.75))
+    ten_limit = x[x.shape[0] - 1 - ten_pct]
+    five_limit = x[x.shape[0] - 1 - five_pct]
+    limit = max(q_limit, ten_limit)
+    if len(x) < 100:
+        limit = max(q_limit, five_limit)
+    for i in range(len(x)):
+        if x[i] < limit:
+            o.append(x[i])
+    try:
+        for i in range(-ten_pct, 0):
+            a = o[i] + a
+        norm_factor = a / ten_pct
+    except IndexError:
+        raise NormError('Unable to calculate a normalization factor.')
+    return norm_factor
+
+def make_profile(length, seed=0, nan_fraction=0.05):
+    r"""
+    A synthetic reactivity profile: mostly low, gamma-distributed reactivities
+    with a tail of highly reactive positions, and some positions without data.
+    """
+    random = np.random.default_rng(seed)
+    profile = random.gamma(0.6, 0.02, length)
+    hot = random.random(length) < 0.02
+    profile[hot] += random.gamma(2, 0.2, hot.sum())
+    profile[random.random(length) < nan_fraction] = np.nan
+    return profile
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lengths', type=int, nargs='+',
+            default=[10**4, 10**5, 10**6])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print('length\tloop_s\tvectorised_s\tspeedup\tidentical')
+    for length in args.lengths:
+        profile = make_profile(length)
+        loop_factor = find_boxplot_factor_loop(profile)
+        vectorised_factor = norm.find_boxplot_factor(profile)
+        loop_time = min(timeit.repeat(
+                lambda: find_boxplot_factor_loop(profile),
+                number=1, repeat=args.repeat))
+        vectorised_time = min(timeit.repeat(
+                lambda: norm.find_boxplot_factor(profile),
+                number=1, repeat=args.repeat))
+        print('{}\t{:.4f}\t{:.4f}\t{:.1f}x\t{}'.format(
+                length, loop_time, vectorised_time,
+                loop_time / vectorised_time, loop_factor == vectorised_factor))
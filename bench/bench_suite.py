@@ -0,0 +1,235 @@
+#! /usr/bin/env python3
+"""
+Benchmark suite for alignment clipping, normalisation and the end-to-end
+profile path, on synthetic bowtie2-style and hisat2-style reads. Results are
+stored as JSON (by default in bench/results/, named after the commit), so
+that runs can be compared across commits with --compare.
+
+The end-to-end benchmark runs ``profile.profile_once`` with the stand-in
+shapemapper2 binaries of bench/stand_ins, so it times bedshape's own work
+and process overhead, not that of shapemapper2.
+"""
+
+import argparse, datetime, io, json, logging, os, platform, shutil, \
+        subprocess, sys, tempfile, time
+
+BENCH_DIR = os.path.dirname(os.path.realpath(__file__))
+os.environ['BEDSHAPE_BIN_DIR'] = os.path.join(BENCH_DIR, 'stand_ins')
+# Ahead of the standard library, which has its own profile module.
+sys.path.insert(0, os.path.join(BENCH_DIR, '../src'))
+
+import numpy as np
+import clip, norm, normalize_profiles, profile, sam
+from alignment import Alignment, ClippedRegionEmptyError
+from synthetic import make_reference, make_sam_lines, write_reference
+
+RNAME = 'chrB'
+MARGIN = 2000  # reference bases either side of the region
+
+def best_of(function, repeat):
+    r"""
+    Returns
+    -------
+    float (the shortest time of repeat calls of function, in seconds)
+    """
+    times = []
+    for _ in range(repeat):
+        begin = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - begin)
+    return min(times)
+
+def get_fields(lines):
+    fields = []
+    for line in lines:
+        line_fields = line.split(b'\t')
+        fields.append((int(line_fields[3]), line_fields[5].decode(),
+                line_fields[-1][5:].decode()))
+    return fields
+
+def construct_alignments(fields):
+    for pos, cigar, md in fields:
+        Alignment(pos, cigar, md)
+
+def soft_clip_alignments(fields, start, stop):
+    for pos, cigar, md in fields:
+        try:
+            Alignment(pos, cigar, md).soft_clip(start, stop)
+        # Alignment.soft_clip fails on some reads outside the region.
+        except (ClippedRegionEmptyError, TypeError, ValueError):
+            pass
+
+def soft_clip_runs(fields, start, stop):
+    for pos, cigar, md in fields:
+        try:
+            clip.soft_clip(pos, cigar, md, start, stop)
+        except ClippedRegionEmptyError:
+            pass
+
+def clip_sam_file(lines, start, stop):
+    sam_file = sam.File(lines)
+    sam_file.soft_clip(start, stop)
+    str(sam_file)
+
+def clip_sam_stream(lines, start, stop):
+    sam.Stream(lines, start, stop).write(io.BytesIO())
+
+def profile_region(tmpdir, reference_name, region, in_process=False):
+    outdir = os.path.join(tmpdir, 'out')
+    profile.profile_once(reference_name, 'modified', 'untreated', None,
+            region, keep=True, outdir=outdir, min_depth=0, max_bg=1,
+            skip_shape=False, min_mapq=0, tmpdir=tmpdir, extracted=True,
+            in_process=in_process)
+    # As run does, once the region is finished
+    profile.render_figure(os.path.join(outdir, '{}.profile'.format(region)),
+            '{}.pdf'.format(region), outdir=outdir, min_depth=0, max_bg=1)
+
+def run_style(style, args):
+    r"""
+    Run every benchmark on reads of style.
+
+    Returns
+    -------
+    dict of str (benchmark) to dict of results
+    """
+    start = MARGIN + 1
+    stop = MARGIN + args.region_length
+    reference = make_reference(args.region_length + 2 * MARGIN)
+    lines = make_sam_lines(reference, RNAME, start, stop, depth=args.depth,
+            read_length=args.read_length, style=style)
+    fields = get_fields(lines)
+    results = {}
+
+    def add(name, seconds, reads=len(lines)):
+        results['{}/{}'.format(style, name)] = {
+                'seconds': seconds, 'reads_per_s': reads / seconds}
+
+    add('alignment_construction', best_of(
+            lambda: construct_alignments(fields), args.repeat))
+    add('alignment_soft_clip', best_of(
+            lambda: soft_clip_alignments(fields, start, stop), args.repeat))
+    add('clip_soft_clip', best_of(
+            lambda: soft_clip_runs(fields, start, stop), args.repeat))
+    add('sam_file', best_of(
+            lambda: clip_sam_file(lines, start, stop), args.repeat))
+    add('sam_stream', best_of(
+            lambda: clip_sam_stream(lines, start, stop), args.repeat))
+
+    if not args.skip_profile:
+        tmpdir = tempfile.mkdtemp(prefix='bedshape-bench-')
+        try:
+            reference_name = os.path.join(tmpdir, 'reference.fa')
+            write_reference(reference_name, RNAME, reference)
+            for seed, sample_name in enumerate(profile.SAMPLE_NAMES[:2]):
+                with open(os.path.join(tmpdir, sample_name), 'wb') as outfile:
+                    outfile.write(b'\n'.join(make_sam_lines(
+                            reference, RNAME, start, stop, depth=args.depth,
+                            read_length=args.read_length, style=style,
+                            seed=seed)) + b'\n')
+            region = '{}:{}-{}'.format(RNAME, start, stop)
+            add('profile_once', best_of(
+                    lambda: profile_region(tmpdir, reference_name, region),
+                    args.repeat), reads=2 * len(lines))
+            add('profile_once_in_process', best_of(
+                    lambda: profile_region(tmpdir, reference_name, region,
+                        in_process=True), args.repeat), reads=2 * len(lines))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    return results
+
+def run_normalisation(args):
+    random = np.random.default_rng(0)
+    profile_array = random.gamma(0.6, 0.1, args.profile_length)
+    profile_array[random.random(args.profile_length) < 0.05] = np.nan
+    stderrs = np.abs(random.normal(0, 0.01, args.profile_length))
+    results = {}
+    seconds = best_of(
+            lambda: norm.find_boxplot_factor(profile_array),
+            args.repeat)
+    results['normalise/find_boxplot_factor'] = {'seconds': seconds,
+            'positions_per_s': args.profile_length / seconds}
+    seconds = best_of(
+            lambda: normalize_profiles.normalize_profile(
+                profile_array, stderrs, 1.5), args.repeat)
+    results['normalise/normalize_profile'] = {'seconds': seconds,
+            'positions_per_s': args.profile_length / seconds}
+    return results
+
+def get_commit():
+    r"""
+    Returns
+    -------
+    tuple of str (commit, or 'unknown') and bool (whether the tree is dirty)
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                cwd=BENCH_DIR, stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL, universal_newlines=True,
+                check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--', '..'],
+                cwd=BENCH_DIR, stdout=subprocess.PIPE,
+                universal_newlines=True).stdout.strip() != ''
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown', False
+    return commit, dirty
+
+def compare(results, baseline):
+    print('benchmark\tbaseline\tcurrent\tchange')
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        rate = [key for key in results[name] if key.endswith('_per_s')][0]
+        print('{}\t{:.0f}\t{:.0f}\t{:+.1%}'.format(name, baseline[name][rate],
+                results[name][rate],
+                results[name][rate] / baseline[name][rate] - 1))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--styles', nargs='+', default=['bowtie2', 'hisat2'],
+            choices=['bowtie2', 'hisat2'])
+    parser.add_argument('--depth', type=int, default=200)
+    parser.add_argument('--read-length', type=int, default=150)
+    parser.add_argument('--region-length', type=int, default=1000)
+    parser.add_argument('--profile-length', type=int, default=10**6)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--skip-profile', action='store_true',
+            help='Skip the end-to-end profile_once benchmark.')
+    parser.add_argument('--out',
+            help='Results file. Defaults to bench/results/<commit>.json.')
+    parser.add_argument('--compare',
+            help='Results file of an earlier run to compare against.')
+    args = parser.parse_args()
+
+    logging.getLogger('bedshape').setLevel(logging.ERROR)
+
+    commit, dirty = get_commit()
+    results = {}
+    for style in args.styles:
+        results.update(run_style(style, args))
+    results.update(run_normalisation(args))
+
+    out_name = args.out if args.out != None else os.path.join(BENCH_DIR,
+            'results', '{}{}.json'.format(commit, '-dirty' if dirty else ''))
+    os.makedirs(os.path.dirname(os.path.abspath(out_name)), exist_ok=True)
+    with open(out_name, 'w') as outfile:
+        json.dump({
+                'commit': commit, 'dirty': dirty,
+                'date': datetime.datetime.now().isoformat(),
+                'python': platform.python_version(),
+                'parameters': {key: value for key, value in vars(args).items()
+                    if key not in ('out', 'compare')},
+                'results': results}, outfile, indent=1, sort_keys=True)
+
+    print('benchmark\tseconds\trate')
+    for name in sorted(results):
+        rate = [key for key in results[name] if key.endswith('_per_s')][0]
+        print('{}\t{:.4f}\t{:.0f} {}'.format(
+                name, results[name]['seconds'], results[name][rate],
+                rate.replace('_per_s', '/s')))
+    print('Results written to {}'.format(out_name))
+
+    if args.compare != None:
+        with open(args.compare) as baseline_file:
+            compare(results, json.load(baseline_file)['results'])
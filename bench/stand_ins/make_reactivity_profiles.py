@@ -0,0 +1,26 @@
+#! /usr/bin/env python3
+"""
+Stand-in for shapemapper2's make_reactivity_profiles.py, for benchmarks:
+writes a profile of seeded, gamma-distributed reactivities over the reference.
+"""
+
+import argparse, random
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--fa', required=True)
+parser.add_argument('--counts', nargs='+', required=True)
+parser.add_argument('--out', required=True)
+parser.add_argument('--mindepth', type=int, default=0)
+parser.add_argument('--maxbg', type=float, default=1)
+args = parser.parse_args()
+
+with open(args.fa) as fasta_file:
+    sequence = ''.join(line.strip() for line in fasta_file
+            if not line.startswith('>'))
+
+rng = random.Random(len(sequence))
+with open(args.out, 'w') as outfile:
+    outfile.write('Nucleotide\tSequence\tHQ_profile\tHQ_stderr\n')
+    for i, base in enumerate(sequence):
+        outfile.write('{}\t{}\t{}\t{}\n'.format(i + 1, base,
+                rng.gammavariate(0.6, 0.1), rng.random() / 100))
@@ -0,0 +1,16 @@
+#! /usr/bin/env python3
+"""
+Stand-in for shapemapper2's render_figures.py, for benchmarks: writes an
+empty figure.
+"""
+
+import argparse
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--infile', required=True)
+parser.add_argument('--plot', required=True)
+parser.add_argument('--mindepth', type=int, default=0)
+parser.add_argument('--maxbg', type=float, default=1)
+args = parser.parse_args()
+
+open(args.plot, 'w').close()
@@ -0,0 +1,23 @@
+#! /usr/bin/env python3
+"""
+Stand-in for shapemapper2's tab_to_shape.py, for benchmarks: writes the
+normalised reactivities of a profile to each output.
+"""
+
+import argparse
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--infile', required=True)
+parser.add_argument('--map', required=True)
+parser.add_argument('--shape', required=True)
+parser.add_argument('--varna', required=True)
+parser.add_argument('--ribosketch', required=True)
+args = parser.parse_args()
+
+with open(args.infile) as infile:
+    lines = infile.read().splitlines()[1:]
+for out_name in (args.map, args.shape, args.varna, args.ribosketch):
+    with open(out_name, 'w') as outfile:
+        for line in lines:
+            fields = line.split('\t')
+            outfile.write('{}\t{}\n'.format(fields[0], fields[-2]))
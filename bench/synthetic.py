@@ -0,0 +1,129 @@
+"""
+Synthetic references and SAM records, for benchmarks: bowtie2-style reads
+(soft clips, mismatches and short indels) and hisat2-style spliced reads,
+at a given depth and read length over a region.
+"""
+
+import random
+
+BASES = 'ACGT'
+
+def make_reference(length, seed=0):
+    rng = random.Random(seed)
+    return ''.join(rng.choice(BASES) for _ in range(length))
+
+def make_ops(rng, read_length, style):
+    r"""
+    CIGAR ops of a read of read_length bases: bowtie2 reads may be soft
+    clipped, and have a short insertion or deletion; hisat2 reads are also
+    spliced into two or three exons.
+
+    Returns
+    -------
+    list of two-element tuples of str (op) and int (reps)
+    """
+    ops = []
+    left_clip = rng.choice([0, 0, 0, rng.randint(1, 10)])
+    right_clip = rng.choice([0, 0, 0, rng.randint(1, 10)])
+    aligned = read_length - left_clip - right_clip
+
+    exons = 1 if style == 'bowtie2' else rng.choice([1, 2, 2, 3])
+    cuts = sorted(rng.sample(range(10, aligned - 10), exons - 1))
+    lengths = [b - a for a, b in zip([0] + cuts, cuts + [aligned])]
+    if left_clip > 0:
+        ops.append(('S', left_clip))
+    for exon, length in enumerate(lengths):
+        if exon > 0:
+            ops.append(('N', rng.randint(50, 500)))
+        indel = rng.random()
+        if indel < 0.05 and length > 20:
+            first = rng.randint(5, length - 10)
+            ops += [('M', first), ('I', 2), ('M', length - first - 2)]
+        elif indel < 0.1 and length > 20:
+            first = rng.randint(5, length - 5)
+            ops += [('M', first), ('D', rng.randint(1, 3)),
+                    ('M', length - first)]
+        else:
+            ops.append(('M', length))
+    if right_clip > 0:
+        ops.append(('S', right_clip))
+    return ops
+
+def make_read(rng, reference, pos, read_length, style, mismatch_rate):
+    r"""
+    The SEQ, CIGAR and MD fields of a read aligned at pos (1-based) in
+    reference.
+
+    Returns
+    -------
+    tuple of str (seq), str (cigar) and str (md), or None if the read runs off
+    the end of the reference
+    """
+    ops = make_ops(rng, read_length, style)
+    seq, md = [], []
+    matches = 0
+    ref_i = pos - 1
+    for op, reps in ops:
+        if op in 'SI':
+            seq.extend(rng.choice(BASES) for _ in range(reps))
+        elif op == 'N':
+            ref_i += reps
+        elif op == 'D':
+            md.append('{}^{}'.format(matches, reference[ref_i:ref_i+reps]))
+            matches = 0
+            ref_i += reps
+        elif op == 'M':
+            for ref_base in reference[ref_i:ref_i+reps]:
+                if rng.random() < mismatch_rate:
+                    seq.append(rng.choice(BASES.replace(ref_base, '')))
+                    md.append('{}{}'.format(matches, ref_base))
+                    matches = 0
+                else:
+                    seq.append(ref_base)
+                    matches += 1
+            ref_i += reps
+        if ref_i > len(reference):
+            return None
+    md.append(str(matches))
+    return ''.join(seq), \
+            ''.join('{}{}'.format(reps, op) for op, reps in ops), ''.join(md)
+
+def make_sam_lines(reference, rname, start, stop, *, depth, read_length,
+        style, mismatch_rate=0.01, seed=0):
+    r"""
+    SAM records (as bytes, without newlines) sorted by position, of reads
+    starting throughout [start - read_length, stop], so that [start, stop] is
+    covered about depth times.
+
+    Returns
+    -------
+    list of bytes
+    """
+    rng = random.Random(seed)
+    n_reads = depth * (stop - start + 1) // read_length
+    positions = sorted(rng.randint(max(start - read_length, 1), stop)
+            for _ in range(n_reads))
+    lines = []
+    for i, pos in enumerate(positions):
+        read = make_read(rng, reference, pos, read_length, style, mismatch_rate)
+        if read == None:
+            continue
+        seq, cigar, md = read
+        lines.append('r{}\t{}\t{}\t{}\t42\t{}\t*\t0\t0\t{}\t{}\tAS:i:0\tMD:Z:{}'
+                .format(i, rng.choice([0, 16]), rname, pos, cigar, seq,
+                    'I' * len(seq), md).encode())
+    return lines
+
+def write_reference(filename, rname, sequence, line_length=60):
+    r"""
+    Write sequence as a FASTA file, with its .fai index.
+    """
+    with open(filename, 'w') as fasta_file:
+        header = '>{}\n'.format(rname)
+        fasta_file.write(header)
+        for i in range(0, len(sequence), line_length):
+            fasta_file.write(sequence[i:i+line_length] + '\n')
+    with open(filename + '.fai', 'w') as index_file:
+        index_file.write('{}\t{}\t{}\t{}\t{}\n'.format(
+                rname, len(sequence), len(header), line_length,
+                line_length + 1))
@@ -17,6 +17,11 @@ class Alignment:
     # characters. There may be an additional delimiting '0' at he end if the
     # next token is a deletion.
     RE_MD_MISMATCH = re.compile(r'0?[A-Z](0[A-Z])*0?')
+    # Any of the above, tried in the same order, so that an MD string can be
+    # tokenised in a single scan.
+    RE_MD_TOKEN = re.compile(
+            r'(?P<match>[1-9]\d*)|(?P<deletion>\^[A-Z]+0?)|'
+            r'(?P<mismatch>0?[A-Z](?:0[A-Z])*0?)')
 
     def __init__(self, pos, cigar, md):
         self.pos = int(pos)
@@ -74,7 +79,7 @@ class Alignment:
             last_token = None if cigar_tokens == [] else cigar_tokens[-1]
             last_mapped = None if last_token == None or last_token[1] == None else \
                     last_token[1] + last_token[-1] - 1
-            if base.get_type() == Base.ONE_TO_ONE:
+            if base.type == Base.ONE_TO_ONE:
                 # if needs init, is new op, or was reference skip.
                 if last_token == None or \
                         last_token[0] != 'M' or \
@@ -82,12 +87,12 @@ class Alignment:
                     cigar_tokens.append(['M', base.ref_pos, base.rd_pos, 1])
                 else:
                     last_token[-1] += 1
-            elif base.get_type() == Base.INSERTION:
+            elif base.type == Base.INSERTION:
                 if last_token == None or last_token[0] != 'I':
                     cigar_tokens.append(['I', None, base.rd_pos, 1])
                 else:
                     last_token[-1] += 1
-            elif base.get_type() == Base.DELETION:
+            elif base.type == Base.DELETION:
                 if cigar_tokens == [] or \
                         last_token[0] != 'D' or \
                         base.ref_pos - last_mapped > 1:
@@ -138,11 +143,11 @@ class Alignment:
         # Collate all MD-relevant information
         for base in self.bases:
             last_md = None if md == [] else md[-1]
-            is_match = base.get_type() == Base.ONE_TO_ONE and \
+            is_match = base.type == Base.ONE_TO_ONE and \
                     base.rd_base == None
-            is_mismatch = base.get_type() == Base.ONE_TO_ONE and \
+            is_mismatch = base.type == Base.ONE_TO_ONE and \
                     base.rd_base != None
-            is_deletion = base.get_type() == Base.DELETION
+            is_deletion = base.type == Base.DELETION
 
             if is_deletion and base.ref_base == None:
                 raise RuntimeError(
@@ -256,41 +261,41 @@ class Alignment:
             elif op == 'N':
                 ref_pos += reps
 
-        # Obtain information from the MD field.
+        # Obtain information from the MD field. md_i is the MD token being
+        # read, and md_offset the number of bases already read from it.
         md = cls._parse_md(md)
+        md_i, md_offset = 0, 0
         for base in bases:
             # The MD field does not contain information about insertions (I) or
             # soft clips (S)
-            if base.get_type() == Base.INSERTION:
+            if base.type == Base.INSERTION:
                 continue
+            token = md[md_i]  # FIXME IndexError
             # MD contains no additional information about matches, carry on.
-            elif base.get_type() == Base.ONE_TO_ONE and \
-                    md[0][0] == cls.MD_MATCH:  # FIXME IndexError
-                md[0][1] -= 1
+            if base.type == Base.ONE_TO_ONE and \
+                    token[0] == cls.MD_MATCH:
+                pass
             # MD contains additional information about mismatches, which is the
             # base identity of the nucleotide on the read.
-            elif base.get_type() == Base.ONE_TO_ONE and \
-                    md[0][0] == cls.MD_MISMATCH:
-                base.rd_base = md[0][1]
-                md[0].pop(1)
+            elif base.type == Base.ONE_TO_ONE and \
+                    token[0] == cls.MD_MISMATCH:
+                base.rd_base = token[1+md_offset]
             # MD contains additional information about deletions, which is the
             # base identity of the nucleotide on the reference (which was
             # deleted from the read).
-            elif base.get_type() == Base.DELETION and \
-                    md[0][0] == cls.MD_DELETION:
-                base.ref_base = md[0][1]
-                md[0].pop(1)
+            elif base.type == Base.DELETION and \
+                    token[0] == cls.MD_DELETION:
+                base.ref_base = token[1+md_offset]
             else:
                 raise RuntimeError(
                         'CIGAR and MD fields do not match: ({}, {})'.format(
                             _cigar, _md))
 
-            # Now, remove information already read from the MD tokens.
-            if md[0][0] == cls.MD_MATCH and md[0][1] <= 0:
-                md = md[1:]
-            elif md[0][0] in (cls.MD_MISMATCH, cls.MD_DELETION) and \
-                    len(md[0]) <= 1:
-                md = md[1:]
+            # Now, move past MD tokens which have been read completely.
+            md_offset += 1
+            if md_offset >= (token[1] if token[0] == cls.MD_MATCH else
+                    len(token) - 1):
+                md_i, md_offset = md_i + 1, 0
 
         return bases, length
 
@@ -337,32 +342,32 @@ class Alignment:
         mismatched.
         """
         md_tokens = []
-        while md != '':
-            if cls.RE_MD_MATCH.match(md):
-                matching = cls.RE_MD_MATCH.match(md).group()
-                md_tokens.append([cls.MD_MATCH, int(matching)])
-                md = md.replace(matching, '', 1)
-            elif cls.RE_MD_DELETION.match(md):
-                matching = cls.RE_MD_DELETION.match(md).group()
-                md_tokens.append(
-                        [cls.MD_DELETION] + [
-                            b for b in matching if not b in ('^', '0')])
-                md = md.replace(matching, '', 1)
-            elif cls.RE_MD_MISMATCH.match(md):
-                matching = cls.RE_MD_MISMATCH.match(md).group()
+        cursor = 0  # end of the last token; tokens must follow one another
+        for matching in cls.RE_MD_TOKEN.finditer(md):
+            if matching.start() != cursor:
+                raise RuntimeError('Invalid MD string')
+            cursor = matching.end()
+
+            kind, token = matching.lastgroup, matching.group()
+            if kind == 'match':
+                md_tokens.append([cls.MD_MATCH, int(token)])
+            elif kind == 'deletion':
                 md_tokens.append(
-                        [cls.MD_MISMATCH] + [
-                            b for b in matching if not b == '0'])
-                md = md.replace(matching, '', 1)
+                        [cls.MD_DELETION] + list(token[1:].rstrip('0')))
             else:
-                raise RuntimeError('Invalid MD string')
+                md_tokens.append(
+                        [cls.MD_MISMATCH] + list(token.replace('0', '')))
+        if cursor != len(md):
+            raise RuntimeError('Invalid MD string')
 
         return md_tokens
 
 
 class Base:
     r"""
-    Represents a base of an alignment.
+    Represents a base of an alignment. One is created per aligned position, so
+    the attributes are slotted, and the type is stored rather than derived
+    every time it is needed.
 
     Attributes
     ----------
@@ -372,17 +377,30 @@ class Base:
     """
     ONE_TO_ONE, DELETION, INSERTION = 0, 1, 2
 
-    def __init__(self, rd_pos=None, ref_pos=None, rd_base=None, ref_base=None):
-        assert rd_pos == None or isinstance(rd_pos, int)
-        assert ref_pos == None or isinstance(ref_pos, int)
-        assert rd_base == None or isinstance(rd_base, str)
-        assert ref_base == None or isinstance(rd_base, str)
+    __slots__ = ('rd_pos', 'ref_pos', 'rd_base', 'ref_base', 'type')
 
+    def __init__(self, rd_pos=None, ref_pos=None, rd_base=None, ref_base=None):
         self.rd_pos = rd_pos
         self.ref_pos = ref_pos
         self.rd_base = rd_base
         self.ref_base = ref_base
 
+        if ref_pos != None and rd_pos != None:
+            self.type = self.ONE_TO_ONE
+        # Insertions into the reads, which are not present in the reference. 'I'
+        # in CIGAR, and unrepresented in MD.
+        elif rd_pos != None:
+            self.type = self.INSERTION
+        # Deletions from the reads, which are present in the reference. 'D' in
+        # CIGAR, and represented by tokens starting with '^' in MD.
+        elif ref_pos != None:
+            self.type = self.DELETION
+        else:
+            raise RuntimeError(
+                    'Invalid internal nucleotide base representation.\n'
+                    'rd_pos = {}, ref_pos = {}, rd_base = {}, ref_base = {}'
+                    .format(rd_pos, ref_pos, rd_base, ref_base))
+
     def get_type(self):
         r"""
         Get the type of base. Matches and mismatches are encoded as
@@ -396,22 +414,7 @@ class Base:
         -------
         int
         """
-        if self.ref_pos != None and self.rd_pos != None:
-            return self.ONE_TO_ONE
-        # Insertions into the reads, which are not present in the reference. 'I'
-        # in CIGAR, and unrepresented in MD.
-        elif self.ref_pos == None and self.rd_pos != None:
-            return self.INSERTION
-        # Deletions from the reads, which are present in the reference. 'D' in
-        # CIGAR, and represented by tokens starting with '^' in MD.
-        elif self.ref_pos != None:
-            return self.DELETION
-        else:
-            raise RuntimeError(
-                    'Invalid internal nucleotide base representation.\n'
-                    'rd_pos = {}, ref_pos = {}, rd_base = {}, ref_base = {}'
-                    .format(self.rd_pos, self.ref_pos, self.rd_base,
-                        self.ref_base))
+        return self.type
 
     def __eq__(self, other):
         return isinstance(other, Base) and \
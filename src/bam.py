@@ -0,0 +1,468 @@
+import binascii, logging, os, struct, zlib
+import clip, sam
+from alignment import ClippedRegionEmptyError
+
+logger = logging.getLogger('bedshape')
+
+# Parsed .bai indexes, by filename. Records are read through a new file handle
+# per ``File``, so that samples read concurrently do not share a position, but
+# the index is parsed only once per process.
+_indexes = {}
+
+def get_index_name(filename):
+    r"""
+    Get the .bai index of a BAM file (<name>.bam.bai, or <name>.bai), or None
+    if it has none.
+
+    Returns
+    -------
+    str, or None
+    """
+    for index_name in (filename + '.bai',
+            os.path.splitext(filename)[0] + '.bai'):
+        if os.path.isfile(index_name):
+            return index_name
+    return None
+
+def get_index(filename):
+    r"""
+    Get the (cached) ``Index`` of a BAM file.
+
+    Returns
+    -------
+    ``Index``
+    """
+    filename = os.path.abspath(filename)
+    if filename not in _indexes:
+        index_name = get_index_name(filename)
+        if index_name == None:
+            raise RuntimeError('No .bai index for {}'.format(filename))
+        _indexes[filename] = Index(index_name)
+    return _indexes[filename]
+
+def get_sort_order(header):
+    r"""
+    Get the sort order (SO) of the @HD line of a SAM header, or None if it has
+    none.
+
+    Returns
+    -------
+    str, or None
+    """
+    for line in header.rstrip(b'\x00').split(b'\n'):
+        if line.startswith(b'@HD\t'):
+            for field in line.rstrip(b'\r').split(b'\t')[1:]:
+                if field.startswith(b'SO:'):
+                    return field[3:].decode()
+    return None
+
+class BgzfReader:
+    """
+    Reads a BGZF (blocked gzip) file, as a sequence of decompressed blocks
+    addressed by virtual offsets (the compressed offset of a block, shifted
+    left by 16 bits, plus an offset within the decompressed block).
+    """
+
+    def __init__(self, filename):
+        self.file = open(filename, 'rb')
+        self.block_address = 0
+        self.next_block_address = 0
+        self.block = b''
+        self.block_offset = 0
+
+    def _load_block(self, address):
+        self.file.seek(address)
+        header = self.file.read(12)
+        if len(header) < 12:
+            self.block_address = self.next_block_address = address
+            self.block, self.block_offset = b'', 0
+            return
+        if header[:4] != b'\x1f\x8b\x08\x04':
+            raise RuntimeError('Not a BGZF block at offset {}'.format(address))
+
+        xlen, = struct.unpack('<H', header[10:12])
+        extra = self.file.read(xlen)
+        block_size = None
+        i = 0
+        while i < xlen:
+            subfield_id = extra[i:i+2]
+            subfield_length, = struct.unpack('<H', extra[i+2:i+4])
+            if subfield_id == b'BC':
+                block_size, = struct.unpack('<H', extra[i+4:i+6])
+            i += 4 + subfield_length
+        if block_size == None:
+            raise RuntimeError('No BGZF block size at offset {}'.format(address))
+
+        # The block is block_size + 1 bytes, ending in CRC32 and ISIZE.
+        data = self.file.read(block_size + 1 - 12 - xlen)
+        self.block = zlib.decompress(data[:-8], -15)
+        self.block_address = address
+        self.next_block_address = address + block_size + 1
+        self.block_offset = 0
+
+    def seek(self, virtual_offset):
+        address, offset = virtual_offset >> 16, virtual_offset & 0xffff
+        if address != self.block_address or self.block == b'':
+            self._load_block(address)
+        self.block_offset = offset
+
+    def tell(self):
+        # Virtual offsets point at the start of the next block, rather than at
+        # the end of the current one.
+        if self.block_offset == len(self.block) and self.block != b'':
+            return self.next_block_address << 16
+        return (self.block_address << 16) | self.block_offset
+
+    def read(self, size):
+        chunks = []
+        while size > 0:
+            if self.block_offset == len(self.block):
+                self._load_block(self.next_block_address)
+                if self.block == b'':
+                    break
+            chunk = self.block[self.block_offset:self.block_offset+size]
+            self.block_offset += len(chunk)
+            size -= len(chunk)
+            chunks.append(chunk)
+        return b''.join(chunks)
+
+    def close(self):
+        self.file.close()
+
+def reg2bins(beg, end):
+    r"""
+    Get the bins which may hold alignments overlapping [beg, end) (0-based),
+    as in the SAM specification.
+
+    Returns
+    -------
+    list of int
+    """
+    end -= 1
+    bins = [0]
+    for shift, first_bin in ((26, 1), (23, 9), (20, 73), (17, 585), (14, 4681)):
+        bins.extend(range(first_bin + (beg >> shift),
+                first_bin + (end >> shift) + 1))
+    return bins
+
+class Index:
+    """
+    Represents a .bai index. Only the bins and the linear index are kept; the
+    pseudo-bin of mapped/unmapped counts is skipped.
+    """
+
+    PSEUDO_BIN = 37450
+
+    def __init__(self, filename):
+        with open(filename, 'rb') as infile:
+            data = infile.read()
+        if data[:4] != b'BAI\x01':
+            raise RuntimeError('{} is not a BAI index'.format(filename))
+
+        self.bins = []  # per reference, dict of bin to list of chunks
+        self.intervals = []  # per reference, list of linear index offsets
+        n_ref, = struct.unpack_from('<i', data, 4)
+        i = 8
+        for _ in range(n_ref):
+            bins = {}
+            n_bin, = struct.unpack_from('<i', data, i)
+            i += 4
+            for _ in range(n_bin):
+                bin_id, n_chunk = struct.unpack_from('<Ii', data, i)
+                i += 8
+                chunks = struct.unpack_from('<{}Q'.format(2 * n_chunk), data, i)
+                i += 16 * n_chunk
+                if bin_id != self.PSEUDO_BIN:
+                    bins[bin_id] = list(zip(chunks[0::2], chunks[1::2]))
+            n_intv, = struct.unpack_from('<i', data, i)
+            i += 4
+            self.intervals.append(
+                    struct.unpack_from('<{}Q'.format(n_intv), data, i))
+            i += 8 * n_intv
+            self.bins.append(bins)
+
+    def query(self, tid, beg, end):
+        r"""
+        Get the chunks of virtual offsets which may hold alignments overlapping
+        [beg, end) (0-based) on reference tid, sorted and merged.
+
+        Returns
+        -------
+        list of tuples of int (begin) and int (end)
+        """
+        if tid >= len(self.bins):
+            return []
+        bins, intervals = self.bins[tid], self.intervals[tid]
+        min_offset = intervals[min(beg >> 14, len(intervals) - 1)] \
+                if intervals else 0
+
+        chunks = sorted(chunk for bin_id in reg2bins(beg, end)
+                for chunk in bins.get(bin_id, []) if chunk[1] > min_offset)
+        merged = []
+        for chunk_beg, chunk_end in chunks:
+            chunk_beg = max(chunk_beg, min_offset)
+            if merged != [] and chunk_beg <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], chunk_end)
+            else:
+                merged.append([chunk_beg, chunk_end])
+        return [tuple(chunk) for chunk in merged]
+
+class File:
+    """
+    Represents a coordinate-sorted, indexed BAM file, from which the alignments
+    overlapping a region are read as ``Record`` objects.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.index = get_index(filename)
+        self.reader = BgzfReader(filename)
+
+        if self.reader.read(4) != b'BAM\x01':
+            raise RuntimeError('{} is not a BAM file'.format(filename))
+        l_text, = struct.unpack('<i', self.reader.read(4))
+        # Alignments are read in file order, and reading stops at the first
+        # past the region, so the file must be sorted by coordinate. A header
+        # without a sort order is allowed, as by samtools index.
+        self.sort_order = get_sort_order(self.reader.read(l_text))
+        if self.sort_order not in (None, 'coordinate'):
+            raise RuntimeError('{} is not sorted by coordinate (SO:{})'.format(
+                    filename, self.sort_order))
+        n_ref, = struct.unpack('<i', self.reader.read(4))
+        self.rnames = []
+        for _ in range(n_ref):
+            l_name, = struct.unpack('<i', self.reader.read(4))
+            self.rnames.append(self.reader.read(l_name)[:-1])
+            self.reader.read(4)
+        self.tids = {rname.decode(): tid for tid, rname in enumerate(self.rnames)}
+
+    def fetch(self, rname, start, stop):
+        r"""
+        Read the alignments overlapping [start, stop] (1-based, inclusive) in
+        rname, as samtools view does.
+
+        Returns
+        -------
+        generator of ``Record``
+        """
+        if rname not in self.tids:
+            return
+        tid = self.tids[rname]
+        last_pos = -1
+        for chunk_beg, chunk_end in self.index.query(tid, start - 1, stop):
+            self.reader.seek(chunk_beg)
+            while self.reader.tell() < chunk_end:
+                block_size = self.reader.read(4)
+                if len(block_size) < 4:
+                    return
+                data = self.reader.read(struct.unpack('<i', block_size)[0])
+                ref_id, pos = struct.unpack_from('<ii', data)
+                if ref_id == tid and pos < last_pos:
+                    raise RuntimeError('{} is not sorted by coordinate ({} '
+                            'at {}:{} follows {}:{})'.format(self.filename,
+                            Record(data, self.rnames).name, rname, pos + 1,
+                            rname, last_pos + 1))
+                last_pos = pos
+                # Alignments are sorted by position, so none further on overlap.
+                if ref_id != tid or pos + 1 > stop:
+                    return
+                record = Record(data, self.rnames)
+                if record.last >= start:
+                    yield record
+
+    def close(self):
+        self.reader.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+# Decoding tables for SEQ (via its hexadecimal representation) and QUAL.
+SEQ_TABLE = bytes.maketrans(b'0123456789abcdef', b'=ACMGRSVTWYHKDBN')
+QUAL_TABLE = bytes((i + 33) & 0xff for i in range(256))
+CIGAR_OPS = 'MIDNSHP=X'
+
+# Sizes of tag values, by type; Z and H values end in NUL, and B values are
+# arrays.
+TAG_SIZES = {b'A': 1, b'c': 1, b'C': 1, b's': 2, b'S': 2, b'i': 4, b'I': 4,
+        b'f': 4}
+TAG_FORMATS = {b'c': 'b', b'C': 'B', b's': 'h', b'S': 'H', b'i': 'i',
+        b'I': 'I', b'f': 'f'}
+
+class Record:
+    """
+    Represents an alignment in a BAM file. Only the fields needed to clip the
+    alignment (position, CIGAR and MD tag) are decoded when it is read; the
+    others are formatted as SAM text when the record is written.
+    """
+
+    # As ``sam.Line``; BAM headers are not records.
+    type = sam.Line.TYPE_ALIGNMENT
+
+    def __init__(self, data, rnames):
+        (ref_id, pos, self.l_read_name, self.mapq, _, n_cigar_op, self.flag,
+                self.l_seq, self.next_ref_id, next_pos, self.tlen) = \
+                struct.unpack_from('<iiBBHHHiiii', data)
+        self.data = data
+        self.rnames = rnames
+        self.rname = rnames[ref_id]
+        self.rnext = b'*' if self.next_ref_id == -1 else \
+                b'=' if self.next_ref_id == ref_id else \
+                rnames[self.next_ref_id]
+        self.pos, self.pnext = pos + 1, next_pos + 1
+
+        # Alignments without a CIGAR are kept as '*', so that they may be
+        # counted as unmapped by ``Stream``.
+        cigar_start = 32 + self.l_read_name
+        self.cigar = [(CIGAR_OPS[v & 0xf], v >> 4) for v in struct.unpack_from(
+                '<{}I'.format(n_cigar_op), data, cigar_start)] \
+                if n_cigar_op > 0 else '*'
+        self.seq_start = cigar_start + 4 * n_cigar_op
+        self.tags_start = self.seq_start + (self.l_seq + 1) // 2 + self.l_seq
+        self.last = clip.reference_span(self.pos, self.cigar)[1]
+        self._md = None
+
+    @property
+    def name(self):
+        return self.data[32:32+self.l_read_name-1].decode()
+
+    @property
+    def seq(self):
+        if self.l_seq == 0:
+            return b'*'
+        return binascii.hexlify(self.data[self.seq_start:
+                self.seq_start+(self.l_seq+1)//2]) \
+                .translate(SEQ_TABLE)[:self.l_seq]
+
+    @property
+    def qual(self):
+        if self.l_seq == 0:
+            return b'*'
+        qual = self.data[self.tags_start-self.l_seq:self.tags_start]
+        return b'*' if qual[0] == 0xff else qual.translate(QUAL_TABLE)
+
+    @property
+    def md(self):
+        if self._md == None:
+            for tag, tag_type, value_start, value_end in self._iter_tags():
+                if tag == b'MD' and tag_type == b'Z':
+                    self._md = self.data[value_start:value_end-1].decode()
+                    break
+            else:
+                raise RuntimeError('No MD tag for {}'.format(self.name))
+        return self._md
+
+    @md.setter
+    def md(self, md):
+        self._md = md
+
+    def _iter_tags(self):
+        r"""
+        Iterate over the optional fields, without decoding their values.
+
+        Returns
+        -------
+        generator of tuples of bytes (tag), bytes (type), int (start of value)
+        and int (end of value)
+        """
+        data = self.data
+        i = self.tags_start
+        while i < len(data):
+            tag, tag_type = data[i:i+2], data[i+2:i+3]
+            i += 3
+            if tag_type in (b'Z', b'H'):
+                end = data.index(b'\x00', i) + 1
+            elif tag_type == b'B':
+                subtype = data[i:i+1]
+                count, = struct.unpack_from('<i', data, i + 1)
+                end = i + 5 + TAG_SIZES[subtype] * count
+            else:
+                end = i + TAG_SIZES[tag_type]
+            yield tag, tag_type, i, end
+            i = end
+
+    def soft_clip(self, start, stop):
+        r"""
+        Soft-clip the alignment to [start, stop], as ``sam.Line.soft_clip``.
+        """
+        overlap = clip.get_overlap(self.pos, self.cigar, start, stop)
+        if overlap == clip.OVERLAP_NONE:
+            raise ClippedRegionEmptyError
+
+        # As in ``sam.Line.strip_paired_end_info``.
+        self.flag &= 0b00111100
+        self.rnext, self.pnext, self.tlen = b'*', 0, 0
+
+        if overlap == clip.OVERLAP_CONTAINED:
+            self.pos = self.pos - start + 1
+        else:
+            self.pos, self.cigar, self.md = clip.soft_clip(
+                    self.pos, self.cigar, self.md, start, stop)
+        self.rname = b'%s:%d-%d' % (self.rname, start, stop)
+
+    def _format_tags(self):
+        data = self.data
+        tags = []
+        for tag, tag_type, value_start, value_end in self._iter_tags():
+            if tag_type in (b'Z', b'H'):
+                if tag == b'MD' and tag_type == b'Z' and self._md != None:
+                    value = self._md.encode()
+                else:
+                    value = data[value_start:value_end-1]
+            elif tag_type == b'A':
+                value = data[value_start:value_end]
+            elif tag_type == b'B':
+                subtype = data[value_start:value_start+1]
+                count = (value_end - value_start - 5) // TAG_SIZES[subtype]
+                values = struct.unpack_from(
+                        '<{}{}'.format(count, TAG_FORMATS[subtype]),
+                        data, value_start + 5)
+                value = b','.join([subtype] + [
+                        (b'%g' if subtype == b'f' else b'%d') % v
+                        for v in values])
+            else:
+                value, = struct.unpack_from(
+                        '<' + TAG_FORMATS[tag_type], data, value_start)
+                value = (b'%g' if tag_type == b'f' else b'%d') % value
+                tag_type = b'f' if tag_type == b'f' else b'i'
+            tags.append(b'%s:%s:%s' % (tag, tag_type, value))
+        return tags
+
+    def __bytes__(self):
+        data = self.data
+        cigar = self.cigar if isinstance(self.cigar, str) else \
+                ''.join('{}{}'.format(reps, op) for op, reps in self.cigar)
+        return b'\t'.join([
+                data[32:32+self.l_read_name-1], b'%d' % self.flag,
+                self.rname, b'%d' % self.pos, b'%d' % self.mapq,
+                cigar.encode(), self.rnext, b'%d' % self.pnext,
+                b'%d' % self.tlen, self.seq, self.qual] +
+                self._format_tags())
+
+    def __repr__(self):
+        return bytes(self).decode()
+
+class Stream(sam.Stream):
+    """
+    Represents the alignments of a BAM file overlapping a region, which are
+    decoded, soft-clipped and written as SAM text one at a time, as
+    ``sam.Stream`` does for SAM text.
+    """
+
+    def __init__(self, bam_file, rname, start, stop, downsampler=None):
+        super().__init__(bam_file.fetch(rname, start, stop), start, stop,
+                downsampler=downsampler)
+        self.bam_file = bam_file
+        self.rname = rname
+
+    def read(self):
+        for record in self.iterable_lines:
+            self.total_lines += 1
+            if record.cigar == '*':
+                self.lines_unmapped += 1
+                logger.debug('skipped {} (no mapping information)'.format(
+                        record.name))
+                continue
+            yield record
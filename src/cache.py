@@ -0,0 +1,157 @@
+import functools, hashlib, json, logging, os, shutil, subprocess, tempfile
+import constants
+
+logger = logging.getLogger('bedshape')
+
+# Bumped whenever the clipping or counting of a sample changes, so that counts
+# from an older bedshape are not reused.
+CACHE_VERSION = 1
+
+# Extensions of the index files samtools reads alongside an alignment, as
+# <name>.bam.bai or <name>.bai.
+INDEX_EXTENSIONS = ['.bai', '.csi', '.crai']
+
+def get_file_identity(filename):
+    r"""
+    Identify a file by its absolute path, size and modification time, rather
+    than by its contents, which would have to be read in full.
+
+    Returns
+    -------
+    list of str (path), int (size) and int (mtime, in ns)
+    """
+    stat = os.stat(filename)
+    return [os.path.abspath(filename), stat.st_size, stat.st_mtime_ns]
+
+def get_index_identities(alignment):
+    r"""
+    Identify the index files of alignment (see ``get_file_identity``). Whether
+    an alignment is indexed decides whether samtools view can extract a region
+    of it at all, so the counts depend on them too.
+
+    Returns
+    -------
+    list of identities
+    """
+    index_names = dict.fromkeys(name + extension
+            for name in (alignment, os.path.splitext(alignment)[0])
+            for extension in INDEX_EXTENSIONS)
+    return [get_file_identity(index_name) for index_name in index_names
+            if os.path.isfile(index_name)]
+
+@functools.lru_cache(maxsize=None)
+def get_tool_versions():
+    r"""
+    Get the versions of the tools which clip and count a sample: samtools (as
+    reported by samtools --version), and the shapemapper2 binaries (which
+    report no version, so are identified as files).
+
+    Returns
+    -------
+    dict of str (tool) to version
+    """
+    try:
+        samtools_version = subprocess.run(['samtools', '--version'],
+                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                universal_newlines=True).stdout.split('\n')[0]
+    except OSError:
+        samtools_version = None
+
+    versions = {'bedshape': CACHE_VERSION, 'samtools': samtools_version}
+    for tool in (constants.MUT_PARSER_BIN, constants.MUT_COUNTER_BIN):
+        versions[os.path.basename(tool)] = get_file_identity(tool) \
+                if os.path.isfile(tool) else None
+    return versions
+
+class CountsCache:
+    """
+    Represents a persistent, content-addressed cache of the .counts files of
+    samples. Entries are evicted least recently used first once the cache
+    grows past max_bytes; using an entry updates its modification time.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = os.path.abspath(directory)
+        self.max_bytes = max_bytes
+
+    def get_key(self, alignment, region, *, min_mapq, downsampling=None,
+            native_counts=False):
+        r"""
+        Get the key of the counts of alignment over region, which covers
+        everything the counts depend on, including the index files of
+        alignment. downsampling is the options of the ``sam.Downsampler`` the
+        reads were downsampled with, if any, and native_counts whether the
+        counts were made by ``counts.Counter``.
+
+        Returns
+        -------
+        str
+        """
+        key = json.dumps({
+                'alignment': get_file_identity(alignment),
+                'indexes': get_index_identities(alignment),
+                'region': region,
+                'min_mapq': min_mapq,
+                'downsampling': downsampling,
+                'native_counts': native_counts,
+                'tools': get_tool_versions()}, sort_keys=True)
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def get_entry_name(self, key):
+        return os.path.join(self.directory, '{}.counts'.format(key))
+
+    def fetch(self, key, out_name):
+        r"""
+        Copy the counts cached under key to out_name.
+
+        Returns
+        -------
+        bool (whether the counts were cached)
+        """
+        entry_name = self.get_entry_name(key)
+        try:
+            shutil.copyfile(entry_name, out_name)
+            os.utime(entry_name)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def store(self, key, counts_name):
+        r"""
+        Cache the counts in counts_name under key, then evict entries until the
+        cache fits in max_bytes.
+        """
+        if counts_name == None or not os.path.isfile(counts_name):
+            return
+        os.makedirs(self.directory, exist_ok=True)
+
+        # Written under a temporary name first, so that other processes never
+        # read a partial entry.
+        fd, tmp_name = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        os.close(fd)
+        shutil.copyfile(counts_name, tmp_name)
+        os.replace(tmp_name, self.get_entry_name(key))
+
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith('.counts'):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+
+        total_bytes = sum(map(lambda e: e[1], entries))
+        for _, size, path in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                logger.debug('evicted {} from the cache'.format(path))
+            except FileNotFoundError:
+                pass
+            total_bytes -= size
@@ -1,6 +1,7 @@
 #! /usr/bin/env python3
 
 import argparse, logging, re, sys
+import constants
 
 logger = logging.getLogger('bedshape')
 
@@ -84,13 +85,99 @@ def config_profile(parser):
             help='Maximum background mutation rate to be passed to '
                 "shapemapper2's make_reactivity_profile.py and"
                 'render_figures.py. Should be a float between 0 and 1.')
+    parser.add_argument('--shared-norm', action='store_true', default=False,
+            help='If specified with a BED file, will normalise all regions by '
+                'a single factor calculated over the profiles of all regions, '
+                'instead of one factor per region.')
     parser.add_argument('--skip-plot', action='store_true', default=False,
             help='If specified, will not run render_figures.py (i.e. no '
                 'reactivity plot will be produced.')
+    parser.add_argument('--plot', default='each',
+            choices=['each', 'batch', 'combined', 'png'],
+            help='How reactivity plots are rendered: by render_figures.py for '
+                'each region as it finishes (each), or after all regions '
+                'finish, in this process, as a PDF per region (batch), a '
+                'single multi-page PDF of all regions (combined), or a '
+                'rasterised PNG per region, which is the fastest (png).')
     parser.add_argument('--skip-shape', action='store_true', default=False,
             help='If specified, will not run tab_to_shape.py (i.e. no '
                 'shape file will be produced.')
 
+    parser.add_argument('--jobs', '-j', type=int, default=1,
+            help='Number of regions to profile in parallel, each in its own '
+                'process.')
+
+    parser.add_argument('--pipe', action='store_true', default=False,
+            help='If specified, will stream samtools output through the '
+                'clipper and shapemapper2 binaries via pipes, instead of '
+                'writing intermediate files. Ignored if --keep is specified.')
+
+    parser.add_argument('--batch', action='store_true', default=False,
+            help='If specified, will extract all regions from each alignment '
+                'with a single samtools view, instead of one per region. '
+                'Useful with BED files of many small regions.')
+
+    parser.add_argument('--native-bam', action='store_true', default=False,
+            help='If specified, will read indexed BAM files directly, instead '
+                'of through samtools view. Alignments without a .bai index '
+                'are still read through samtools view.')
+
+    parser.add_argument('--native-counts', action='store_true',
+            default=False,
+            help='If specified, will count mutations in-process, instead of '
+                'with shapemapper_mutation_parser and '
+                'shapemapper_mutation_counter. No clipped SAM or .mut files '
+                'are written.')
+
+    parser.add_argument('--in-process', action='store_true', default=False,
+            help='If specified, will run shapemapper2\'s '
+                'make_reactivity_profiles.py and tab_to_shape.py in this '
+                'process, instead of starting an interpreter for each region. '
+                'Scripts which fail in-process are run again in a subprocess. '
+                'Figures rendered with --plot each are still rendered in a '
+                'subprocess, in the background.')
+
+    parser.add_argument('--max-memory', type=int,
+            help='If specified, will count regions too long to count within '
+                'about this much memory (in MiB) in overlapping windows, one '
+                'at a time.')
+
+    parser.add_argument('--max-reads', type=int,
+            help='If specified, will keep at most this many reads of each '
+                'sample per region, sampled at random, before clipping.')
+
+    parser.add_argument('--target-depth', type=int,
+            help='If specified, will downsample the reads of each sample '
+                'per region, before clipping, so that the depth is at most '
+                'about this where reads start.')
+
+    parser.add_argument('--seed', type=int, default=0,
+            help='Seed for --max-reads and --target-depth, which downsample '
+                'the same reads given the same seed.')
+
+    parser.add_argument('--no-cache', action='store_true', default=False,
+            help='If specified, will neither use nor update the cache of '
+                'sample counts from earlier runs.')
+
+    parser.add_argument('--cache-dir', default=constants.CACHE_DIR,
+            help='Directory of the cache of sample counts. Defaults to '
+                '$BEDSHAPE_CACHE_DIR, or ~/.cache/bedshape.')
+
+    parser.add_argument('--cache-size', type=int, default=1024,
+            help='Maximum size of the cache of sample counts, in MiB. The '
+                'least recently used counts are evicted first.')
+
+    parser.add_argument('--stages', action='store_true', default=False,
+            help='If specified, will record the wall time, CPU time, peak '
+                'RSS and bytes in and out of every stage of every region, '
+                'into <region>.stages.json and bedshape-stages.tsv in the '
+                'output directory.')
+
+    parser.add_argument('--resume', type=str,
+            help='Output directory of an earlier run to resume. Only the '
+                'regions without complete outputs from the same inputs and '
+                'options are profiled. Overrides --outdir.')
+
     parser.add_argument('--outdir', '-o', default='./',
             help='Directory to place output files within.')
     parser.add_argument('--keep', '-k', action='store_true', default=False,
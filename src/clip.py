@@ -0,0 +1,265 @@
+import logging, re
+from alignment import Alignment, CigarUnavailableError, \
+        ClippedRegionEmptyError
+
+logger = logging.getLogger('bedshape')
+
+RE_CIGAR = re.compile(r'(\d+)([MIDNSHP=X])')
+
+def get_cigar_tokens(cigar):
+    r"""
+    Tokenise a CIGAR string, as ``Alignment._parse_cigar``. The functions of
+    this module take either CIGAR strings or their tokens, so that CIGARs which
+    are already tokenised (e.g. from BAM records) need not be formatted and
+    parsed again.
+
+    Returns
+    -------
+    list of two-element tuples of str (op) and int (reps)
+    """
+    if not isinstance(cigar, str):
+        return cigar
+    return [(op, int(reps)) for reps, op in RE_CIGAR.findall(cigar)]
+
+def reference_span(pos, cigar):
+    r"""
+    Get the first and last reference positions covered by an alignment,
+    including deletions and reference skips. Alignments without a CIGAR are
+    taken to cover only their position, as samtools does.
+
+    Returns
+    -------
+    tuple of int (first) and int (last)
+    """
+    pos = int(pos)
+    if cigar == '*':
+        return pos, pos
+    length = sum(map(lambda t: t[1],
+            filter(lambda t: t[0] in 'MDN=X', get_cigar_tokens(cigar))))
+    return pos, pos + max(length, 1) - 1
+
+OVERLAP_NONE, OVERLAP_CONTAINED, OVERLAP_PARTIAL = 0, 1, 2
+
+def get_overlap(pos, cigar, start, stop):
+    r"""
+    Find how an alignment overlaps the reference region [start, stop] from its
+    position and CIGAR alone. An alignment is ``OVERLAP_CONTAINED`` if it lies
+    within the region, starts and ends on aligned (not inserted or deleted)
+    bases, and has only M, I, D, N and S operations, so that soft-clipping it
+    would leave its CIGAR and MD unchanged (``soft_clip`` writes '=' and 'X'
+    as 'M', and drops 'H' and 'P').
+
+    Returns
+    -------
+    int (one of ``OVERLAP_NONE``, ``OVERLAP_CONTAINED`` or ``OVERLAP_PARTIAL``)
+    """
+    first, last = reference_span(pos, cigar)
+    if last < start or first > stop:
+        return OVERLAP_NONE
+    if first < start or last > stop:
+        return OVERLAP_PARTIAL
+
+    ops = [op for op, _ in get_cigar_tokens(cigar)]
+    if any(map(lambda op: op not in 'MIDNS', ops)):
+        return OVERLAP_PARTIAL
+    ops = [op for op in ops if op != 'S']
+    if ops[0] == 'M' and ops[-1] == 'M':
+        return OVERLAP_CONTAINED
+    return OVERLAP_PARTIAL
+
+def soft_clip(pos, cigar, md, start, stop):
+    r"""
+    Soft-clip an alignment to the reference region [start, stop] by working on
+    the run-length tokens of its CIGAR and MD fields, rather than on one
+    ``Base`` per aligned position. The result is that of
+    ``Alignment.soft_clip``.
+
+    Returns
+    -------
+    tuple of int (pos), str (cigar) and str (md)
+    """
+    runs, length = get_runs(int(pos), cigar, md)
+    runs = _clip_runs(runs, start, stop)
+
+    # Only insertions or deletions remain; nothing is mappable.
+    if runs == [] or all(map(lambda r: r[1] == None or r[2] == None, runs)):
+        raise ClippedRegionEmptyError
+
+    return runs[0][2] - start + 1, _get_cigar(runs, length), _get_md(runs)
+
+def get_runs(pos, cigar, md):
+    r"""
+    Obtain a run representation of an alignment from its SAM position, CIGAR,
+    and MD fields. Each run is a list of ``[op, rd_pos, ref_pos, reps, bases]``,
+    where op is one of 'M' (matches), 'X' (mismatches), 'I' (insertions) or
+    'D' (deletions). For mismatches and deletions, bases holds the base
+    identities from the MD field; otherwise, it is ``None``.
+
+    Returns
+    -------
+    tuple of list of runs, and int (the read length)
+    """
+    _cigar, _md = cigar, md
+    if cigar == '*':
+        raise CigarUnavailableError
+    cigar = get_cigar_tokens(cigar)
+    md = Alignment._parse_md(md)
+    length = sum(map(lambda t: t[1],
+            filter(lambda t: t[0] in 'MIS=X', cigar)))
+
+    md_i, md_offset = 0, 0  # cursor into the MD tokens
+    rd_pos = 1
+    ref_pos = pos
+    runs = []
+    for op, reps in cigar:
+        if op in ('H', 'P'):
+            continue
+        elif op == 'S':
+            rd_pos += reps
+        elif op == 'N':
+            ref_pos += reps
+        elif op == 'I':
+            runs.append(['I', rd_pos, None, reps, None])
+            rd_pos += reps
+        elif op in ('M', '=', 'X', 'D'):
+            # Split the CIGAR token over as many MD tokens as it spans.
+            while reps > 0:
+                if md_i >= len(md):
+                    raise RuntimeError(
+                            'CIGAR and MD fields do not match: ({}, {})'.format(
+                                _cigar, _md))
+                md_op = md[md_i][0]
+                if op == 'D' and md_op == Alignment.MD_DELETION:
+                    available = len(md[md_i]) - 1 - md_offset
+                    n = min(reps, available)
+                    bases = ''.join(md[md_i][1+md_offset:1+md_offset+n])
+                    runs.append(['D', None, ref_pos, n, bases])
+                elif op != 'D' and md_op == Alignment.MD_MISMATCH:
+                    available = len(md[md_i]) - 1 - md_offset
+                    n = min(reps, available)
+                    bases = ''.join(md[md_i][1+md_offset:1+md_offset+n])
+                    runs.append(['X', rd_pos, ref_pos, n, bases])
+                elif op != 'D' and md_op == Alignment.MD_MATCH:
+                    available = md[md_i][1] - md_offset
+                    n = min(reps, available)
+                    runs.append(['M', rd_pos, ref_pos, n, None])
+                else:
+                    raise RuntimeError(
+                            'CIGAR and MD fields do not match: ({}, {})'.format(
+                                _cigar, _md))
+
+                if op != 'D':
+                    rd_pos += n
+                ref_pos += n
+                reps -= n
+                if n == available:
+                    md_i, md_offset = md_i + 1, 0
+                else:
+                    md_offset += n
+
+    return runs, length
+
+def _clip_runs(runs, start, stop):
+    r"""
+    Keep only the runs (or parts of runs) which map to the reference region
+    [start, stop]. Insertions are kept only if they follow a kept reference
+    base, and precede any reference base past the region.
+
+    Returns
+    -------
+    list of runs
+    """
+    clipped = []
+    for op, rd_pos, ref_pos, reps, bases in runs:
+        if ref_pos == None:
+            if clipped != []:
+                clipped.append([op, rd_pos, ref_pos, reps, bases])
+            continue
+        if ref_pos > stop:
+            break
+        if ref_pos + reps - 1 < start:
+            continue
+
+        first = max(ref_pos, start)
+        last = min(ref_pos + reps - 1, stop)
+        offset, n = first - ref_pos, last - first + 1
+        clipped.append([
+                op,
+                None if rd_pos == None else rd_pos + offset,
+                first,
+                n,
+                None if bases == None else bases[offset:offset+n]])
+
+        # This run continues past the region.
+        if last < ref_pos + reps - 1:
+            break
+
+    return clipped
+
+def _get_cigar(runs, length):
+    cigar_tokens = []
+
+    # Collapse runs into CIGAR operations, as in ``Alignment.get_cigar``.
+    for op, rd_pos, ref_pos, reps, _ in runs:
+        last_token = None if cigar_tokens == [] else cigar_tokens[-1]
+        cigar_op = 'M' if op == 'X' else op
+        if last_token != None and last_token[0] == cigar_op and \
+                (op == 'I' or ref_pos == last_token[1] + last_token[-1]):
+            last_token[-1] += reps
+        else:
+            cigar_tokens.append([cigar_op, ref_pos, rd_pos, reps])
+
+    cigar_string = []
+    last_mapped_ref_pos = None
+    for token in cigar_tokens:
+        # Detect reference skips ('N')
+        if last_mapped_ref_pos != None and token[1] != None and \
+                token[1] - last_mapped_ref_pos > 1:
+            cigar_string.append('{}N'.format(
+                token[1] - last_mapped_ref_pos - 1))
+        cigar_string.append('{}{}'.format(token[-1], token[0]))
+        if token[0] in ('M', 'D'):
+            last_mapped_ref_pos = token[1] + token[-1] - 1
+
+    # 'Pad' the CIGAR string with soft clips.
+    mapped_tokens = list(filter(lambda t: t[2] != None, cigar_tokens))
+    left_soft_clip_reps = mapped_tokens[0][2] - 1
+    right_soft_clip_reps = length - (mapped_tokens[-1][2] +
+            mapped_tokens[-1][-1] - 1)
+    if left_soft_clip_reps != 0:
+        cigar_string.insert(0, '{}S'.format(left_soft_clip_reps))
+    if right_soft_clip_reps != 0:
+        cigar_string.append('{}S'.format(right_soft_clip_reps))
+
+    return ''.join(cigar_string)
+
+def _get_md(runs):
+    md = []
+
+    # Collate all MD-relevant information; insertions are not represented.
+    for op, _, _, reps, bases in runs:
+        if op == 'I':
+            continue
+        if md != [] and md[-1][0] == op:
+            md[-1][1] += reps if op == 'M' else bases
+        else:
+            md.append([op, reps if op == 'M' else bases])
+
+    # Each op is guaranteed different from the last. Mismatches and deletions
+    # which follow each other are delimited by a '0'.
+    md_tokens = []
+    last_op = None
+    for op, payload in md:
+        if op == 'M':
+            md_tokens.append(str(payload))
+        elif op == 'X':
+            if last_op == 'D':
+                md_tokens.append('0')
+            md_tokens.append('0'.join(payload))
+        elif op == 'D':
+            if last_op == 'X':
+                md_tokens.append('0')
+            md_tokens.append('^{}'.format(payload))
+        last_op = op
+
+    return ''.join(md_tokens)
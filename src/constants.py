@@ -4,10 +4,17 @@ import os
 
 THIS_DIR = os.path.dirname(os.path.realpath(__file__))
 
-MUT_PARSER_BIN = os.path.join(THIS_DIR, 'shapemapper_mutation_parser')
-MUT_COUNTER_BIN = os.path.join(THIS_DIR, 'shapemapper_mutation_counter')
+# The shapemapper2 binaries and scripts are copied into src/ by make, but may
+# be taken from elsewhere (e.g. stand-ins, for benchmarks).
+BIN_DIR = os.environ.get('BEDSHAPE_BIN_DIR', THIS_DIR)
 
-PROFILER_BIN = os.path.join(THIS_DIR, 'make_reactivity_profiles.py')
-NORMALISER_BIN = os.path.join(THIS_DIR, 'normalize_profiles.py')
-RENDERER_BIN = os.path.join(THIS_DIR, 'render_figures.py')
-TAB2SHAPE_BIN = os.path.join(THIS_DIR, 'tab_to_shape.py')
+MUT_PARSER_BIN = os.path.join(BIN_DIR, 'shapemapper_mutation_parser')
+MUT_COUNTER_BIN = os.path.join(BIN_DIR, 'shapemapper_mutation_counter')
+
+PROFILER_BIN = os.path.join(BIN_DIR, 'make_reactivity_profiles.py')
+NORMALISER_BIN = os.path.join(BIN_DIR, 'normalize_profiles.py')
+RENDERER_BIN = os.path.join(BIN_DIR, 'render_figures.py')
+TAB2SHAPE_BIN = os.path.join(BIN_DIR, 'tab_to_shape.py')
+
+CACHE_DIR = os.environ.get('BEDSHAPE_CACHE_DIR', os.path.join(
+        os.path.expanduser('~'), '.cache', 'bedshape'))
@@ -0,0 +1,278 @@
+import bisect, itertools, logging
+import numpy as np
+import clip, sam
+
+logger = logging.getLogger('bedshape')
+
+# The columns of the .counts files written by shapemapper_mutation_counter,
+# which make_reactivity_profiles.py reads. Mutations are classed by their
+# reference and read bases: 'AT' is an A read as a T, 'A-' a deleted A, and
+# '-A' an inserted A.
+MUTATION_CLASSES = ['A-', 'T-', 'G-', 'C-', '-A', '-T', '-G', '-C', '-N',
+        'AT', 'AG', 'AC', 'TA', 'TG', 'TC', 'GA', 'GT', 'GC', 'CA', 'CT', 'CG',
+        'multinuc_deletion', 'multinuc_insertion', 'multinuc_mismatch',
+        'complex_deletion', 'complex_insertion']
+DEPTH_COLUMNS = ['read_depth', 'effective_depth', 'off_target_mapped_depth',
+        'low_mapq_mapped_depth', 'mapped_depth']
+READ_DEPTH, EFFECTIVE_DEPTH, OFF_TARGET_MAPPED_DEPTH, LOW_MAPQ_MAPPED_DEPTH, \
+        MAPPED_DEPTH = range(len(DEPTH_COLUMNS))
+
+CLASS_INDICES = {c: i for i, c in enumerate(MUTATION_CLASSES)}
+BASES = 'ACGT'
+
+class Counter:
+    """
+    Counts the mutations and depths of clipped alignments at each position of
+    a region, as shapemapper_mutation_parser and shapemapper_mutation_counter
+    do from a clipped SAM file, but in-process, from the runs of each
+    alignment (see ``clip.get_runs``).
+
+    Mismatches, deletions and insertions which follow one another (with no
+    matched base between them) make up a single mutation, which is counted at
+    its 3'-most reference position; for an insertion, that is the reference
+    position after it. The other positions of a mutation are excluded from the
+    effective depth, as are positions of bases with qualities below min_qual,
+    or which are not called. Alignments with mapping qualities below min_mapq
+    only count towards the low MAPQ and mapped depths.
+    """
+
+    # Pending positions are added to the arrays in batches of about this many.
+    FLUSH_SIZE = 2**20
+
+    def __init__(self, length, *, min_mapq=0, min_qual=0):
+        self.length = length
+        self.min_mapq, self.min_qual = min_mapq, min_qual
+        self.mutations = np.zeros((len(MUTATION_CLASSES), length),
+                dtype=np.int64)
+        self.depths = np.zeros((len(DEPTH_COLUMNS), length), dtype=np.int64)
+
+        # Pending flat indices into mutations, into the differences of depths
+        # (in rows of length + 1) where coverage starts and ends, and of
+        # positions excluded from the effective depth.
+        self._mutations = []
+        self._depth_starts, self._depth_ends = [], []
+        self._excluded = []
+
+    def count(self, lines):
+        r"""
+        Count each of lines, e.g. from a ``sam.Stream``, skipping header lines.
+        """
+        for line in lines:
+            if line.type == sam.Line.TYPE_HEADER:
+                continue
+            self.add(line)
+        self.flush()
+
+    def add(self, line):
+        r"""
+        Count a clipped alignment, which has a position, CIGAR, MD, mapping
+        quality, sequence and qualities (e.g. ``sam.Line`` or ``bam.Record``).
+        """
+        runs, _ = clip.get_runs(line.pos, line.cigar, line.md)
+        low_mapq = line.mapq < self.min_mapq
+        for first, last in self._get_segments(runs):
+            for column in (MAPPED_DEPTH, LOW_MAPQ_MAPPED_DEPTH if low_mapq
+                    else READ_DEPTH):
+                self._depth_starts.append(column * (self.length + 1) + first - 1)
+                self._depth_ends.append(column * (self.length + 1) + last)
+        if low_mapq:
+            return
+
+        seq = line.seq.decode().upper()
+        low_quality = self._get_low_quality(seq, line.qual)
+        excluded = set()
+        if low_quality != []:
+            for op, rd_pos, ref_pos, reps, _ in runs:
+                if op != 'M':
+                    continue
+                lo = bisect.bisect_left(low_quality, rd_pos)
+                hi = bisect.bisect_left(low_quality, rd_pos + reps)
+                excluded.update(ref_pos + p - rd_pos
+                        for p in low_quality[lo:hi])
+
+        group_start = None
+        for i, run in enumerate(runs + [None]):
+            if run != None and run[0] != 'M':
+                group_start = i if group_start == None else group_start
+                continue
+            if group_start != None:
+                self._add_mutation(runs, group_start, i, seq,
+                        set(low_quality), excluded)
+                group_start = None
+
+        self._excluded.extend(excluded)
+        if len(self._mutations) + len(self._depth_starts) + \
+                len(self._excluded) > self.FLUSH_SIZE:
+            self.flush()
+
+    @staticmethod
+    def _get_segments(runs):
+        r"""
+        Get the contiguous reference spans of runs, which are split by
+        reference skips.
+
+        Returns
+        -------
+        list of two-element lists of int (first) and int (last)
+        """
+        segments = []
+        for _, _, ref_pos, reps, _ in runs:
+            if ref_pos == None:
+                continue
+            if segments != [] and ref_pos == segments[-1][1] + 1:
+                segments[-1][1] = ref_pos + reps - 1
+            else:
+                segments.append([ref_pos, ref_pos + reps - 1])
+        return segments
+
+    def _get_low_quality(self, seq, qual):
+        r"""
+        Get the read positions of bases which are not called, or have
+        qualities below min_qual.
+
+        Returns
+        -------
+        sorted list of int (1-based)
+        """
+        positions = [i + 1 for i, base in enumerate(seq) if base not in BASES] \
+                if seq != '*' else []
+        if self.min_qual > 0 and qual != b'*':
+            quals = np.frombuffer(qual, dtype=np.uint8).astype(np.int64) - 33
+            positions = sorted(set(positions).union(
+                    (np.flatnonzero(quals < self.min_qual) + 1).tolist()))
+        return positions
+
+    def _add_mutation(self, runs, group_start, group_stop, seq, low_quality,
+            excluded):
+        group = runs[group_start:group_stop]
+        following = runs[group_stop] if group_stop < len(runs) else None
+        ref_positions = [ref_pos + i for _, _, ref_pos, reps, _ in group
+                if ref_pos != None for i in range(reps)]
+        if group[-1][0] == 'I':
+            # An insertion at the end of the read has no position after it.
+            if following == None:
+                excluded.update(ref_positions)
+                return
+            position = following[2]
+        else:
+            position = ref_positions[-1]
+        excluded.update(p for p in ref_positions if p != position)
+
+        # Mutations are only as good as their read bases, and the read bases
+        # either side of them, as in shapemapper_mutation_parser.
+        rd_positions = [rd_pos + i for _, rd_pos, _, reps, _ in group
+                if rd_pos != None for i in range(reps)]
+        previous = runs[group_start - 1] if group_start > 0 else None
+        if previous != None and previous[1] != None:
+            rd_positions.append(previous[1] + previous[3] - 1)
+        if following != None and following[1] != None:
+            rd_positions.append(following[1])
+        if seq == '*' or not low_quality.isdisjoint(rd_positions):
+            excluded.add(position)
+            return
+
+        mutation_class = self._classify(group, seq)
+        self._mutations.append(
+                CLASS_INDICES[mutation_class] * self.length + position - 1)
+
+    @staticmethod
+    def _classify(group, seq):
+        ops = set(map(lambda r: r[0], group))
+        n_bases = sum(map(lambda r: r[3], group))
+        if ops == {'X'}:
+            if n_bases > 1:
+                return 'multinuc_mismatch'
+            _, rd_pos, _, _, ref_bases = group[0]
+            mutation_class = ref_bases.upper() + seq[rd_pos - 1]
+            # A mismatch against an ambiguous reference base
+            return mutation_class if mutation_class in CLASS_INDICES else \
+                    'multinuc_mismatch'
+        elif ops == {'D'}:
+            if n_bases > 1:
+                return 'multinuc_deletion'
+            mutation_class = group[0][4].upper() + '-'
+            return mutation_class if mutation_class in CLASS_INDICES else \
+                    'multinuc_deletion'
+        elif ops == {'I'}:
+            if n_bases > 1:
+                return 'multinuc_insertion'
+            inserted = seq[group[0][1] - 1]
+            return '-' + (inserted if inserted in BASES else 'N')
+        elif 'D' in ops:
+            return 'complex_deletion'
+        return 'complex_insertion'
+
+    def flush(self):
+        r"""
+        Add the pending positions to the arrays.
+        """
+        depth_size = len(DEPTH_COLUMNS) * (self.length + 1)
+        changes = bincount(self._depth_starts, depth_size) - \
+                bincount(self._depth_ends, depth_size)
+        depths = np.cumsum(changes.reshape(len(DEPTH_COLUMNS), -1),
+                axis=1)[:, :-1]
+        depths[EFFECTIVE_DEPTH] = depths[READ_DEPTH] - bincount(
+                [p - 1 for p in self._excluded], self.length)
+        self.depths += depths
+        self.mutations += bincount(self._mutations,
+                self.mutations.size).reshape(self.mutations.shape)
+
+        self._mutations = []
+        self._depth_starts, self._depth_ends = [], []
+        self._excluded = []
+
+    def write(self, out_name):
+        r"""
+        Write the counts, one row per position of the region.
+        """
+        self.flush()
+        np.savetxt(out_name, np.vstack([self.mutations, self.depths]).T,
+                fmt='%d', delimiter='\t',
+                header='\t'.join(MUTATION_CLASSES + DEPTH_COLUMNS), comments='')
+
+def bincount(indices, size):
+    r"""
+    Count the occurrences of each of range(size) in indices.
+
+    Returns
+    -------
+    ``numpy.ndarray`` of int
+    """
+    return np.bincount(np.array(indices, dtype=np.int64), minlength=size)
+
+def get_windows(start, stop, window_length):
+    r"""
+    Split [start, stop] into consecutive windows of window_length positions,
+    the last of which may be shorter.
+
+    Returns
+    -------
+    list of tuples of int (start) and int (stop)
+    """
+    return [(window_start, min(window_start + window_length - 1, stop))
+            for window_start in range(start, stop + 1, window_length)]
+
+def write_window_rows(window_file, outfile, *, skip, n_rows, n_columns,
+        missing=0):
+    r"""
+    Copy n_rows rows of counts after the first skip rows of window_file to
+    outfile. Rows missing at the end of window_file (i.e. positions past the
+    last one counted) are only written, as zeros, once a row of a later window
+    follows them; missing is the number of rows still missing from earlier
+    windows. As when the whole region is counted by
+    shapemapper_mutation_counter, no rows are written past the last position
+    counted.
+
+    Returns
+    -------
+    int (the number of rows missing after those written)
+    """
+    zeros = '\t'.join(['0'] * n_columns) + '\n'
+    written = 0
+    for row in itertools.islice(window_file, skip, skip + n_rows):
+        if missing > 0:
+            outfile.write(zeros * missing)
+            missing = 0
+        outfile.write(row)
+        written += 1
+    return missing + n_rows - written
@@ -0,0 +1,79 @@
+import logging, mmap, os
+
+logger = logging.getLogger('bedshape')
+
+# Open references, by filename. Kept for the lifetime of the process, so that
+# every region of a run reuses the same index and mapping.
+_references = {}
+
+def get_reference(filename):
+    r"""
+    Get the (cached) ``Reference`` for a FASTA file, or None if it cannot be
+    read in-process (no .fai index, or compressed with bgzip).
+
+    Returns
+    -------
+    ``Reference``, or None
+    """
+    filename = os.path.abspath(filename)
+    if filename not in _references:
+        if not os.path.isfile(filename + '.fai') or \
+                os.path.isfile(filename + '.gzi'):
+            return None
+        _references[filename] = Reference(filename)
+    return _references[filename]
+
+class Reference:
+    """
+    Represents a FASTA file indexed by samtools faidx. The .fai index is parsed
+    once, and the FASTA file is memory-mapped so that sequences are sliced
+    directly from it.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.index = {}
+        with open(filename + '.fai') as index_file:
+            for line in index_file:
+                name, length, offset, line_bases, line_width = \
+                        line.split('\t')[:5]
+                self.index[name] = (
+                        int(length), int(offset), int(line_bases),
+                        int(line_width))
+
+        with open(filename, 'rb') as fasta_file:
+            self.mmap = mmap.mmap(
+                    fasta_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def fetch(self, rname, start, stop):
+        r"""
+        Get the sequence of [start, stop] (1-based, inclusive) in rname. As in
+        samtools faidx, the region is truncated to the end of the sequence.
+
+        Returns
+        -------
+        str
+        """
+        if rname not in self.index:
+            raise KeyError('{} not in {}'.format(rname, self.filename))
+        length, offset, line_bases, line_width = self.index[rname]
+        start, stop = max(start, 1) - 1, min(stop, length)
+        if start >= stop:
+            return ''
+
+        first = offset + start // line_bases * line_width + start % line_bases
+        last = offset + stop // line_bases * line_width + stop % line_bases
+        return self.mmap[first:last] \
+                .replace(b'\n', b'').replace(b'\r', b'').decode()
+
+    def write(self, region, outfile, line_length=60):
+        r"""
+        Write region (<rname>:<start>-<stop>) to outfile, as samtools faidx
+        does.
+        """
+        rname, coords = region.rsplit(':', 1)
+        start, stop = map(int, coords.split('-'))
+        sequence = self.fetch(rname, start, stop)
+        outfile.write('>{}\n'.format(region))
+        for i in range(0, len(sequence), line_length):
+            outfile.write(sequence[i:i+line_length] + '\n')
@@ -0,0 +1,72 @@
+import hashlib, json, logging, os, tempfile
+import cache
+
+logger = logging.getLogger('bedshape')
+
+MANIFEST_FILENAME = 'bedshape-manifest.json'
+
+def get_region_key(inputs, region, options):
+    r"""
+    Get the key of a region's outputs, which covers the input files (see
+    ``cache.get_file_identity``; inputs which are not local files are taken by
+    name), the region and the options they depend on.
+
+    Parameters
+    ----------
+    inputs: list of str (filenames), or None for missing samples
+    region: str
+    options: dict, serialisable as JSON
+
+    Returns
+    -------
+    str
+    """
+    key = json.dumps({
+            'inputs': [cache.get_file_identity(filename)
+                if filename != None and os.path.isfile(filename) else filename
+                for filename in inputs],
+            'region': region,
+            'options': options}, sort_keys=True)
+    return hashlib.sha256(key.encode()).hexdigest()
+
+class Manifest:
+    """
+    Represents the record of the regions completed in an output directory, so
+    that a run may be resumed. Each completed region is recorded with its key
+    (see ``get_region_key``), and the output files it produced.
+    """
+
+    def __init__(self, outdir):
+        self.filename = os.path.join(outdir, MANIFEST_FILENAME)
+        self.regions = {}
+        if os.path.isfile(self.filename):
+            with open(self.filename) as manifest_file:
+                self.regions = json.load(manifest_file)['regions']
+
+    def is_complete(self, region, key, outputs):
+        r"""
+        Check that region was completed with the same key, and that all of
+        outputs exist.
+
+        Returns
+        -------
+        bool
+        """
+        entry = self.regions.get(region)
+        return entry != None and entry['key'] == key and \
+                all(map(os.path.isfile, outputs))
+
+    def record(self, region, key, outputs):
+        self.regions[region] = {'key': key, 'outputs': outputs}
+        self.save()
+
+    def save(self):
+        # Written under a temporary name first, so that an interrupted run
+        # never leaves a partial manifest.
+        outdir = os.path.dirname(self.filename)
+        os.makedirs(outdir, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=outdir, suffix='.tmp')
+        with os.fdopen(fd, 'w') as manifest_file:
+            json.dump({'regions': self.regions}, manifest_file, indent=1,
+                    sort_keys=True)
+        os.replace(tmp_name, self.filename)
@@ -0,0 +1,136 @@
+import math, os
+import numpy as np
+from normalize_profiles import NormError
+
+# Normalisation of reactivity profiles as in shapemapper2's
+# normalize_profiles.py, which is vendored as it is (see the Makefile), so
+# that bedshape's changes are kept here instead.
+
+def calc_quartile(x, q):
+    r"""
+    Calculate the q quantile of the sorted array x, by interpolating between
+    its values (type 7 in R), as ``normalize_profiles.calc_quartile`` does by
+    default, but without copying x.
+
+    Returns
+    -------
+    float
+    """
+    n = len(x)
+    g, j = math.modf(1 + (n - 1) * q - 1)
+    if j < 0:
+        return x[0]
+    elif j >= n:
+        return x[n - 1]
+    j = int(j)
+    if g == 0:
+        return x[j]
+    return x[j] + (x[j + 1] - x[j]) * g
+
+def find_boxplot_factor(array):
+    r"""
+    Calculate the boxplot normalisation factor of a profile: the mean of the
+    top tenth of reactivities, after outliers are excluded, as
+    ``normalize_profiles.find_boxplot_factor`` does, but without looping over
+    the reactivities in Python. The factor is identical to that of
+    ``normalize_profiles.find_boxplot_factor``.
+
+    Returns
+    -------
+    float
+    """
+    x = array[np.isfinite(array)]
+    if x.shape[0] < 10:
+        raise NormError('Error: sequence contains too few nucleotides with '
+                'quality reactivity information for effective normalization '
+                'factor calculation.')
+    x.sort()
+    ten_pct = len(x) // 10
+    five_pct = len(x) // 20
+    # The cutoff is the greater (i.e. excluding the fewest reactivities) of
+    # 1.5 times the interquartile range, and the top tenth (or twentieth, for
+    # fewer than 100 reactivities).
+    q_limit = 1.5 * abs(calc_quartile(x, 0.25) - calc_quartile(x, 0.75))
+    limit = max(q_limit, x[len(x) - 1 -
+            (ten_pct if len(x) >= 100 else five_pct)])
+    # x is sorted, so the reactivities below the cutoff are a prefix of it.
+    kept = x[:np.searchsorted(x, limit, side='left')]
+    if len(kept) < ten_pct:
+        raise NormError('Unable to calculate a normalization factor.')
+    # cumsum adds left to right, one value at a time, so the sum (and the
+    # factor) is identical to that of a plain Python loop; np.sum would use
+    # pairwise summation instead.
+    return np.cumsum(kept[len(kept) - ten_pct:])[-1] / ten_pct
+
+def calc_norm_factor(profiles):
+    r"""
+    Calculate the normalisation factor over profiles together.
+
+    Returns
+    -------
+    float
+    """
+    return find_boxplot_factor(np.hstack(profiles))
+
+class ProfileTable:
+    """
+    Represents a reactivity profile file (as written by
+    make_reactivity_profiles.py), which is read once: its reactivities and
+    standard errors (HQ_profile and HQ_stderr) are parsed, and its rows kept,
+    so that normalised columns can be written without reading it again.
+    """
+
+    COLUMNS = ['HQ_profile', 'HQ_stderr']
+    NORM_COLUMNS = ['Norm_profile', 'Norm_stderr']
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename) as profile_file:
+            self.headers = profile_file.readline().strip().split('\t')
+            self.rows = [line.strip().split('\t') for line in profile_file]
+
+        if self.rows == []:
+            raise RuntimeError('Error: file "{}" contains no data.'.format(
+                    filename))
+        if any(map(lambda c: c not in self.headers, self.COLUMNS)):
+            raise RuntimeError('File "{}" does not contain the expected '
+                    'columns.'.format(filename))
+        self.profile, self.stderrs = [
+                np.array([row[self.headers.index(column)]
+                    for row in self.rows], dtype=float)
+                for column in self.COLUMNS]
+
+    def write_norm_columns(self, out_name, norm_factor, *,
+            decimal_places=6):
+        r"""
+        Write the profile with its reactivities and standard errors normalised
+        by norm_factor to out_name, in the Norm_profile and Norm_stderr
+        columns, which are added if the profile has none.
+        """
+        number = '{{:.{}f}}'.format(decimal_places)
+        headers = list(self.headers)
+        if all(map(lambda c: c in headers, self.NORM_COLUMNS)):
+            norm_indices = list(map(headers.index, self.NORM_COLUMNS))
+        else:
+            norm_indices = None
+            headers.extend(self.NORM_COLUMNS)
+
+        folder = os.path.dirname(out_name)
+        if folder != '':
+            os.makedirs(folder, exist_ok=True)
+        with open(out_name, 'w') as outfile:
+            outfile.write('\t'.join(headers) + '\n')
+            outfile.write('\n'.join(
+                    '\t'.join(self._set_norm_fields(row, norm_indices,
+                        number.format(reactivity / norm_factor),
+                        number.format(stderr / norm_factor)))
+                    for row, reactivity, stderr in
+                        zip(self.rows, self.profile, self.stderrs)))
+
+    @staticmethod
+    def _set_norm_fields(row, norm_indices, reactivity, stderr):
+        if norm_indices == None:
+            return row + [reactivity, stderr]
+        row = list(row)
+        row[norm_indices[0]], row[norm_indices[1]] = reactivity, stderr
+        return row
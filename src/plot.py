@@ -0,0 +1,130 @@
+import logging, math
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.backends.backend_pdf import PdfPages
+from matplotlib.collections import PolyCollection
+from matplotlib.figure import Figure
+
+logger = logging.getLogger('bedshape')
+
+# Reactivities are coloured as in shapemapper2's figures: low (black), medium
+# (orange) and high (red); positions without data are grey.
+COLOURS = ['black', 'orange', 'red']
+THRESHOLDS = [0.4, 0.85]
+NO_DATA_COLOUR = '0.7'
+
+SAMPLES = ['Modified', 'Untreated', 'Denatured']
+SAMPLE_COLOURS = ['C3', 'C0', 'C2']
+
+# Widths of figures (in inches) per position, and their bounds.
+INCHES_PER_POSITION = 0.04
+MIN_WIDTH, MAX_WIDTH = 8, 48
+
+def load_profile(profile_name):
+    r"""
+    Load the columns of a normalised profile (see ``profile.normalize``) as
+    arrays, with missing values as NaN.
+
+    Returns
+    -------
+    dict of str (column) to ``numpy.ndarray``
+    """
+    with open(profile_name) as profile_file:
+        headers = profile_file.readline().rstrip('\n').split('\t')
+        rows = [line.rstrip('\n').split('\t') for line in profile_file]
+    columns = {}
+    for i, header in enumerate(headers):
+        values = [row[i] for row in rows]
+        try:
+            columns[header] = np.array(
+                    [float(value) if value != '' else math.nan
+                        for value in values])
+        except ValueError:
+            columns[header] = np.array(values)
+    return columns
+
+class Renderer:
+    """
+    Renders reactivity profiles as figures, one at a time, reusing a single
+    figure (and so its fonts and axes) for every profile. Figures are the
+    normalised reactivities of each position, and the effective depth of each
+    sample where the profile has them. If raster, figures are saved as PNG
+    images at dpi, which is faster than vector PDF.
+    """
+
+    def __init__(self, *, min_depth=0, raster=False, dpi=100):
+        self.min_depth = min_depth
+        self.raster = raster
+        self.dpi = dpi
+        self.figure = Figure()
+        FigureCanvasAgg(self.figure)
+        self.profile_axes, self.depth_axes = self.figure.subplots(2, 1,
+                sharex=True, gridspec_kw={'height_ratios': [3, 1]})
+
+    def draw(self, profile_name, title):
+        columns = load_profile(profile_name)
+        positions = columns['Nucleotide']
+        reactivities = columns['Norm_profile']
+        stderrs = columns['Norm_stderr']
+        self.figure.set_size_inches(min(max(
+                len(positions) * INCHES_PER_POSITION, MIN_WIDTH), MAX_WIDTH), 6)
+
+        axes = self.profile_axes
+        axes.clear()
+        colours = np.full(len(positions), NO_DATA_COLOUR, dtype=object)
+        bins = np.digitize(reactivities, THRESHOLDS)
+        for i, colour in enumerate(COLOURS):
+            colours[(bins == i) & ~np.isnan(reactivities)] = colour
+        # The bars and error bars are drawn as a collection each, rather than
+        # as a patch and line per position, which is much faster to draw.
+        heights = np.nan_to_num(reactivities)
+        bars = np.zeros((len(positions), 4, 2))
+        bars[:, :, 0] = positions[:, None] + [-0.5, -0.5, 0.5, 0.5]
+        bars[:, 1:3, 1] = heights[:, None]
+        axes.add_collection(PolyCollection(bars,
+                facecolors=colours.tolist(), edgecolors='none'))
+        axes.vlines(positions, heights - np.nan_to_num(stderrs),
+                heights + np.nan_to_num(stderrs), colors='0.4',
+                linewidth=0.5)
+        axes.autoscale_view()
+        for threshold in THRESHOLDS:
+            axes.axhline(threshold, color='0.8', linewidth=0.5, zorder=0)
+        axes.set_title(title)
+        axes.set_ylabel('Normalised reactivity')
+
+        axes = self.depth_axes
+        axes.clear()
+        for sample, colour in zip(SAMPLES, SAMPLE_COLOURS):
+            depths = columns.get('{}_effective_depth'.format(sample))
+            if depths is not None:
+                axes.plot(positions, depths, color=colour, linewidth=1,
+                        label=sample)
+        if self.min_depth > 0:
+            axes.axhline(self.min_depth, color='0.5', linestyle='--',
+                    linewidth=0.5)
+        if axes.has_data():
+            axes.legend(loc='upper right', fontsize='small')
+        axes.set_xlabel('Nucleotide')
+        axes.set_ylabel('Effective depth')
+        if len(positions) > 0:
+            axes.set_xlim(positions[0] - 0.5, positions[-1] + 0.5)
+
+    def save(self, out_name):
+        self.figure.savefig(out_name, format='png' if self.raster else 'pdf',
+                dpi=self.dpi)
+
+    def render(self, profile_name, out_name, title):
+        r"""
+        Render a profile as a figure in out_name.
+        """
+        self.draw(profile_name, title)
+        self.save(out_name)
+
+    def render_pages(self, profile_names, out_name, titles):
+        r"""
+        Render profiles as the pages of a single PDF, out_name.
+        """
+        with PdfPages(out_name) as pages:
+            for profile_name, title in zip(profile_names, titles):
+                self.draw(profile_name, title)
+                pages.savefig(self.figure)
@@ -1,8 +1,39 @@
-import logging, os, shutil, subprocess, sys, tempfile, time
-import alias, constants, sam
+import concurrent.futures, contextvars, logging, os, select, shutil, \
+        subprocess, sys, tempfile, time
+import alias, bam, cache, clip, constants, counts, fasta, manifest, norm, \
+        plot, sam, scripts, stages
 
 logger = logging.getLogger('bedshape')
 
+class RegionFilter(logging.Filter):
+    """
+    Prefixes log messages with the region being profiled, so that logs from
+    regions running in parallel can be told apart.
+    """
+
+    def filter(self, record):
+        region = stages.current_region.get()
+        if region != None:
+            record.msg = '[{}] {}'.format(region, record.msg)
+        return True
+
+logger.addFilter(RegionFilter())
+
+# Names of the extracted modified, untreated and denatured samples.
+SAMPLE_NAMES = ['modified.sam', 'untreated.sam', 'denatured.sam']
+
+# Name of the multi-page PDF of all regions, with --plot combined.
+COMBINED_FIGURE_NAME = 'bedshape-profiles.pdf'
+
+# Estimated peak memory of counting a sample, in bytes per position of the
+# region (counts.Counter takes about 600), for --max-memory.
+BYTES_PER_POSITION = 1024
+# Regions longer than the window length are counted in windows, each counted
+# with this many positions either side, so that mutations up to this long at
+# the edges of a window are counted as over the whole region.
+WINDOW_OVERLAP = 500
+MIN_WINDOW_LENGTH = 10 * WINDOW_OVERLAP
+
 def run(args):
     regions = []
 
@@ -40,21 +71,150 @@ def run(args):
                 'Both an alias and reference/sample filepaths specified, '
                 'defaulting to alias.')
 
-    outdir = get_abs_join(
-            './' if len(regions) < 2 else time.strftime('bedshape-%Y%m%d-%H%M%s'),
-            args.outdir)
-    for region in regions:
+    if args.resume:
+        outdir = os.path.abspath(args.resume)
+    else:
+        outdir = get_abs_join(
+                './' if len(regions) < 2 else
+                    time.strftime('bedshape-%Y%m%d-%H%M%s'),
+                args.outdir)
+    if args.pipe and args.keep:
         logger.info(
-                'Running profile for {} with\n'
-                '\tmodified: {}\n'
-                '\tunmodified: {}\n'
-                '\tdenatured: {}'.format(region, modified, unmodified, denatured))
-        profile_once(
-                reference, modified, unmodified, denatured, region,
-                keep=args.keep, outdir=outdir,
-                min_depth=args.min_depth, max_bg=args.max_bg,
-                skip_plot=args.skip_plot, skip_shape=args.skip_shape,
-                min_mapq=args.min_mapq)
+                'Both --pipe and --keep specified; intermediate files will be '
+                'written to the temp directory instead of piped.')
+    if args.pipe and args.native_counts:
+        logger.info(
+                'Both --pipe and --native-counts specified; mutations will be '
+                'counted in-process, with no intermediate files to pipe.')
+    pipe = args.pipe and not args.keep
+    if args.native_bam and args.batch:
+        logger.info(
+                'Both --native-bam and --batch specified; the batch-extracted '
+                'SAM files will be read instead of the alignments.')
+    count_options = dict(
+            min_depth=args.min_depth, max_bg=args.max_bg,
+            min_mapq=args.min_mapq, pipe=pipe, extracted=args.batch,
+            native_bam=args.native_bam and not args.batch,
+            native_counts=args.native_counts, in_process=args.in_process,
+            window_length=None if args.max_memory == None else
+                get_window_length(args.max_memory),
+            downsampler=None if args.max_reads == None and
+                args.target_depth == None else sam.Downsampler(
+                    max_reads=args.max_reads, target_depth=args.target_depth,
+                    seed=args.seed),
+            counts_cache=None if args.no_cache else cache.CountsCache(
+                args.cache_dir, args.cache_size * 2**20))
+    # Figures are not rendered by finish_once, so that regions need not wait
+    # on them: with --plot each, they are rendered in the background as each
+    # region finishes, and otherwise in a batch after all regions finish.
+    batch_plot = not args.skip_plot and args.plot != 'each'
+    plot_executor = concurrent.futures.ThreadPoolExecutor(1) \
+            if not args.skip_plot and args.plot == 'each' else None
+    plot_futures = []
+    finish_options = dict(outdir=outdir, skip_shape=args.skip_shape,
+            in_process=args.in_process)
+
+    samples = (reference, modified, unmodified, denatured)
+    shared_norm = args.shared_norm and len(regions) > 1
+
+    # Completed regions are recorded as they finish, so that the run may be
+    # resumed if interrupted. With --shared-norm, every region depends on the
+    # normalisation factor over all regions, so on all the regions.
+    region_manifest = manifest.Manifest(outdir)
+    key_options = dict(
+            min_depth=args.min_depth, max_bg=args.max_bg,
+            min_mapq=args.min_mapq, max_reads=args.max_reads,
+            target_depth=args.target_depth, seed=args.seed,
+            native_counts=args.native_counts, max_memory=args.max_memory,
+            shared_norm=sorted(regions) if shared_norm else None)
+    keys = {region: manifest.get_region_key(samples, region, key_options)
+            for region in regions}
+    outputs = {region: get_output_names(region, outdir=outdir,
+                skip_plot=args.skip_plot or batch_plot,
+                skip_shape=args.skip_shape)
+            for region in regions}
+    def on_result(result):
+        region, error, _ = result
+        if error != None:
+            return
+        if plot_executor != None:
+            plot_futures.append(plot_executor.submit(render_and_record, region))
+        else:
+            region_manifest.record(region, keys[region], outputs[region])
+    def render_and_record(region):
+        # Figures are rendered in a subprocess even with --in-process, since
+        # in-process scripts hold the lock of ``scripts.run_in_process``,
+        # which would hold up the scripts of the regions still being profiled.
+        result = call_for_region(region, render_figure, (
+                get_abs_join(outdir, '{}.profile'.format(region)),
+                '{}.pdf'.format(region)),
+                dict(outdir=outdir, min_depth=args.min_depth,
+                    max_bg=args.max_bg))
+        # Only once its figure exists (so in this thread) is a region complete.
+        if result[1] == None:
+            region_manifest.record(region, keys[region], outputs[region])
+        return result
+
+    all_regions = regions
+    if args.resume:
+        completed = [region for region in regions
+                if region_manifest.is_complete(
+                    region, keys[region], outputs[region])]
+        logger.info('{} of {} regions already complete in {}'.format(
+                len(completed), len(regions), outdir))
+        if shared_norm and len(completed) < len(regions):
+            completed = []
+        regions = [region for region in regions if region not in completed]
+
+    if args.stages:
+        os.makedirs(outdir, exist_ok=True)
+        records_name = get_abs_join(outdir, 'bedshape-stages.jsonl')
+        open(records_name, 'w').close()
+        stages.enable(records_name)
+
+    tmpdirs = dict.fromkeys(regions)
+    if args.batch and regions != []:
+        tmpdirs = extract_batches([modified, unmodified, denatured], regions,
+                keep=args.keep)
+
+    try:
+        if shared_norm and regions != []:
+            results = profile_shared_norm(samples, regions, tmpdirs,
+                    count_options=count_options,
+                    finish_options=finish_options, keep=args.keep,
+                    jobs=args.jobs, on_result=on_result)
+        else:
+            results = map_regions([
+                    (region, profile_once, samples + (region,), dict(
+                        {**count_options, **finish_options},
+                        keep=args.keep, tmpdir=tmpdirs[region]))
+                    for region in regions], jobs=args.jobs,
+                    on_result=on_result)
+    except BaseException:
+        # Figures not yet started are not rendered.
+        if plot_executor != None:
+            plot_executor.shutdown(cancel_futures=True)
+        raise
+
+    log_summary(results)
+    plot_results = []
+    if plot_executor != None:
+        if any(map(lambda f: not f.done(), plot_futures)):
+            logger.info('Waiting for figures to finish rendering')
+        plot_executor.shutdown()
+        plot_results = [future.result() for future in plot_futures]
+    elif batch_plot:
+        # Including regions completed by an earlier run, if resumed
+        plot_regions = [region for region in all_regions if os.path.isfile(
+                get_abs_join(outdir, '{}.profile'.format(region)))]
+        plot_results = render_batch(plot_regions, outdir=outdir,
+                plot_mode=args.plot, min_depth=args.min_depth)
+    log_plot_summary(plot_results)
+
+    if args.stages:
+        stages.write_reports(records_name, outdir)
+        stages.enable(None)
+    return results
 
 def validate(args, print_help):
     to_exit = False
@@ -63,8 +223,6 @@ def validate(args, print_help):
         logger.error('You must specify either a region or BED file')
         to_exit = True
 
-    if args.alias and not to_exit:
-        return  # has alias, region/bed is ok, just continue
     if not args.alias and not args.reference:
         logger.error(
                 'You must specify a reference through --reference, or --alias')
@@ -75,6 +233,21 @@ def validate(args, print_help):
                 '--alias')
         to_exit=True
 
+    if args.jobs < 1:
+        logger.error('--jobs must be at least 1')
+        to_exit = True
+
+    for option, value in [('--max-reads', args.max_reads),
+            ('--target-depth', args.target_depth),
+            ('--max-memory', args.max_memory)]:
+        if value != None and value < 1:
+            logger.error('{} must be at least 1'.format(option))
+            to_exit = True
+
+    if args.cache_size < 0:
+        logger.error('--cache-size must not be negative')
+        to_exit = True
+
     if to_exit:
         print_help()
         sys.exit(1)
@@ -89,29 +262,135 @@ def parse_bedfile(bedfile):
             regions.append('{}:{}-{}'.format(*line[:3]))
     return regions
 
+def map_regions(calls, *, jobs, on_result=None):
+    r"""
+    Make calls of (region, function, args, kwargs) with ``call_for_region``, on
+    a pool of jobs processes if jobs > 1. If given, on_result is called with
+    each result as soon as it is available.
+
+    Returns
+    -------
+    list of results of ``call_for_region``, in order of completion
+    """
+    results = []
+    if jobs < 2 or len(calls) < 2:
+        for call in calls:
+            results.append(call_for_region(*call))
+            if on_result != None:
+                on_result(results[-1])
+        return results
+
+    with concurrent.futures.ProcessPoolExecutor(jobs,
+            initializer=stages.enable,
+            initargs=(stages.get_records_name(),)) as executor:
+        futures = [executor.submit(call_for_region, *call) for call in calls]
+        for future in concurrent.futures.as_completed(futures):
+            results.append(future.result())
+            if on_result != None:
+                on_result(results[-1])
+    return results
+
+def call_for_region(region, function, args, kwargs):
+    r"""
+    Call function for a region, with logs prefixed by the region name. Errors
+    are logged and returned instead of raised, so that one failing region does
+    not stop the others.
+
+    Returns
+    -------
+    tuple of str (region), str (error message, or None if successful) and the
+    value returned by function (or None if failed)
+    """
+    token = stages.current_region.set(region)
+    try:
+        return region, None, function(*args, **kwargs)
+    except Exception as e:
+        logger.exception('{} failed'.format(function.__name__))
+        return region, '{}: {}'.format(type(e).__name__, e), None
+    finally:
+        stages.current_region.reset(token)
+
+def log_summary(results):
+    failed = list(filter(lambda r: r[1] != None, results))
+    logger.info('{} of {} regions succeeded ({} failed)'.format(
+            len(results) - len(failed), len(results), len(failed)))
+    for region, error, _ in failed:
+        logger.error('{} failed with {}'.format(region, error))
+
+def log_plot_summary(results):
+    r"""
+    Report figures which failed to render. These do not fail their regions,
+    whose profiles and shape files are already written.
+    """
+    failed = list(filter(lambda r: r[1] != None, results))
+    if failed == []:
+        return
+    logger.warn('{} of {} figures failed to render'.format(
+            len(failed), len(results)))
+    for region, error, _ in failed:
+        logger.error('Rendering {} failed with {}'.format(region, error))
+
 def profile_once(
         reference, modified, unmodified, denatured, region, *, keep, outdir,
-        min_depth, max_bg, skip_plot, skip_shape, min_mapq):
-
-    start, stop = region.split(':')[1].split('-')
-    start, stop = int(start), int(stop)
-    tmpdir = tempfile.mkdtemp()
-
-    ref_name = extract_from_reference(
-            reference, region, tmpdir=tmpdir)
-    modified_name = extract_from_alignment(
-            modified, region, out_name='modified.sam', tmpdir=tmpdir)
-    unmodified_name = extract_from_alignment(
-            unmodified, region, out_name='untreated.sam', tmpdir=tmpdir)
-    denatured_name = extract_from_alignment(
-            denatured, region, out_name='denatured.sam', tmpdir=tmpdir)
-
-    modified_counts = make_counts(
-            modified_name, region, min_mapq=min_mapq, tmpdir=tmpdir)
-    unmodified_counts = make_counts(
-            unmodified_name, region, min_mapq=min_mapq, tmpdir=tmpdir)
-    denatured_counts = make_counts(
-            denatured_name, region, min_mapq=min_mapq, tmpdir=tmpdir)
+        min_depth, max_bg, skip_shape, min_mapq, pipe=False, tmpdir=None,
+        extracted=False, native_bam=False, native_counts=False,
+        in_process=False, window_length=None, downsampler=None,
+        counts_cache=None):
+    tmpdir = tmpdir if tmpdir != None else \
+            tempfile.mkdtemp(prefix='bedshape-{}-'.format(region))
+
+    try:
+        intermediate_name = count_once(
+                reference, modified, unmodified, denatured, region,
+                min_depth=min_depth, max_bg=max_bg, min_mapq=min_mapq,
+                pipe=pipe, tmpdir=tmpdir, extracted=extracted,
+                native_bam=native_bam, native_counts=native_counts,
+                in_process=in_process, window_length=window_length,
+                downsampler=downsampler, counts_cache=counts_cache)
+        finish_once(intermediate_name, region, outdir=outdir,
+                skip_shape=skip_shape, in_process=in_process)
+    finally:
+        # Including after a failure, which is reported by call_for_region
+        if not keep:
+            shutil.rmtree(tmpdir)
+
+def count_once(
+        reference, modified, unmodified, denatured, region, *, min_depth,
+        max_bg, min_mapq, tmpdir, pipe=False, extracted=False,
+        native_bam=False, native_counts=False, in_process=False,
+        window_length=None, downsampler=None, counts_cache=None):
+    r"""
+    Count mutations in each sample, and calculate the (unnormalised) reactivity
+    profile of a region.
+
+    Returns
+    -------
+    str (the unnormalised profile filename, in tmpdir)
+    """
+    logger.info(
+            'Running profile with\n'
+            '\tmodified: {}\n'
+            '\tunmodified: {}\n'
+            '\tdenatured: {}'.format(modified, unmodified, denatured))
+
+    # The samples are independent until make_profile, so each is extracted,
+    # clipped and counted in its own thread. The threads mostly wait on the
+    # samtools and shapemapper subprocesses.
+    with concurrent.futures.ThreadPoolExecutor(3) as executor:
+        futures = [
+                executor.submit(
+                    contextvars.copy_context().run, make_sample_counts,
+                    alignment, region, out_name=out_name, min_mapq=min_mapq,
+                    tmpdir=tmpdir, pipe=pipe, extracted=extracted,
+                    native_bam=native_bam, native_counts=native_counts,
+                    window_length=window_length, downsampler=downsampler,
+                    counts_cache=counts_cache)
+                for alignment, out_name in zip(
+                    [modified, unmodified, denatured], SAMPLE_NAMES)]
+        ref_name = extract_from_reference(
+                reference, region, tmpdir=tmpdir)
+        modified_counts, unmodified_counts, denatured_counts = [
+                future.result() for future in futures]
 
     # if denatured not supplied, denatured_counts == None
     samples = list(filter(
@@ -119,27 +398,355 @@ def profile_once(
                 [modified_counts, unmodified_counts, denatured_counts]))
 
     profile_filename = '{}.profile'.format(region)
-    profile_filename = make_profile(samples, ref_name, profile_filename,
-            tmpdir=tmpdir, outdir=outdir, min_depth=min_depth, max_bg=max_bg)
+    return make_profile(samples, ref_name, profile_filename,
+            tmpdir=tmpdir, min_depth=min_depth, max_bg=max_bg,
+            in_process=in_process)
 
-    if not skip_plot:
-        figure_filename = '{}.pdf'.format(region)
-        render_figure(profile_filename, figure_filename,
-                outdir=outdir, min_depth=min_depth, max_bg=max_bg)
+def finish_once(intermediate_name, region, *, outdir, skip_shape,
+        norm_factor=None, table=None, in_process=False):
+    r"""
+    Normalise the profile from ``count_once`` into outdir, then make shape
+    files. Figures are rendered by ``run``, once the region is finished. If
+    norm_factor is None, the normalisation factor is calculated from this
+    profile alone. table is the profile, if it has already been read (see
+    ``norm.ProfileTable``). If in_process, tab_to_shape.py is run in this
+    process (see ``scripts.run``).
+    """
+    profile_filename = get_abs_join(outdir, '{}.profile'.format(region))
+    normalize([intermediate_name], [profile_filename], norm_factor=norm_factor,
+            tables=None if table == None else [table])
 
     if not skip_shape:
-        make_shape(profile_filename, region, outdir=outdir)
+        make_shape(profile_filename, region, outdir=outdir,
+                in_process=in_process)
+
+def profile_shared_norm(samples, regions, tmpdirs, *, count_options,
+        finish_options, keep, jobs, on_result=None):
+    r"""
+    Profile all regions with a single normalisation factor, calculated over the
+    profiles of all regions together. on_result is passed to ``map_regions``
+    for the finished regions.
+
+    Returns
+    -------
+    list of results of ``call_for_region``
+    """
+    tmpdirs = {region: tmpdir if tmpdir != None else
+                tempfile.mkdtemp(prefix='bedshape-{}-'.format(region))
+            for region, tmpdir in tmpdirs.items()}
+
+    try:
+        counted = map_regions([
+                (region, count_once, samples + (region,), dict(
+                    tmpdir=tmpdirs[region], **count_options))
+                for region in regions], jobs=jobs)
+        failed = list(filter(lambda r: r[1] != None, counted))
+        intermediate_names = {region: intermediate_name
+                for region, error, intermediate_name in counted
+                if error == None}
+
+        try:
+            if intermediate_names == {}:
+                raise norm.NormError('no region was profiled')
+            # Each profile is read once, for both the factor and its
+            # normalised columns.
+            tables = {region: norm.ProfileTable(intermediate_name)
+                    for region, intermediate_name in
+                        intermediate_names.items()}
+            norm_factor = norm.calc_norm_factor(
+                    [table.profile for table in tables.values()])
+            logger.info('Normalisation factor over {} regions: {}'.format(
+                    len(intermediate_names), norm_factor))
+            finished = map_regions([
+                    (region, finish_once, (intermediate_names[region], region),
+                        dict(norm_factor=norm_factor, table=tables[region],
+                            **finish_options))
+                    for region in regions if region in intermediate_names],
+                    jobs=jobs, on_result=on_result)
+        except norm.NormError as e:
+            logger.error(
+                    'Could not normalise over all regions: {}'.format(e))
+            finished = [(region, 'NormError: {}'.format(e), None)
+                    for region in intermediate_names]
+    finally:
+        if not keep:
+            for tmpdir in tmpdirs.values():
+                shutil.rmtree(tmpdir)
+
+    return failed + finished
+
+def make_sample_counts(alignment, region, *, out_name, min_mapq, tmpdir,
+        pipe=False, extracted=False, native_bam=False, native_counts=False,
+        window_length=None, downsampler=None, counts_cache=None):
+    r"""
+    Extract, clip and count a single sample. If pipe, intermediate files are
+    not written (see ``make_counts_piped``). If extracted, the sample has
+    already been extracted to out_name in tmpdir (see ``extract_batch``). If
+    native_bam, the alignment is read directly as an indexed BAM file (see
+    ``bam.Stream``) instead of through samtools view. If native_counts,
+    mutations are counted in-process (see ``make_counts_native``). If
+    window_length is given, regions longer than it are counted in windows (see
+    ``make_counts_windowed``). If downsampler is given, reads are downsampled
+    before they are clipped (see ``sam.Downsampler``). If counts_cache is
+    given, the counts are taken from it if they were cached by an earlier run,
+    and cached otherwise.
+
+    Returns
+    -------
+    str (the counts filename), or None if alignment is None
+    """
+    if alignment != None and counts_cache != None and \
+            os.path.isfile(alignment):
+        # Windows are downsampled independently, unlike the whole region.
+        key = counts_cache.get_key(alignment, region, min_mapq=min_mapq,
+                downsampling=None if downsampler == None else
+                    dict(downsampler.get_options(),
+                        window_length=window_length),
+                native_counts=native_counts)
+        counts_name = get_abs_join(
+                tmpdir, '{}.counts'.format(get_basename(out_name)))
+        with stages.stage('cache', sample=get_basename(out_name),
+                outputs=[counts_name]):
+            cached = counts_cache.fetch(key, counts_name)
+        if cached:
+            logger.info('Using cached counts for {}'.format(alignment))
+            return counts_name
+        counts_name = make_sample_counts(alignment, region, out_name=out_name,
+                min_mapq=min_mapq, tmpdir=tmpdir, pipe=pipe,
+                extracted=extracted, native_bam=native_bam,
+                native_counts=native_counts, window_length=window_length,
+                downsampler=downsampler)
+        counts_cache.store(key, counts_name)
+        return counts_name
+
+    if alignment != None and extracted:
+        alignment = get_abs_join(tmpdir, out_name)
+
+    if alignment != None and native_bam and bam.get_index_name(alignment) == None:
+        logger.warn('No .bai index for {}; reading it through samtools view '
+                'instead'.format(alignment))
+        native_bam = False
+
+    _, start, stop = parse_region(region)
+    if alignment != None and window_length != None and \
+            stop - start + 1 > window_length:
+        return make_counts_windowed(alignment, region,
+                window_length=window_length, out_name=out_name,
+                min_mapq=min_mapq, tmpdir=tmpdir, pipe=pipe,
+                extracted=extracted, native_bam=native_bam,
+                native_counts=native_counts, downsampler=downsampler)
+
+    return count_sample(alignment, region, out_name=out_name,
+            min_mapq=min_mapq, tmpdir=tmpdir, pipe=pipe, extracted=extracted,
+            native_bam=native_bam, native_counts=native_counts,
+            downsampler=downsampler)
+
+def count_sample(alignment, region, *, out_name, min_mapq, tmpdir,
+        pipe=False, extracted=False, native_bam=False, native_counts=False,
+        downsampler=None):
+    r"""
+    Clip and count a single sample over region, with the options of
+    ``make_sample_counts``. If extracted, alignment is the extracted SAM file
+    itself, which may cover more than region; otherwise the sample is extracted
+    to out_name in tmpdir first, unless it is not written at all. The counts
+    are named after out_name.
+
+    Returns
+    -------
+    str (the counts filename), or None if alignment is None
+    """
+    basename = get_basename(out_name)
+    if native_counts:
+        return make_counts_native(alignment, region, min_mapq=min_mapq,
+                tmpdir=tmpdir, basename=basename, extracted=extracted,
+                native_bam=native_bam, downsampler=downsampler)
+
+    if pipe:
+        return make_counts_piped(alignment, region, min_mapq=min_mapq,
+                tmpdir=tmpdir, basename=basename, extracted=extracted,
+                native_bam=native_bam, downsampler=downsampler)
+
+    if native_bam:
+        return make_counts(alignment, region, min_mapq=min_mapq,
+                tmpdir=tmpdir, native_bam=True, downsampler=downsampler,
+                clipped_name='{}.clipped.sam'.format(basename),
+                mut_name='{}.mut'.format(basename),
+                out_name='{}.counts'.format(basename))
+
+    alignment_name = alignment if extracted else extract_from_alignment(
+            alignment, region, out_name=out_name, tmpdir=tmpdir)
+    return make_counts(alignment_name, region, min_mapq=min_mapq,
+            tmpdir=tmpdir, downsampler=downsampler,
+            clipped_name='{}.clipped.sam'.format(basename),
+            mut_name='{}.mut'.format(basename),
+            out_name='{}.counts'.format(basename))
 
-    if not keep:
-        shutil.rmtree(tmpdir)
+def get_window_length(max_memory):
+    r"""
+    Get the length of the windows which a region is counted in, so that
+    counting its three samples together takes about max_memory MiB.
+
+    Returns
+    -------
+    int
+    """
+    return max(max_memory * 2**20 // (3 * BYTES_PER_POSITION),
+            MIN_WINDOW_LENGTH)
+
+def make_counts_windowed(alignment, region, *, window_length, out_name,
+        tmpdir, **kwargs):
+    r"""
+    Count a single sample over a long region in windows of window_length
+    positions (see ``counts.get_windows``), so that the memory taken by
+    counting is bounded by the window rather than the region. Each window is
+    counted (see ``count_sample``, which kwargs are passed to) with
+    WINDOW_OVERLAP positions either side, so that alignments and mutations
+    crossing its edges are counted as they are over the whole region. The rows
+    of the window itself are then appended to the counts of the region, and
+    the counts of the window removed. Positions past the last one counted
+    have no rows, as when the region is counted whole.
+
+    Returns
+    -------
+    str (the counts filename)
+    """
+    rname, start, stop = parse_region(region)
+    basename = get_basename(out_name)
+    counts_name = get_abs_join(tmpdir, '{}.counts'.format(basename))
+    windows = counts.get_windows(start, stop, window_length)
+    logger.info('Counting {} in {} windows of up to {} positions'.format(
+            alignment, len(windows), window_length))
+
+    missing = 0
+    with open(counts_name, 'w') as outfile:
+        for window_start, window_stop in windows:
+            counted_start = max(window_start - WINDOW_OVERLAP, start)
+            counted_stop = min(window_stop + WINDOW_OVERLAP, stop)
+            window_name = count_sample(alignment,
+                    '{}:{}-{}'.format(rname, counted_start, counted_stop),
+                    out_name='{}-window.sam'.format(basename),
+                    tmpdir=tmpdir, **kwargs)
+            with open(window_name) as window_file:
+                header = window_file.readline()
+                if outfile.tell() == 0:
+                    outfile.write(header)
+                missing = counts.write_window_rows(window_file, outfile,
+                        skip=window_start - counted_start,
+                        n_rows=window_stop - window_start + 1,
+                        n_columns=len(header.split('\t')), missing=missing)
+            os.remove(window_name)
+
+    return counts_name
+
+def extract_batches(alignments, regions, *, keep=False):
+    r"""
+    Extract all regions from each of the modified, untreated and denatured
+    alignments with ``extract_batch``, each region into its own temp
+    directory. The alignments are extracted concurrently. If any extraction
+    fails, the temp directories are removed, unless keep.
+
+    Returns
+    -------
+    dict of str (region) to str (temp directory)
+    """
+    tmpdirs = {region: tempfile.mkdtemp(prefix='bedshape-{}-'.format(region))
+            for region in regions}
+    try:
+        with concurrent.futures.ThreadPoolExecutor(3) as executor:
+            futures = [
+                    executor.submit(
+                        extract_batch, alignment, regions,
+                        {region: get_abs_join(tmpdirs[region], out_name)
+                            for region in regions})
+                    for alignment, out_name in zip(alignments, SAMPLE_NAMES)
+                    if alignment != None]
+            for future in futures:
+                future.result()
+    except BaseException:
+        if not keep:
+            for tmpdir in tmpdirs.values():
+                shutil.rmtree(tmpdir)
+        raise
+    return tmpdirs
+
+def extract_batch(alignment, regions, out_names):
+    r"""
+    Extract many regions from an alignment with a single samtools view, instead
+    of one per region. Each read is written to the extracted SAM file of every
+    region it overlaps, as if ``extract_from_alignment`` was run per region.
+
+    Parameters
+    ----------
+    alignment: str
+    regions: list of str
+    out_names: dict of str (region) to str (SAM filename to write)
+    """
+    parsed_regions = {region: parse_region(region) for region in regions}
+    router = sam.Router([(region,) + parsed_regions[region]
+            for region in regions])
+
+    bed_fd, bed_name = tempfile.mkstemp(suffix='.bed')
+    cmd = ['samtools', 'view', '-M', '-L', bed_name, alignment]
+    outfiles = {}
+    written = set()
+    try:
+        with os.fdopen(bed_fd, 'w') as bedfile:
+            for rname, start, stop in parsed_regions.values():
+                # BED is 0-based and half-open, regions are 1-based and
+                # closed.
+                bedfile.write('{}\t{}\t{}\n'.format(rname, start - 1, stop))
+
+        logger.info(' '.join(cmd))
+        start = time.perf_counter()
+        with subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                universal_newlines=True) as process:
+            for line in process.stdout:
+                fields = line.split('\t', 6)
+                rname = fields[2]
+                first, last = clip.reference_span(fields[3], fields[5])
+
+                for region in router.overlapping(rname, first, last):
+                    if region not in outfiles:
+                        outfiles[region] = open(out_names[region],
+                                'a' if region in written else 'w')
+                        written.add(region)
+                    outfiles[region].write(line)
+
+                # Reads come sorted by coordinate, so no more reads will reach
+                # the regions already passed.
+                for region in list(outfiles):
+                    region_rname, _, region_stop = parsed_regions[region]
+                    if region_rname != rname or region_stop < first:
+                        outfiles.pop(region).close()
+            stages.wait(process, 'batch-extract', start=start,
+                    sample=get_basename(alignment), check=True)
+    finally:
+        for outfile in outfiles.values():
+            outfile.close()
+        os.remove(bed_name)
+
+    # Regions without reads still get an (empty) extracted file.
+    for region in regions:
+        if region not in written:
+            open(out_names[region], 'w').close()
 
 def extract_from_reference(reference, region, tmpdir='./'):
     out_name = '{}.fa'.format(region.replace(':', '-'))
     out_name = get_abs_join(tmpdir, out_name)
+
+    # Slice the region in-process if the reference is already indexed.
+    fasta_reference = fasta.get_reference(reference)
+    if fasta_reference != None:
+        with stages.stage('reference', outputs=[out_name]), \
+                open(out_name, 'w') as outfile:
+            fasta_reference.write(region, outfile)
+        return out_name
+
     cmd = ['samtools', 'faidx', reference, region]
     with open(out_name, 'w') as outfile:
         logger.info(' '.join(cmd))
-        subprocess.run(cmd, stdout=outfile)
+        stages.run(cmd, 'reference', outputs=[out_name], stdout=outfile,
+                check=True)
     return out_name
 
 def extract_from_alignment(alignment, region, tmpdir='./', out_name=None):
@@ -152,27 +759,38 @@ def extract_from_alignment(alignment, region, tmpdir='./', out_name=None):
     cmd = ['samtools', 'view', alignment, region]
     with open(out_name, 'w') as outfile:
         logger.info(' '.join(cmd))
-        subprocess.run(cmd, stdout=outfile)
+        stages.run(cmd, 'extract', sample=get_basename(out_name),
+                outputs=[out_name], stdout=outfile, check=True)
 
     return out_name
 
 def make_counts(alignment, region, *, min_mapq, tmpdir='./',
-        clipped_name=None, mut_name=None, out_name=None):
+        clipped_name=None, mut_name=None, out_name=None, native_bam=False,
+        downsampler=None):
     if alignment == None:
         return None
 
-    start, stop = region.split(':')[1].split('-')
-    start, stop = int(start), int(stop)
-
-    with open(alignment) as infile:
-        sam_file = sam.File(infile)
-    sam_file.soft_clip(start, stop)
+    rname, start, stop = parse_region(region)
 
     clipped_name = clipped_name if clipped_name != None else \
             '{}.clipped.sam'.format(get_basename(alignment))
     clipped_name = get_abs_join(tmpdir, clipped_name)
-    with open(clipped_name, 'w') as outfile:
-        outfile.write(str(sam_file))
+    # e.g. modified, from modified.clipped.sam
+    sample = get_basename(get_basename(clipped_name))
+    if native_bam:
+        logger.info('{} (native) | clip'.format(alignment))
+        with stages.stage('clip', sample=sample, outputs=[clipped_name]), \
+                bam.File(alignment) as bam_file, \
+                open(clipped_name, 'wb') as outfile:
+            bam.Stream(bam_file, rname, start, stop,
+                    downsampler=downsampler).write(outfile)
+    else:
+        with stages.stage('clip', sample=sample, inputs=[alignment],
+                    outputs=[clipped_name]), \
+                open(alignment, 'rb') as infile, \
+                open(clipped_name, 'wb') as outfile:
+            sam.Stream(infile, start, stop,
+                    downsampler=downsampler).write(outfile)
 
     mut_name = mut_name if mut_name != None else \
             '{}.mut'.format(get_basename(alignment))
@@ -180,7 +798,8 @@ def make_counts(alignment, region, *, min_mapq, tmpdir='./',
     cmd = [constants.MUT_PARSER_BIN, '-i', clipped_name, '-o', mut_name,
             '--min_mapq', str(min_mapq), '--min_qual', str(min_mapq)]
     logger.info(' '.join(cmd))
-    subprocess.run(cmd)
+    stages.run(cmd, 'parse', sample=sample, inputs=[clipped_name],
+            outputs=[mut_name], check=True)
 
     out_name = out_name if out_name != None else \
             '{}.counts'.format(get_basename(alignment))
@@ -188,48 +807,402 @@ def make_counts(alignment, region, *, min_mapq, tmpdir='./',
     cmd = [constants.MUT_COUNTER_BIN, '-i', mut_name,
             '-c', out_name, '-w']
     logger.info(' '.join(cmd))
-    subprocess.run(cmd)
+    stages.run(cmd, 'count', sample=sample, inputs=[mut_name],
+            outputs=[out_name], check=True)
+
+    return out_name
+
+def make_counts_piped(alignment, region, *, min_mapq, tmpdir='./', basename,
+        extracted=False, native_bam=False, downsampler=None):
+    r"""
+    Like ``extract_from_alignment`` followed by ``make_counts``, but without
+    intermediate files. samtools view is read directly by the clipper, which
+    writes into a named pipe read by shapemapper_mutation_parser, which in turn
+    writes into a named pipe read by shapemapper_mutation_counter. If
+    extracted, alignment is a SAM file already extracted for the region, and is
+    read instead of samtools view. If native_bam, alignment is an indexed BAM
+    file, which is read directly by the clipper.
+
+    Returns
+    -------
+    str (the counts filename), or None if alignment is None
+    """
+    if alignment == None:
+        return None
+
+    rname, start, stop = parse_region(region)
+
+    clipped_name = get_abs_join(tmpdir, '{}.clipped.sam'.format(basename))
+    mut_name = get_abs_join(tmpdir, '{}.mut'.format(basename))
+    out_name = get_abs_join(tmpdir, '{}.counts'.format(basename))
+    os.mkfifo(clipped_name)
+    os.mkfifo(mut_name)
+
+    view_cmd = ['samtools', 'view', alignment, region]
+    parser_cmd = [constants.MUT_PARSER_BIN, '-i', clipped_name, '-o', mut_name,
+            '--min_mapq', str(min_mapq), '--min_qual', str(min_mapq)]
+    counter_cmd = [constants.MUT_COUNTER_BIN, '-i', mut_name,
+            '-c', out_name, '-w']
+    logger.info('{} | clip | {} | {}'.format(
+            alignment if extracted else
+                '{} (native)'.format(alignment) if native_bam else
+                ' '.join(view_cmd),
+            ' '.join(parser_cmd), ' '.join(counter_cmd)))
+
+    # The stages run concurrently, so their wall times overlap.
+    pipeline = Pipeline(sample=basename)
+    try:
+        if extracted:
+            infile = open(alignment, 'rb')
+        elif native_bam:
+            infile = bam.File(alignment)
+        else:
+            infile = pipeline.start(view_cmd, 'extract',
+                    stdout=subprocess.PIPE).stdout
+        parser = pipeline.start(parser_cmd, 'parse')
+        pipeline.start(counter_cmd, 'count', outputs=[out_name])
+        with stages.stage('clip', sample=basename) as measured, infile, \
+                open_fifo(clipped_name, reader=parser,
+                    pipeline=pipeline) as outfile:
+            if native_bam:
+                measured['bytes_out'] = bam.Stream(infile, rname, start, stop,
+                        downsampler=downsampler).write(outfile)
+            else:
+                measured['bytes_out'] = sam.Stream(infile, start, stop,
+                        downsampler=downsampler).write(outfile)
+        pipeline.wait()
+    finally:
+        pipeline.kill()
+        os.remove(clipped_name)
+        os.remove(mut_name)
 
     return out_name
 
+def make_counts_native(alignment, region, *, min_mapq, tmpdir='./', basename,
+        extracted=False, native_bam=False, downsampler=None):
+    r"""
+    Like ``make_counts_piped``, but mutations are counted in-process from the
+    clipped alignments (see ``counts.Counter``), instead of by
+    shapemapper_mutation_parser and shapemapper_mutation_counter. As with
+    those, min_mapq is also the minimum base quality.
+
+    Returns
+    -------
+    str (the counts filename), or None if alignment is None
+    """
+    if alignment == None:
+        return None
+
+    rname, start, stop = parse_region(region)
+    out_name = get_abs_join(tmpdir, '{}.counts'.format(basename))
+
+    view_cmd = ['samtools', 'view', alignment, region]
+    logger.info('{} | clip | count (native)'.format(
+            alignment if extracted else
+                '{} (native)'.format(alignment) if native_bam else
+                ' '.join(view_cmd)))
+
+    view = None
+    start_time = time.perf_counter()
+    try:
+        if extracted:
+            infile = open(alignment, 'rb')
+        elif native_bam:
+            infile = bam.File(alignment)
+        else:
+            view = subprocess.Popen(view_cmd, stdout=subprocess.PIPE)
+            infile = view.stdout
+        counter = counts.Counter(stop - start + 1, min_mapq=min_mapq,
+                min_qual=min_mapq)
+        # Alignments are clipped as they are counted, in the same stage.
+        with stages.stage('count', sample=basename, outputs=[out_name]), \
+                infile:
+            if native_bam:
+                counter.count(bam.Stream(infile, rname, start, stop,
+                        downsampler=downsampler))
+            else:
+                counter.count(sam.Stream(infile, start, stop,
+                        downsampler=downsampler))
+            counter.write(out_name)
+        if view != None:
+            stages.wait(view, 'extract', start=start_time, sample=basename,
+                    check=True)
+    finally:
+        if view != None and view.poll() == None:
+            view.kill()
+
+    return out_name
+
+class Pipeline:
+    """
+    Represents the subprocesses of a pipeline joined by named pipes. If any of
+    them fails, the others may block forever opening or reading their pipes,
+    so they are all polled together, and recorded as stages as each exits.
+    """
+
+    # Seconds between polls of the subprocesses.
+    POLL_INTERVAL = 0.01
+
+    def __init__(self, *, sample=None):
+        self.sample = sample
+        self.start_time = time.perf_counter()
+        self.processes = []  # tuples of Popen, str (stage) and list of str
+
+    def start(self, cmd, name, *, outputs=(), **kwargs):
+        r"""
+        Start cmd, as ``subprocess.Popen``, as the stage name.
+
+        Returns
+        -------
+        ``subprocess.Popen``
+        """
+        process = subprocess.Popen(cmd, **kwargs)
+        self.processes.append((process, name, list(outputs)))
+        return process
+
+    def poll(self):
+        r"""
+        Check whether every subprocess has exited, raising
+        ``subprocess.CalledProcessError`` if any has failed.
+
+        Returns
+        -------
+        bool
+        """
+        exited = True
+        for process, name, outputs in self.processes:
+            if stages.wait(process, name, start=self.start_time,
+                    sample=self.sample, outputs=outputs, check=True,
+                    block=False) == None:
+                exited = False
+        return exited
+
+    def wait(self):
+        while not self.poll():
+            time.sleep(self.POLL_INTERVAL)
+
+    def kill(self):
+        for process, _, _ in self.processes:
+            if process.poll() == None:
+                process.kill()
+                process.wait()
+
+class FifoWriter:
+    """
+    Writes into a named pipe, in binary mode, without blocking on it: opening
+    the pipe, and writing whenever it is full, wait on the subprocesses of the
+    pipeline instead, failing if any of them fails, or if the reader exits
+    before reading everything.
+    """
+
+    # Bytes buffered before a write to the pipe.
+    BUFFER_SIZE = 2**16
+
+    def __init__(self, fifo_name, *, reader, pipeline):
+        self.fifo_name = fifo_name
+        self.reader, self.pipeline = reader, pipeline
+        self.buffer = bytearray()
+        self.fd = None
+        while self.fd == None:
+            try:
+                self.fd = os.open(fifo_name, os.O_WRONLY | os.O_NONBLOCK)
+            except OSError:  # ENXIO, no reader yet
+                self._check()
+                time.sleep(Pipeline.POLL_INTERVAL)
+
+    def _check(self):
+        self.pipeline.poll()
+        if self.reader.returncode != None:
+            raise RuntimeError('{} exited before reading {}'.format(
+                    self.reader.args[0], self.fifo_name))
+
+    def write(self, data):
+        self.buffer += data
+        if len(self.buffer) >= self.BUFFER_SIZE:
+            self.flush()
+
+    def flush(self):
+        written = 0
+        with memoryview(self.buffer) as view:
+            while written < len(view):
+                try:
+                    written += os.write(self.fd, view[written:])
+                except BlockingIOError:
+                    self._check()
+                    select.select([], [self.fd], [], Pipeline.POLL_INTERVAL)
+                except BrokenPipeError:
+                    self._check()
+                    raise
+        self.buffer.clear()
+
+    def close(self):
+        if self.fd == None:
+            return
+        try:
+            self.flush()
+        finally:
+            os.close(self.fd)
+            self.fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type == None:
+            self.close()
+        elif self.fd != None:
+            os.close(self.fd)
+            self.fd = None
+
+def open_fifo(fifo_name, *, reader, pipeline):
+    r"""
+    Open a named pipe for writing, in binary mode (see ``FifoWriter``).
+
+    Returns
+    -------
+    ``FifoWriter``
+    """
+    return FifoWriter(fifo_name, reader=reader, pipeline=pipeline)
+
 def make_profile(samples, ref_name, out_name, *, tmpdir='./',
-        outdir, min_depth, max_bg):
+        min_depth, max_bg, in_process=False):
     intermediate_name = '{}.profile'.format(get_basename(out_name))
     intermediate_name = get_abs_join(tmpdir, intermediate_name)
-    cmd = ['python3', constants.PROFILER_BIN, '--fa', ref_name, '--counts'] \
-            + samples + ['--out', intermediate_name, '--mindepth',
-            str(min_depth), '--maxbg', str(max_bg)]
-    logger.info(' '.join(cmd))
-    subprocess.run(cmd)
+    args = ['--fa', ref_name, '--counts'] + samples + ['--out',
+            intermediate_name, '--mindepth', str(min_depth), '--maxbg',
+            str(max_bg)]
+    scripts.run(constants.PROFILER_BIN, args, 'profile',
+            in_process=in_process, inputs=samples + [ref_name],
+            outputs=[intermediate_name], check=True)
 
-    out_name = get_abs_join(outdir, out_name)
-    cmd = ['python3', constants.NORMALISER_BIN, '--tonorm', intermediate_name,
-            '--normout', out_name]
-    logger.info(' '.join(cmd))
-    subprocess.run(cmd)
+    return intermediate_name
 
-    return out_name
+def normalize(profiles, out_names, *, norm_factor=None, tables=None):
+    r"""
+    Normalise profiles into out_names, as shapemapper2's normalize_profiles.py
+    would, but without starting a new interpreter. If norm_factor is None, it is
+    calculated over all profiles. tables are the profiles, if they have already
+    been read (see ``norm.ProfileTable``), in which case they are not read
+    again.
+
+    Returns
+    -------
+    float (the normalisation factor)
+    """
+    logger.info('normalize_profiles --tonorm {} --normout {}'.format(
+            ' '.join(profiles), ' '.join(out_names)))
+    with stages.stage('normalise', inputs=profiles, outputs=out_names):
+        if tables == None:
+            tables = list(map(norm.ProfileTable, profiles))
+        if norm_factor == None:
+            norm_factor = norm.calc_norm_factor(
+                    [table.profile for table in tables])
+
+        for table, out_name in zip(tables, out_names):
+            table.write_norm_columns(out_name, norm_factor)
+
+    return norm_factor
 
 def render_figure(profile, out_name, *, outdir, min_depth, max_bg):
     out_name = get_abs_join(outdir, out_name)
-    cmd = ['python3', constants.RENDERER_BIN, '--infile', profile,
-            '--plot', out_name, '--mindepth', str(min_depth), '--maxbg',
-            str(max_bg)]
-    logger.info(' '.join(cmd))
-    subprocess.run(cmd)
+    args = ['--infile', profile, '--plot', out_name, '--mindepth',
+            str(min_depth), '--maxbg', str(max_bg)]
+    scripts.run(constants.RENDERER_BIN, args, 'render', inputs=[profile],
+            outputs=[out_name], check=True)
 
     return out_name
 
-def make_shape(profile, basename, *, outdir):
+def render_batch(regions, *, outdir, plot_mode, min_depth):
+    r"""
+    Render the figures of regions in outdir after they are profiled, in this
+    process, reusing one figure (see ``plot.Renderer``): as a PDF per region
+    (batch), a PNG per region (png), or the pages of a single PDF of all
+    regions (combined). Figures already newer than their profiles are not
+    rendered again.
+
+    Returns
+    -------
+    list of results of ``call_for_region``
+    """
+    raster = plot_mode == 'png'
+    renderer = plot.Renderer(min_depth=min_depth, raster=raster,
+            dpi=72 if raster else 100)
+    profile_names = [get_abs_join(outdir, '{}.profile'.format(region))
+            for region in regions]
+
+    if plot_mode == 'combined':
+        if regions == []:
+            return []
+        out_name = get_abs_join(outdir, COMBINED_FIGURE_NAME)
+        return [call_for_region(COMBINED_FIGURE_NAME, render_batch_figures,
+                (renderer, profile_names, out_name, regions),
+                dict(combined=True))]
+
+    results = []
+    for region, profile_name in zip(regions, profile_names):
+        out_name = get_abs_join(outdir, '{}.{}'.format(
+                region, 'png' if raster else 'pdf'))
+        if os.path.isfile(out_name) and \
+                os.path.getmtime(out_name) >= os.path.getmtime(profile_name):
+            continue
+        results.append(call_for_region(region, render_batch_figures,
+                (renderer, [profile_name], out_name, [region]), {}))
+    return results
+
+def render_batch_figures(renderer, profile_names, out_name, titles, *,
+        combined=False):
+    r"""
+    Render profiles with renderer: the first into out_name, or if combined,
+    each as a page of out_name.
+    """
+    logger.info('render {} into {}'.format(' '.join(profile_names), out_name))
+    with stages.stage('render', inputs=profile_names, outputs=[out_name]):
+        if combined:
+            renderer.render_pages(profile_names, out_name, titles)
+        else:
+            renderer.render(profile_names[0], out_name, titles[0])
+
+    return out_name
+
+def get_output_names(region, *, outdir, skip_plot, skip_shape):
+    r"""
+    Get the names of the output files of a region, as written by
+    ``finish_once``.
+
+    Returns
+    -------
+    list of str
+    """
+    out_names = ['{}.profile'.format(region)]
+    if not skip_plot:
+        out_names.append('{}.pdf'.format(region))
+    if not skip_shape:
+        out_names.extend('{}{}'.format(region, suffix) for suffix in
+                ['.shape', '.map', '.varna.txt', '.ribosketch.txt'])
+    return [get_abs_join(outdir, out_name) for out_name in out_names]
+
+def make_shape(profile, basename, *, outdir, in_process=False):
     shape_filename = get_abs_join(outdir, basename+'.shape')
     map_filename = get_abs_join(outdir, basename+'.map')
     varna_filename = get_abs_join(outdir, basename+'.varna.txt')
     ribosketch_filename = get_abs_join(outdir, basename+'.ribosketch.txt')
-    cmd = ['python3', constants.TAB2SHAPE_BIN, '--infile', profile,
-            '--map', map_filename, '--shape', shape_filename, '--varna',
-            varna_filename, '--ribosketch', ribosketch_filename]
-    logger.info(' '.join(cmd))
-    subprocess.run(cmd )
+    args = ['--infile', profile, '--map', map_filename, '--shape',
+            shape_filename, '--varna', varna_filename, '--ribosketch',
+            ribosketch_filename]
+    scripts.run(constants.TAB2SHAPE_BIN, args, 'shape',
+            in_process=in_process, inputs=[profile], outputs=[shape_filename,
+                map_filename, varna_filename, ribosketch_filename],
+            check=True)
+
+def parse_region(region):
+    r"""
+    Returns
+    -------
+    tuple of str (rname), int (start) and int (stop)
+    """
+    rname, coords = region.rsplit(':', 1)
+    start, stop = coords.split('-')
+    return rname, int(start), int(stop)
 
 def get_abs_join(_dir, _fn):
     return os.path.abspath(os.path.join(_dir, _fn))
@@ -1,5 +1,6 @@
-import logging
-from alignment import Alignment, CigarUnavailableError, ClippedRegionEmptyError
+import bisect, heapq, itertools, logging, random
+import clip
+from alignment import CigarUnavailableError, ClippedRegionEmptyError
 
 logger = logging.getLogger('bedshape')
 
@@ -38,7 +39,7 @@ class File:
             except ClippedRegionEmptyError:
                 lines_skipped += 1
                 logger.debug('skipped {} (no mappable bases after clipping)'.format(
-                        line.fields[0]))
+                        line.name))
         logger.warn('{} lines did not map after the clip'.format(lines_skipped))
         logger.info('Clipped {} lines ({} skipped)'.format(
                 total_lines-lines_skipped, lines_skipped))
@@ -47,46 +48,336 @@ class File:
     def __repr__(self):
         return '\n'.join([str(line) for line in self.lines])
 
+class Stream:
+    """
+    Represents a SAM file which is read, soft-clipped and written one line at a
+    time, so that memory use does not grow with the number of lines.
+    """
+
+    def __init__(self, iterable_lines, start, stop, downsampler=None):
+        self.iterable_lines = iterable_lines
+        self.start, self.stop = start, stop
+        self.downsampler = downsampler
+        self.total_lines = 0
+        self.lines_unmapped = 0
+        self.lines_downsampled = 0
+        self.lines_clipped_out = 0
+        # Differences in depth along the region, of the lines kept after
+        # downsampling.
+        self.depth_changes = None
+
+    def read(self):
+        r"""
+        Parse the lines, skipping those without mapping information.
+
+        Returns
+        -------
+        generator of ``Line``
+        """
+        for line_string in self.iterable_lines:
+            self.total_lines += 1
+            try:
+                line = Line(line_string)
+            except CigarUnavailableError:
+                self.lines_unmapped += 1
+                logger.debug('skipped {} (no mapping information)'.format(
+                        line_string.split()[0].decode()))
+                continue
+            yield line
+
+    def __iter__(self):
+        lines = self.read()
+        if self.downsampler != None:
+            lines = self.downsampler.downsample(self, lines)
+            self.depth_changes = [0] * (self.stop - self.start + 2)
+
+        for line in lines:
+            try:
+                line.soft_clip(self.start, self.stop)
+            except ClippedRegionEmptyError:
+                self.lines_clipped_out += 1
+                logger.debug('skipped {} (no mappable bases after clipping)'.format(
+                        line.name))
+                continue
+
+            if self.depth_changes != None and \
+                    line.type == Line.TYPE_ALIGNMENT:
+                # Positions are now relative to the region.
+                first, last = clip.reference_span(line.pos, line.cigar)
+                self.depth_changes[first - 1] += 1
+                self.depth_changes[last] -= 1
+
+            yield line
+
+        self.log_counts()
+
+    def write(self, outfile):
+        r"""
+        Write the clipped lines to outfile (opened in binary mode) as they are
+        read.
+
+        Returns
+        -------
+        int (the number of bytes written)
+        """
+        written = 0
+        for line in self:
+            line_bytes = bytes(line)
+            if written > 0:
+                outfile.write(b'\n')
+                written += 1
+            outfile.write(line_bytes)
+            written += len(line_bytes)
+        return written
+
+    def log_counts(self):
+        lines_read = self.total_lines - self.lines_unmapped
+        logger.warn('{} lines were skipped (not mapping to the region)'.format(
+                self.lines_unmapped))
+        logger.info('Read {} lines ({} skipped)'.format(
+                lines_read, self.lines_unmapped))
+        logger.warn('{} lines did not map after the clip'.format(
+                self.lines_clipped_out))
+        logger.info('Clipped {} lines ({} skipped)'.format(
+                lines_read - self.lines_downsampled - self.lines_clipped_out,
+                self.lines_clipped_out))
+        if self.depth_changes != None:
+            depths = list(itertools.accumulate(self.depth_changes[:-1]))
+            logger.info(
+                    'Downsampled away {} of {} lines; depth over the region '
+                    'is {:.1f} on average, and {} at most'.format(
+                        self.lines_downsampled, lines_read,
+                        sum(depths) / len(depths), max(depths)))
+
+class Downsampler:
+    """
+    Downsamples the lines of a ``Stream`` before they are clipped, so that the
+    cost of clipping and counting is bounded. Lines are kept deterministically
+    for a given seed and region. Only lines overlapping the region are
+    downsampled; the others are passed on, to be clipped out.
+
+    If target_depth is given, lines are kept in order of position (shuffled
+    among lines at the same position) as long as the depth where they enter the
+    region is below target_depth. If max_reads is given, at most max_reads
+    lines are then kept, by reservoir sampling.
+    """
+
+    def __init__(self, *, max_reads=None, target_depth=None, seed=0):
+        self.max_reads = max_reads
+        self.target_depth = target_depth
+        self.seed = seed
+
+    def get_options(self):
+        r"""
+        Returns
+        -------
+        dict of str (option) to value
+        """
+        return {'max_reads': self.max_reads,
+                'target_depth': self.target_depth, 'seed': self.seed}
+
+    def downsample(self, stream, lines):
+        r"""
+        Downsample lines, counting the lines downsampled away in stream.
+
+        Returns
+        -------
+        generator of ``Line``
+        """
+        rng = random.Random('{}:{}-{}'.format(
+                self.seed, stream.start, stream.stop))
+        if self.target_depth != None:
+            lines = self.cap_depth(stream, lines, rng)
+        if self.max_reads != None:
+            lines = self.sample_reservoir(stream, lines, rng)
+        return lines
+
+    def cap_depth(self, stream, lines, rng):
+        ends = []  # heap of the last positions of the lines kept
+        batch, batch_first = [], None
+        for line in lines:
+            # Header lines are passed on, as lines outside the region are.
+            if line.type == Line.TYPE_HEADER:
+                yield line
+                continue
+            first, last = clip.reference_span(line.pos, line.cigar)
+            if last < stream.start or first > stream.stop:
+                yield line
+                continue
+            first = max(first, stream.start)
+            if first != batch_first:
+                yield from self._cap_batch(stream, batch, batch_first, ends,
+                        rng)
+                batch, batch_first = [], first
+            batch.append((line, min(last, stream.stop)))
+        yield from self._cap_batch(stream, batch, batch_first, ends, rng)
+
+    def _cap_batch(self, stream, batch, first, ends, rng):
+        rng.shuffle(batch)
+        while ends != [] and ends[0] < first:
+            heapq.heappop(ends)
+        for line, last in batch:
+            if len(ends) < self.target_depth:
+                heapq.heappush(ends, last)
+                yield line
+            else:
+                stream.lines_downsampled += 1
+
+    def sample_reservoir(self, stream, lines, rng):
+        reservoir = []
+        n_lines = 0
+        for line in lines:
+            # Header lines are passed on, as lines outside the region are.
+            if line.type == Line.TYPE_HEADER:
+                yield line
+                continue
+            first, last = clip.reference_span(line.pos, line.cigar)
+            if last < stream.start or first > stream.stop:
+                yield line
+                continue
+            if n_lines < self.max_reads:
+                reservoir.append((n_lines, line))
+            else:
+                i = rng.randrange(n_lines + 1)
+                if i < self.max_reads:
+                    reservoir[i] = (n_lines, line)
+            n_lines += 1
+        stream.lines_downsampled += max(n_lines - self.max_reads, 0)
+
+        # Back in the order they were read
+        reservoir.sort(key=lambda r: r[0])
+        for _, line in reservoir:
+            yield line
+
+class Router:
+    """
+    Finds the regions which a read overlaps, out of many regions.
+    """
+
+    def __init__(self, regions):
+        r"""
+        Parameters
+        ----------
+        regions: list of tuples of str (region), str (rname), int (start) and
+                 int (stop)
+        """
+        self.regions = {}
+        for region in regions:
+            self.regions.setdefault(region[1], []).append(region)
+        for rname_regions in self.regions.values():
+            rname_regions.sort(key=lambda r: (r[2], r[3]))
+        self.starts = {rname: [r[2] for r in rname_regions]
+                for rname, rname_regions in self.regions.items()}
+        self.max_lengths = {rname: max(map(lambda r: r[3]-r[2]+1, rname_regions))
+                for rname, rname_regions in self.regions.items()}
+
+    def overlapping(self, rname, first, last):
+        r"""
+        Get the regions overlapping the reference positions [first, last].
+
+        Returns
+        -------
+        list of str
+        """
+        if rname not in self.regions:
+            return []
+        starts = self.starts[rname]
+        # No region starting before this can reach first.
+        lo = bisect.bisect_left(starts, first - self.max_lengths[rname] + 1)
+        hi = bisect.bisect_right(starts, last)
+        return [r[0] for r in self.regions[rname][lo:hi] if r[3] >= first]
+
 class Line:
     """
-    Represents a line in the SAM file.
+    Represents a line in the SAM file. Lines are handled as bytes, and only the
+    11 mandatory fields are split; the optional fields are kept as they are,
+    and only searched for the MD tag when it is needed.
     """
 
     TYPE_HEADER = 0
     TYPE_ALIGNMENT = 1
 
     def __init__(self, line_string):
-        self.type = self.TYPE_HEADER if line_string.startswith('@') \
+        if isinstance(line_string, str):
+            line_string = line_string.encode()
+        line_string = line_string.rstrip(b'\r\n')
+
+        self.type = self.TYPE_HEADER if line_string.startswith(b'@') \
                 else self.TYPE_ALIGNMENT
 
         if self.type == self.TYPE_HEADER:
             self.fields = [line_string]
             return
 
-        self.fields = line_string.split()
-        pos, cigar = self.fields[3], self.fields[5]
+        # fields[11], if present, holds all the optional fields.
+        self.fields = line_string.split(b'\t', 11)
+        self.pos, self.cigar = int(self.fields[3]), self.fields[5].decode()
 
-        if cigar == '*':
+        if self.cigar == '*':
             raise CigarUnavailableError
 
-        md = next(filter(lambda field: field.startswith('MD:Z:'), self.fields))
-        md = md.replace('MD:Z:', '')
-        self.alignment = Alignment(pos, cigar, md)
+        self._md = None
+        self._md_span = None  # (start, end) of the MD value in fields[11]
+
+    @property
+    def md(self):
+        if self._md == None:
+            tags = b'\t' + self.fields[11] if len(self.fields) > 11 else b''
+            md_start = tags.find(b'\tMD:Z:')
+            if md_start == -1:
+                raise RuntimeError('No MD tag for {}'.format(self.name))
+            md_end = tags.find(b'\t', md_start + 1)
+            md_end = len(tags) if md_end == -1 else md_end
+            # Offsets into fields[11], which lacks the leading tab
+            self._md_span = (md_start + 5, md_end - 1)
+            self._md = tags[md_start+6:md_end].decode()
+        return self._md
+
+    @md.setter
+    def md(self, md):
+        self.md  # locate the MD tag, if not yet located
+        self._md = md
+
+    @property
+    def name(self):
+        return self.fields[0].decode()
+
+    @property
+    def mapq(self):
+        return int(self.fields[4])
+
+    @property
+    def seq(self):
+        return self.fields[9]
+
+    @property
+    def qual(self):
+        return self.fields[10]
 
     def soft_clip(self, start, stop):
         if self.type == self.TYPE_HEADER:
             return
 
+        # Reads outside the region, or entirely within it, need not be
+        # clipped base by base.
+        overlap = clip.get_overlap(self.pos, self.cigar, start, stop)
+        if overlap == clip.OVERLAP_NONE:
+            raise ClippedRegionEmptyError
+
         self.strip_paired_end_info()
 
-        self.fields[2] = '{}:{}-{}'.format(self.fields[2], start, stop)
-        self.alignment.soft_clip(start, stop)
-        self.fields[3] = str(self.alignment.pos)
-        self.fields[5] = self.alignment.cigar
-        self.fields = list(map(
-                lambda field: 'MD:Z:'+self.alignment.md if \
-                        field.startswith('MD:Z:') else field,
-                self.fields))
+        if overlap == clip.OVERLAP_CONTAINED:
+            self.pos = self.pos - start + 1
+        else:
+            self.pos, self.cigar, self.md = clip.soft_clip(
+                    self.pos, self.cigar, self.md, start, stop)
+            self.fields[5] = self.cigar.encode()
+            md_start, md_end = self._md_span
+            self.fields[11] = self.fields[11][:md_start] + \
+                    self.md.encode() + self.fields[11][md_end:]
+            self._md_span = (md_start, md_start + len(self.md))
+        self.fields[2] = b'%s:%d-%d' % (self.fields[2], start, stop)
+        self.fields[3] = b'%d' % self.pos
 
     def strip_paired_end_info(self):
         '''
@@ -110,12 +401,15 @@ class Line:
         '''
         flags = int(self.fields[1])
         flags &= 0b00111100
-        self.fields[1] = str(flags)
+        self.fields[1] = b'%d' % flags
+
+        self.fields[6:9] = [b'*', b'0', b'0']
 
-        self.fields[6:9] = ['*', '0', '0']
+    def __bytes__(self):
+        return b'\t'.join(self.fields)
 
     def __repr__(self):
-        return '\t'.join(self.fields)
+        return bytes(self).decode()
 
 
 class NoMappableBaseException(Exception):
@@ -0,0 +1,68 @@
+import builtins, logging, os, sys, threading
+import stages
+
+logger = logging.getLogger('bedshape')
+
+# The compiled code of each script run in-process, by filename, so that each
+# is read and compiled once per process.
+_compiled = {}
+
+# Running a script in-process patches sys.argv and sys.path, which are shared
+# by every thread.
+_lock = threading.Lock()
+
+def run(script, args, name, *, in_process=False, inputs=(), outputs=(),
+        check=False):
+    r"""
+    Run a Python script (one of shapemapper2's) with args, and record it as a
+    stage. If in_process, the script is run in this process (see
+    ``run_in_process``), so that the interpreter is not started again and
+    modules the script imports (e.g. NumPy or matplotlib) are imported once;
+    if that fails, the script is run in a subprocess instead. If check, a
+    non-zero return code raises ``subprocess.CalledProcessError``.
+
+    Returns
+    -------
+    int (the return code)
+    """
+    cmd = ['python3', script] + args
+    if in_process:
+        logger.info('{} (in-process)'.format(' '.join(cmd)))
+        try:
+            with stages.stage(name, inputs=inputs, outputs=outputs):
+                run_in_process(script, args)
+            return 0
+        except Exception as e:
+            logger.warn('{} failed in-process ({}: {}); running it in a '
+                    'subprocess instead'.format(
+                        os.path.basename(script), type(e).__name__, e))
+    else:
+        logger.info(' '.join(cmd))
+    return stages.run(cmd, name, inputs=inputs, outputs=outputs, check=check)
+
+def run_in_process(script, args):
+    r"""
+    Run a Python script as __main__, as the interpreter would, with sys.argv
+    set to args and the directory of the script first in sys.path.
+    """
+    if script not in _compiled:
+        with open(script) as script_file:
+            _compiled[script] = compile(script_file.read(), script, 'exec')
+
+    with _lock:
+        argv, path = sys.argv, sys.path[:]
+        sys.argv = [script] + args
+        sys.path.insert(0, os.path.dirname(os.path.abspath(script)))
+        try:
+            exec(_compiled[script], {'__name__': '__main__',
+                    '__file__': script, '__builtins__': builtins})
+        except SystemExit as e:
+            if e.code not in (None, 0):
+                raise RuntimeError('{} exited with {}'.format(
+                        os.path.basename(script), e.code))
+        finally:
+            sys.argv = argv
+            sys.path[:] = path
+            # Scripts which plot leave their figures open.
+            if 'matplotlib.pyplot' in sys.modules:
+                sys.modules['matplotlib.pyplot'].close('all')
@@ -0,0 +1,167 @@
+import contextlib, contextvars, json, logging, os, resource, subprocess, \
+        time
+
+logger = logging.getLogger('bedshape')
+
+# The region being profiled by this process (or thread), if any.
+current_region = contextvars.ContextVar('current_region', default=None)
+
+# The file which stage records are appended to, one JSON object per line, or
+# None if stages are not recorded. Set in each process by ``enable``.
+_records_name = None
+
+FIELDS = ['region', 'stage', 'sample', 'wall_time', 'cpu_time', 'max_rss',
+        'bytes_in', 'bytes_out']
+
+def enable(records_name):
+    global _records_name
+    _records_name = records_name
+
+def get_records_name():
+    return _records_name
+
+def get_size(filenames):
+    r"""
+    Get the total size of the regular files among filenames; named pipes and
+    missing files have no size.
+
+    Returns
+    -------
+    int, or None if none of filenames is a regular file
+    """
+    sizes = [os.path.getsize(filename) for filename in filenames
+            if filename != None and os.path.isfile(filename)]
+    return sum(sizes) if sizes != [] else None
+
+def record(stage, *, sample=None, wall_time, cpu_time, max_rss, bytes_in=None,
+        bytes_out=None):
+    r"""
+    Record a stage of the current region. Records are appended as single lines
+    (well under the size of an atomic write), so that processes profiling
+    regions in parallel may share the records file.
+    """
+    if _records_name == None:
+        return
+    line = json.dumps(dict(
+            region=current_region.get(), stage=stage, sample=sample,
+            wall_time=wall_time, cpu_time=cpu_time, max_rss=max_rss,
+            bytes_in=bytes_in, bytes_out=bytes_out)) + '\n'
+    fd = os.open(_records_name, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line.encode())
+    finally:
+        os.close(fd)
+
+@contextlib.contextmanager
+def stage(name, *, sample=None, inputs=(), outputs=()):
+    r"""
+    Record the in-process work of a stage: its wall time, the CPU time of the
+    calling thread, and the peak RSS of this process so far. Bytes in and out
+    are the sizes of inputs and outputs. The context value is a dict, in which
+    bytes_out may be set if outputs cannot be measured (e.g. named pipes).
+    """
+    bytes_in = get_size(inputs)
+    wall_start, cpu_start = time.perf_counter(), time.thread_time()
+    measured = {}
+    yield measured
+    record(name, sample=sample,
+            wall_time=time.perf_counter() - wall_start,
+            cpu_time=time.thread_time() - cpu_start,
+            max_rss=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            bytes_in=bytes_in,
+            bytes_out=measured.get('bytes_out', get_size(outputs)))
+
+def wait(process, name, *, start, sample=None, inputs=(), outputs=(),
+        check=False, block=True):
+    r"""
+    Wait for a subprocess started at start (from ``time.perf_counter``), and
+    record it as a stage, with its own CPU time and peak RSS. If check, a
+    non-zero return code raises ``subprocess.CalledProcessError``. If not
+    block, only check whether the subprocess has exited.
+
+    Returns
+    -------
+    int (the return code), or None if not block and the subprocess has not
+    exited
+    """
+    if process.returncode == None:
+        pid, status, rusage = os.wait4(process.pid, 0 if block else os.WNOHANG)
+        if pid == 0:
+            return None
+        process.returncode = os.waitstatus_to_exitcode(status)
+        record(name, sample=sample,
+                wall_time=time.perf_counter() - start,
+                cpu_time=rusage.ru_utime + rusage.ru_stime,
+                max_rss=rusage.ru_maxrss,
+                bytes_in=get_size(inputs), bytes_out=get_size(outputs))
+    if check and process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, process.args)
+    return process.returncode
+
+def run(cmd, name, *, sample=None, inputs=(), outputs=(), check=False,
+        **kwargs):
+    r"""
+    Run a command, as ``subprocess.run``, and record it as a stage (see
+    ``wait``, which check is passed to).
+
+    Returns
+    -------
+    int (the return code)
+    """
+    start = time.perf_counter()
+    process = subprocess.Popen(cmd, **kwargs)
+    try:
+        return wait(process, name, start=start, sample=sample, inputs=inputs,
+                outputs=outputs, check=check)
+    finally:
+        if process.returncode == None:
+            process.kill()
+            process.wait()
+
+def load_records(records_name):
+    with open(records_name) as records_file:
+        return [json.loads(line) for line in records_file if line.strip()]
+
+def write_reports(records_name, outdir, *, top=5):
+    r"""
+    Write the stage records as a JSON report per region
+    (<region>.stages.json) and a run-level TSV (bedshape-stages.tsv) in outdir,
+    and log the slowest stages and regions.
+    """
+    records = load_records(records_name)
+    by_region = {}
+    for stage_record in records:
+        by_region.setdefault(stage_record['region'], []).append(stage_record)
+
+    for region, region_records in by_region.items():
+        if region == None:
+            continue
+        with open(os.path.join(outdir, '{}.stages.json'.format(region)),
+                'w') as report_file:
+            json.dump({
+                    'region': region,
+                    'wall_time': sum(r['wall_time'] for r in region_records),
+                    'stages': region_records}, report_file, indent=1)
+
+    with open(os.path.join(outdir, 'bedshape-stages.tsv'), 'w') as tsv_file:
+        tsv_file.write('\t'.join(FIELDS) + '\n')
+        for stage_record in records:
+            tsv_file.write('\t'.join(
+                    '' if stage_record[field] == None else str(stage_record[field])
+                    for field in FIELDS) + '\n')
+
+    slowest_stages = sorted(records, key=lambda r: r['wall_time'],
+            reverse=True)[:top]
+    logger.info('Slowest stages:\n{}'.format('\n'.join(
+            '\t{:.3f}s wall, {:.3f}s CPU\t{}\t{}{}'.format(
+                r['wall_time'], r['cpu_time'], r['region'], r['stage'],
+                '' if r['sample'] == None else ' ({})'.format(r['sample']))
+            for r in slowest_stages)))
+    region_times = sorted(
+            ((sum(r['wall_time'] for r in region_records), region)
+                for region, region_records in by_region.items()
+                if region != None),
+            reverse=True)[:top]
+    logger.info('Slowest regions (total stage wall time):\n{}'.format(
+            '\n'.join('\t{:.3f}s\t{}'.format(wall_time, region)
+                for wall_time, region in region_times)))
@@ -18,6 +18,11 @@ def test_parse_cigar_raises_cigar_unavailable_error():
 def test_parse_md(string, tokens):
     assert Alignment._parse_md(string) == tokens
 
+@pytest.mark.parametrize('string', ['0', '5^', '5a3', '3A-2'])
+def test_parse_md_raises_runtime_error(string):
+    with pytest.raises(RuntimeError):
+        Alignment._parse_md(string)
+
 @pytest.mark.parametrize('cigar,md', bowtie2_fields + hisat2_fields)
 def test_alignment_get_cigar(cigar, md):
     alignment = Alignment(1, cigar, md)
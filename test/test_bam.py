@@ -0,0 +1,308 @@
+import io, os, struct, sys, zlib
+import pytest
+
+sys.path.append(os.path.join(sys.path[0], '../src'))
+
+import bam, counts, sam
+
+rnames = ['chr1', 'chr2']
+
+sam_lines = [
+    b'r0\t0\tchr1\t100\t42\t10M\t*\t0\t0\tACGTACGTAC\tIIIIIIIIII\tMD:Z:10',
+    b'r1\t99\tchr1\t195\t42\t20M\t=\t300\t250\tACGTACGTACGTACGTACGT\t*\tNM:i:1\tMD:Z:10A9\tXS:i:-3',
+    b'r2\t4\tchr1\t200\t0\t*\t*\t0\t0\tACGT\tIIII',
+    b'r3\t16\tchr1\t210\t42\t5S10M1D5M\t*\t0\t0\tNNNNNACGTACGTACGTAC\t*\tMD:Z:0G9^T5\tXA:A:x\tXF:f:0.5\tXB:B:c,-1,2,3',
+    b'r4\t0\tchr1\t230\t42\t2M2I16M\t*\t0\t0\tACGTACGTACGTACGTACGT\t*\tMD:Z:18\tXH:H:1AE3\tXT:Z:a b',
+    b'r5\t0\tchr1\t40000\t42\t10M\t*\t0\t0\tACGTACGTAC\t*\tMD:Z:10',
+    b'r6\t0\tchr2\t205\t42\t10M\t*\t0\t0\tACGTACGTAC\t*\tMD:Z:10',
+]
+
+def encode_tag(tag):
+    name, tag_type, value = tag.split(b':', 2)
+    if tag_type == b'i':
+        return name + b'i' + struct.pack('<i', int(value))
+    if tag_type == b'f':
+        return name + b'f' + struct.pack('<f', float(value))
+    if tag_type == b'A':
+        return name + b'A' + value
+    if tag_type == b'B':
+        values = value.split(b',')
+        return name + b'B' + values[0] + struct.pack(
+                '<i{}b'.format(len(values) - 1), len(values) - 1,
+                *map(int, values[1:]))
+    return name + tag_type + value + b'\x00'
+
+def encode_record(line):
+    fields = line.split(b'\t')
+    name = fields[0] + b'\x00'
+    cigar = [] if fields[5] == b'*' else [
+            int(reps) << 4 | bam.CIGAR_OPS.index(op)
+            for reps, op in bam.clip.RE_CIGAR.findall(fields[5].decode())]
+    seq = fields[9] if fields[9] != b'*' else b''
+    codes = [b'=ACMGRSVTWYHKDBN'.index(base) for base in seq] + [0]
+    packed_seq = bytes(codes[i] << 4 | codes[i + 1]
+            for i in range(0, len(seq), 2))
+    qual = b'\xff' * len(seq) if fields[10] == b'*' else \
+            bytes(q - 33 for q in fields[10])
+    next_tid = -1 if fields[6] == b'*' else rnames.index(fields[2].decode())
+    data = struct.pack('<iiBBHHHiiii',
+            rnames.index(fields[2].decode()), int(fields[3]) - 1, len(name),
+            int(fields[4]), 4680, len(cigar), int(fields[1]), len(seq),
+            next_tid, int(fields[7]) - 1, int(fields[8])) + name + \
+            struct.pack('<{}I'.format(len(cigar)), *cigar) + packed_seq + \
+            qual + b''.join(map(encode_tag, fields[11:]))
+    return struct.pack('<i', len(data)) + data
+
+def bgzf_block(data):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+    cdata = compressor.compress(data) + compressor.flush()
+    return b'\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00' + \
+            struct.pack('<H', len(cdata) + 25) + cdata + \
+            struct.pack('<II', zlib.crc32(data), len(data))
+
+def reg2bin(beg, end):
+    r"""
+    Get the bin of an alignment over [beg, end) (0-based), as in the SAM
+    specification.
+    """
+    end -= 1
+    for shift, first_bin in ((14, 4681), (17, 585), (20, 73), (23, 9),
+            (26, 1)):
+        if beg >> shift == end >> shift:
+            return first_bin + (beg >> shift)
+    return 0
+
+def write_bam(name, lines, *, header_text=b'', block_size=None):
+    r"""
+    Write lines as a BAM file, with its .bai index, as samtools index would:
+    each record is added to the chunks of its bin, and to the linear index of
+    each 16 kb window it overlaps. If block_size, the records are split into
+    BGZF blocks of block_size bytes (so that records may span blocks);
+    otherwise each record is in its own block.
+
+    Returns
+    -------
+    list of int (the virtual offset of each record)
+    """
+    header = b'BAM\x01' + struct.pack('<i', len(header_text)) + header_text + \
+            struct.pack('<i', len(rnames))
+    for rname in rnames:
+        header += struct.pack('<i', len(rname) + 1) + rname.encode() + \
+                b'\x00' + struct.pack('<i', 2**29)
+    records = [encode_record(line) for line in lines]
+    data = b''.join(records)
+    if block_size == None:
+        pieces = records
+    else:
+        pieces = [data[i:i+block_size]
+                for i in range(0, len(data), block_size)]
+    blocks = [bgzf_block(header)] + list(map(bgzf_block, pieces)) + \
+            [bgzf_block(b'')]
+    addresses = [0]
+    for block in blocks:
+        addresses.append(addresses[-1] + len(block))
+
+    # Virtual offsets of the start of each record, and of the end of the last.
+    piece_starts = [0]
+    for piece in pieces:
+        piece_starts.append(piece_starts[-1] + len(piece))
+    offsets = []
+    piece = 0
+    record_start = 0
+    for record in records + [b'']:
+        while piece < len(pieces) and record_start >= piece_starts[piece + 1]:
+            piece += 1
+        offsets.append(addresses[piece + 1] << 16 |
+                record_start - piece_starts[piece])
+        record_start += len(record)
+
+    bins = [{} for _ in rnames]
+    intervals = [[] for _ in rnames]
+    for i, line in enumerate(lines):
+        fields = line.split(b'\t')
+        tid = rnames.index(fields[2].decode())
+        beg = int(fields[3]) - 1
+        end = bam.clip.reference_span(beg + 1, fields[5].decode())[1]
+        chunks = bins[tid].setdefault(reg2bin(beg, end), [])
+        if chunks != [] and chunks[-1][1] == offsets[i]:
+            chunks[-1][1] = offsets[i + 1]
+        else:
+            chunks.append([offsets[i], offsets[i + 1]])
+        tid_intervals = intervals[tid]
+        for window in range(beg >> 14, ((end - 1) >> 14) + 1):
+            while len(tid_intervals) <= window:
+                tid_intervals.append(None)
+            if tid_intervals[window] == None:
+                tid_intervals[window] = offsets[i]
+    index = b'BAI\x01' + struct.pack('<i', len(rnames))
+    for tid in range(len(rnames)):
+        index += struct.pack('<i', len(bins[tid]))
+        for bin_id, chunks in sorted(bins[tid].items()):
+            index += struct.pack('<Ii', bin_id, len(chunks))
+            for chunk in chunks:
+                index += struct.pack('<QQ', *chunk)
+        # Windows without alignments take the offset of the window before.
+        for window in range(len(intervals[tid])):
+            if intervals[tid][window] == None:
+                intervals[tid][window] = intervals[tid][window - 1] \
+                        if window > 0 else 0
+        index += struct.pack('<i{}Q'.format(len(intervals[tid])),
+                len(intervals[tid]), *intervals[tid])
+
+    with open(name, 'wb') as outfile:
+        outfile.write(b''.join(blocks))
+    with open(name + '.bai', 'wb') as outfile:
+        outfile.write(index)
+    return offsets[:-1]
+
+@pytest.fixture
+def bam_name(tmpdir):
+    r"""
+    Write sam_lines as a BAM file, with each record in its own BGZF block.
+    """
+    name = str(tmpdir.join('test.bam'))
+    write_bam(name, sam_lines, header_text=b'@HD\tVN:1.6\tSO:coordinate\n')
+    return name
+
+# Alignments across bins of every level: within a 16 kb window (level 5), and
+# across windows of 16 kb, 128 kb, 1 Mb, 8 Mb and 64 Mb (levels 4 to 0).
+binned_lines = [b'b%d\t0\tchr1\t%d\t42\t%s\t*\t0\t0\tACGTACGTAC\t*\tMD:Z:10'
+        % (i, pos, cigar) for i, (pos, cigar) in enumerate([
+            (1, b'10M'), (16379, b'10M'), (16385, b'10M'), (20000, b'10M'),
+            (131067, b'10M'), (131073, b'5M100000N5M'),
+            (1048570, b'10M'), (1048580, b'10M'),
+            (8388600, b'5M10000000N5M'), (8388610, b'10M'),
+            (67108860, b'5M1000N5M'), (67108870, b'10M'),
+            (67108871, b'10M'), (100000000, b'10M')])]
+
+@pytest.fixture
+def binned_bam_name(tmpdir):
+    r"""
+    Write binned_lines as a BAM file, in BGZF blocks of 100 bytes, so that
+    most records span two blocks.
+    """
+    name = str(tmpdir.join('binned.bam'))
+    write_bam(name, binned_lines, block_size=100)
+    return name
+
+def test_reg2bins():
+    assert bam.reg2bins(0, 1) == [0, 1, 9, 73, 585, 4681]
+    assert bam.reg2bins(16383, 16385) == [0, 1, 9, 73, 585, 4681, 4682]
+
+def test_fetch(bam_name):
+    with bam.File(bam_name) as bam_file:
+        assert [record.name for record in bam_file.fetch('chr1', 200, 250)] \
+                == ['r1', 'r2', 'r3', 'r4']
+        assert [record.name for record in bam_file.fetch('chr2', 1, 10**6)] \
+                == ['r6']
+        assert list(bam_file.fetch('chr3', 1, 10**6)) == []
+
+def overlapping_names(lines, start, stop):
+    names = []
+    for line in lines:
+        fields = line.split(b'\t')
+        first, last = bam.clip.reference_span(fields[3], fields[5].decode())
+        if first <= stop and last >= start:
+            names.append(fields[0].decode())
+    return names
+
+def test_binned_lines_span_bins_and_blocks(tmpdir):
+    bins = [reg2bin(pos - 1, bam.clip.reference_span(pos, cigar)[1])
+            for pos, cigar in [(int(line.split(b'\t')[3]),
+                line.split(b'\t')[5].decode()) for line in binned_lines]]
+    # A bin of every level.
+    assert {0, 1, 9, 73, 585} <= set(bins)
+    assert any(bin_id >= 4681 for bin_id in bins)
+    offsets = write_bam(str(tmpdir.join('binned.bam')), binned_lines,
+            block_size=100)
+    # Records start in blocks other than the first, and not at their start.
+    assert len(set(offset >> 16 for offset in offsets)) > 1
+    assert any(offset & 0xffff != 0 for offset in offsets[1:])
+
+@pytest.mark.parametrize('start,stop', [(1, 2**29)] + [
+    (pos, pos) for boundary in (16384, 131072, 1048576, 8388608, 67108864)
+        for pos in (boundary - 1, boundary, boundary + 1)] + [
+    (16388, 16390), (16389, 20000), (131070, 131080), (200000, 231077),
+    (231078, 231078), (1048579, 1048580), (10000000, 10000000),
+    (18388609, 18388609), (18388610, 67108859), (67108869, 67108880),
+    (99999999, 100000000), (100000010, 2**29)])
+def test_fetch_at_bin_and_block_boundaries(binned_bam_name, start, stop):
+    with bam.File(binned_bam_name) as bam_file:
+        assert [record.name for record in bam_file.fetch('chr1', start, stop)] \
+                == overlapping_names(binned_lines, start, stop)
+
+def test_fetch_each_record(binned_bam_name):
+    with bam.File(binned_bam_name) as bam_file:
+        for line in binned_lines:
+            fields = line.split(b'\t')
+            first, last = bam.clip.reference_span(fields[3],
+                    fields[5].decode())
+            for pos in (first, last):
+                assert fields[0].decode() in [record.name
+                        for record in bam_file.fetch('chr1', pos, pos)]
+
+def test_query_skips_by_linear_index(tmpdir):
+    name = str(tmpdir.join('binned.bam'))
+    offsets = write_bam(name, binned_lines, block_size=100)
+    # b10, in bin 0, is read by every query unless the linear index is used.
+    chunks = bam.Index(name + '.bai').query(0, 99999999, 100000000)
+    assert chunks != []
+    assert all(chunk_beg >= offsets[-1] for chunk_beg, _ in chunks)
+
+def test_get_sort_order():
+    assert bam.get_sort_order(b'') == None
+    assert bam.get_sort_order(b'@SQ\tSN:chr1\tLN:10\n') == None
+    assert bam.get_sort_order(
+            b'@HD\tVN:1.6\tSO:coordinate\n@SQ\tSN:chr1\tLN:10\n\x00') \
+            == 'coordinate'
+    assert bam.get_sort_order(b'@HD\tVN:1.6\tSO:queryname\r\n') \
+            == 'queryname'
+
+def test_file_not_sorted_by_coordinate(tmpdir):
+    name = str(tmpdir.join('unsorted.bam'))
+    write_bam(name, sam_lines, header_text=b'@HD\tVN:1.6\tSO:unsorted\n')
+    with pytest.raises(RuntimeError, match='not sorted by coordinate'):
+        bam.File(name)
+
+def test_fetch_unsorted(tmpdir):
+    name = str(tmpdir.join('unsorted.bam'))
+    write_bam(name, [sam_lines[0], sam_lines[3], sam_lines[1]])
+    with bam.File(name) as bam_file:
+        with pytest.raises(RuntimeError, match='r1 at chr1:195 follows'):
+            list(bam_file.fetch('chr1', 1, 10**6))
+
+def test_record_matches_sam(bam_name):
+    with bam.File(bam_name) as bam_file:
+        records = list(bam_file.fetch('chr1', 1, 10**6))
+    assert [bytes(record) for record in records] == sam_lines[:6]
+
+@pytest.mark.parametrize('rname,start,stop', [
+    ('chr1', 200, 250), ('chr1', 100, 109), ('chr1', 1, 10**6),
+    ('chr2', 200, 210)])
+def test_stream_matches_sam_stream(bam_name, rname, start, stop):
+    sam_outfile = io.BytesIO()
+    sam.Stream([line for line in sam_lines
+            if line.split(b'\t')[2] == rname.encode()],
+            start, stop).write(sam_outfile)
+    bam_outfile = io.BytesIO()
+    with bam.File(bam_name) as bam_file:
+        bam.Stream(bam_file, rname, start, stop).write(bam_outfile)
+    assert bam_outfile.getvalue() == sam_outfile.getvalue()
+
+def test_counter_matches_sam_stream(bam_name):
+    sam_counter = counts.Counter(51, min_qual=30)
+    sam_counter.count(sam.Stream(sam_lines[:6], 200, 250))
+    bam_counter = counts.Counter(51, min_qual=30)
+    with bam.File(bam_name) as bam_file:
+        bam_counter.count(bam.Stream(bam_file, 'chr1', 200, 250))
+    assert (bam_counter.mutations == sam_counter.mutations).all()
+    assert (bam_counter.depths == sam_counter.depths).all()
+    assert sam_counter.mutations.sum() > 0
+
+def test_stream_counts(bam_name):
+    with bam.File(bam_name) as bam_file:
+        stream = bam.Stream(bam_file, 'chr1', 200, 250)
+        assert len(list(stream)) == 3
+    assert stream.total_lines == 4
+    assert stream.lines_unmapped == 1
+    assert stream.lines_clipped_out == 0
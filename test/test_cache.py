@@ -0,0 +1,72 @@
+import os, sys
+import pytest
+
+sys.path.append(os.path.join(sys.path[0], '../src'))
+
+import cache
+
+@pytest.fixture
+def alignment(tmp_path):
+    filename = str(tmp_path / 'modified.bam')
+    with open(filename, 'w') as alignment_file:
+        alignment_file.write('reads')
+    return filename
+
+def write_counts(filename, contents='counts'):
+    with open(filename, 'w') as counts_file:
+        counts_file.write(contents)
+    return filename
+
+def test_get_key(tmp_path, alignment):
+    counts_cache = cache.CountsCache(str(tmp_path / 'cache'), 2**20)
+    key = counts_cache.get_key(alignment, 'chr1:1-100', min_mapq=0)
+    assert key == counts_cache.get_key(alignment, 'chr1:1-100', min_mapq=0)
+    assert key != counts_cache.get_key(alignment, 'chr1:1-101', min_mapq=0)
+    assert key != counts_cache.get_key(alignment, 'chr1:1-100', min_mapq=10)
+
+    os.utime(alignment, ns=(0, 0))
+    assert key != counts_cache.get_key(alignment, 'chr1:1-100', min_mapq=0)
+
+def test_get_key_covers_index(tmp_path, alignment):
+    counts_cache = cache.CountsCache(str(tmp_path / 'cache'), 2**20)
+    key = counts_cache.get_key(alignment, 'chr1:1-100', min_mapq=0)
+    write_counts(alignment + '.bai', 'index')
+    indexed_key = counts_cache.get_key(alignment, 'chr1:1-100', min_mapq=0)
+    assert indexed_key != key
+
+    os.utime(alignment + '.bai', ns=(0, 0))
+    assert indexed_key != counts_cache.get_key(
+            alignment, 'chr1:1-100', min_mapq=0)
+
+def test_fetch_and_store(tmp_path, alignment):
+    counts_cache = cache.CountsCache(str(tmp_path / 'cache'), 2**20)
+    key = counts_cache.get_key(alignment, 'chr1:1-100', min_mapq=0)
+    out_name = str(tmp_path / 'out.counts')
+    assert not counts_cache.fetch(key, out_name)
+
+    counts_cache.store(key, write_counts(str(tmp_path / 'in.counts')))
+    assert counts_cache.fetch(key, out_name)
+    with open(out_name) as counts_file:
+        assert counts_file.read() == 'counts'
+
+def test_store_ignores_missing_counts(tmp_path):
+    counts_cache = cache.CountsCache(str(tmp_path / 'cache'), 2**20)
+    counts_cache.store('key', None)
+    counts_cache.store('key', str(tmp_path / 'missing.counts'))
+    assert not counts_cache.fetch('key', str(tmp_path / 'out.counts'))
+
+def test_evicts_least_recently_used(tmp_path):
+    counts_cache = cache.CountsCache(str(tmp_path / 'cache'), 25)
+    counts_name = write_counts(str(tmp_path / 'in.counts'), 'x' * 10)
+    out_name = str(tmp_path / 'out.counts')
+
+    counts_cache.store('a', counts_name)
+    counts_cache.store('b', counts_name)
+    os.utime(counts_cache.get_entry_name('a'), ns=(1, 1))
+    os.utime(counts_cache.get_entry_name('b'), ns=(2, 2))
+    assert counts_cache.fetch('a', out_name)  # a is now the most recent
+
+    counts_cache.store('c', counts_name)
+    assert counts_cache.fetch('a', out_name)
+    assert not counts_cache.fetch('b', out_name)
+    assert counts_cache.fetch('c', out_name)
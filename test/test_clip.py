@@ -0,0 +1,65 @@
+import os, sys
+import pytest
+
+sys.path.append(os.path.join(sys.path[0], '../src'))
+
+import clip
+from alignment import Alignment, ClippedRegionEmptyError
+from test_alignment_cases import *
+
+@pytest.mark.parametrize('pre_clip,to_clip,post_clip', clip_test_set)
+def test_soft_clip(pre_clip, to_clip, post_clip):
+    alignment = Alignment(*post_clip)
+    assert clip.soft_clip(*pre_clip, *to_clip) == \
+            (alignment.pos, alignment.cigar, alignment.md)
+
+@pytest.mark.parametrize('pre_clip,to_clip,post_clip', clip_test_set)
+def test_soft_clip_matches_alignment(pre_clip, to_clip, post_clip):
+    alignment = Alignment(*pre_clip)
+    alignment.soft_clip(*to_clip)
+    assert clip.soft_clip(*pre_clip, *to_clip) == \
+            (alignment.pos, alignment.get_cigar(), alignment.get_md())
+
+@pytest.mark.parametrize('cigar,md', bowtie2_fields + hisat2_fields)
+@pytest.mark.parametrize('to_clip', [
+        (1, 10**6), (1, 1), (5, 40), (24, 24), (30, 140), (100, 300)])
+def test_soft_clip_windows_match_alignment(cigar, md, to_clip):
+    alignment = Alignment(1, cigar, md)
+    try:
+        alignment.soft_clip(*to_clip)
+    # Alignment.soft_clip fails outright on reads which end before the window,
+    # or which keep no mapped bases.
+    except (ClippedRegionEmptyError, TypeError, ValueError):
+        with pytest.raises(ClippedRegionEmptyError):
+            clip.soft_clip(1, cigar, md, *to_clip)
+        return
+    assert clip.soft_clip(1, cigar, md, *to_clip) == \
+            (alignment.pos, alignment.get_cigar(), alignment.get_md())
+
+def test_soft_clip_raises_clipped_region_empty_error():
+    with pytest.raises(ClippedRegionEmptyError):
+        clip.soft_clip(1, '10M', '10', 20, 30)
+
+@pytest.mark.parametrize('pos,cigar,span', [
+    (1, '10M', (1, 10)), (5, '5S10M5S', (5, 14)), (1, '1M1D1M', (1, 3)),
+    (100, '43M132N60M47S', (100, 334)), (1, '3M2I3M', (1, 6)),
+    (7, '*', (7, 7))])
+def test_reference_span(pos, cigar, span):
+    assert clip.reference_span(pos, cigar) == span
+
+@pytest.mark.parametrize('pos,cigar,overlap', [
+    (1, '10M', clip.OVERLAP_NONE), (201, '10M', clip.OVERLAP_NONE),
+    (91, '10M', clip.OVERLAP_PARTIAL), (100, '5S10M5S', clip.OVERLAP_CONTAINED),
+    (100, '2I10M', clip.OVERLAP_PARTIAL), (190, '10M1D', clip.OVERLAP_PARTIAL),
+    (100, '43M10N20M', clip.OVERLAP_CONTAINED),
+    (150, '43M10N20M', clip.OVERLAP_PARTIAL),
+    (50, '10M60N10M', clip.OVERLAP_PARTIAL),
+    (100, '5=1X4=', clip.OVERLAP_PARTIAL), (100, '3H10M', clip.OVERLAP_PARTIAL),
+    (100, '4M1P6M', clip.OVERLAP_PARTIAL)])
+def test_get_overlap(pos, cigar, overlap):
+    assert clip.get_overlap(pos, cigar, 100, 200) == overlap
+
+@pytest.mark.parametrize('cigar,md', bowtie2_fields + hisat2_fields)
+def test_contained_soft_clip_is_unchanged(cigar, md):
+    if clip.get_overlap(100, cigar, 100, 10**6) == clip.OVERLAP_CONTAINED:
+        assert clip.soft_clip(100, cigar, md, 100, 10**6) == (1, cigar, md)
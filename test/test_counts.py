@@ -0,0 +1,158 @@
+import os, sys
+import numpy as np
+import pytest
+
+sys.path.append(os.path.join(sys.path[0], '../src'))
+
+import counts, sam
+
+# Clipped to [1, 10]; r3 is below the minimum MAPQ of 5, and the third base of
+# r4 below the minimum base quality of 5.
+clipped_lines = [
+    b'r1\t0\tc\t3\t42\t5M\t*\t0\t0\tACTTA\tIIIII\tMD:Z:2G2',
+    b'r2\t0\tc\t1\t42\t3M2I2M1D2M\t*\t0\t0\tACGTTACTA\tIIIIIIIII\tMD:Z:5^A2',
+    b'r3\t0\tc\t1\t1\t4M\t*\t0\t0\tACGA\tIIII\tMD:Z:4',
+    b'r4\t0\tc\t1\t42\t2M3D2M\t*\t0\t0\tACTA\tII#I\tMD:Z:2^GAC2',
+    b'r5\t0\tc\t6\t42\t1M1I2M\t*\t0\t0\tAGTC\tIIII\tMD:Z:1A0G0',
+]
+
+def count(lines, **kwargs):
+    counter = counts.Counter(10, min_mapq=5, min_qual=5, **kwargs)
+    counter.count(sam.Line(line) for line in lines)
+    return counter
+
+def get_column(counter, name):
+    if name in counts.MUTATION_CLASSES:
+        return counter.mutations[counts.CLASS_INDICES[name]].tolist()
+    return counter.depths[counts.DEPTH_COLUMNS.index(name)].tolist()
+
+def test_mutations():
+    counter = count(clipped_lines)
+    assert get_column(counter, 'GT') == [0, 0, 0, 0, 1, 0, 0, 0, 0, 0]
+    assert get_column(counter, 'A-') == [0, 0, 0, 0, 0, 1, 0, 0, 0, 0]
+    assert get_column(counter, 'multinuc_insertion') == \
+            [0, 0, 0, 1, 0, 0, 0, 0, 0, 0]
+    assert get_column(counter, 'complex_insertion') == \
+            [0, 0, 0, 0, 0, 0, 0, 1, 0, 0]
+    # The deletion of r4 is flanked by a low quality base.
+    assert get_column(counter, 'multinuc_deletion') == [0] * 10
+    assert counter.mutations.sum() == 4
+
+def test_depths():
+    counter = count(clipped_lines)
+    assert get_column(counter, 'read_depth') == [2, 2, 3, 3, 3, 4, 4, 2, 0, 0]
+    assert get_column(counter, 'effective_depth') == \
+            [2, 2, 2, 2, 2, 3, 3, 2, 0, 0]
+    assert get_column(counter, 'low_mapq_mapped_depth') == \
+            [1, 1, 1, 1, 0, 0, 0, 0, 0, 0]
+    assert get_column(counter, 'mapped_depth') == \
+            [3, 3, 4, 4, 3, 4, 4, 2, 0, 0]
+
+@pytest.mark.parametrize('line,excluded', [
+    # A mismatch (at 3) beside a low quality base, on either side.
+    (b'r1\t0\tc\t1\t42\t5M\t*\t0\t0\tACTTA\tI#III\tMD:Z:2G2', True),
+    (b'r1\t0\tc\t1\t42\t5M\t*\t0\t0\tACTTA\tII#II\tMD:Z:2G2', True),
+    (b'r1\t0\tc\t1\t42\t5M\t*\t0\t0\tACTTA\tIII#I\tMD:Z:2G2', True),
+    (b'r1\t0\tc\t1\t42\t5M\t*\t0\t0\tACTTA\t#IIII\tMD:Z:2G2', False),
+    # An insertion (before 3) beside a low quality base.
+    (b'r1\t0\tc\t1\t42\t2M1I2M\t*\t0\t0\tACTGA\tIIII#\tMD:Z:4', False),
+    (b'r1\t0\tc\t1\t42\t2M1I2M\t*\t0\t0\tACTGA\tIII#I\tMD:Z:4', True)])
+def test_mutations_beside_low_quality_bases(line, excluded):
+    counter = count([line])
+    assert counter.mutations.sum() == (0 if excluded else 1)
+    assert get_column(counter, 'effective_depth')[2] == (0 if excluded else 1)
+
+def test_header_lines_are_not_counted():
+    counter = counts.Counter(10, min_mapq=5, min_qual=5)
+    counter.count(sam.Stream([b'@HD\tVN:1.6\tSO:coordinate'] + clipped_lines,
+            1, 10, downsampler=sam.Downsampler(max_reads=10)))
+    expected = count(clipped_lines)
+    assert np.array_equal(counter.mutations, expected.mutations)
+    assert np.array_equal(counter.depths, expected.depths)
+
+def test_flushes_match(monkeypatch):
+    counter = count(clipped_lines)
+    monkeypatch.setattr(counts.Counter, 'FLUSH_SIZE', 1)
+    flushed_counter = count(clipped_lines)
+    assert np.array_equal(counter.mutations, flushed_counter.mutations)
+    assert np.array_equal(counter.depths, flushed_counter.depths)
+
+def test_reference_skips_are_not_covered():
+    counter = counts.Counter(10)
+    counter.count([sam.Line(
+            b'r1\t0\tc\t1\t42\t2M5N3M\t*\t0\t0\tACGTA\tIIIII\tMD:Z:5')])
+    assert get_column(counter, 'read_depth') == [1, 1, 0, 0, 0, 0, 0, 1, 1, 1]
+
+def test_write(tmp_path):
+    out_name = str(tmp_path / 'modified.counts')
+    count(clipped_lines).write(out_name)
+    with open(out_name) as counts_file:
+        header = counts_file.readline().rstrip('\n').split('\t')
+        rows = [list(map(int, line.split('\t'))) for line in counts_file]
+    assert header == counts.MUTATION_CLASSES + counts.DEPTH_COLUMNS
+    assert len(rows) == 10 and all(map(lambda r: len(r) == 31, rows))
+    assert rows[4][header.index('GT')] == 1
+    assert rows[5][header.index('read_depth')] == 4
+
+def test_get_windows():
+    assert counts.get_windows(1, 10, 4) == [(1, 4), (5, 8), (9, 10)]
+    assert counts.get_windows(5, 8, 4) == [(5, 8)]
+
+def test_write_window_rows(tmp_path):
+    window_name = str(tmp_path / 'window.counts')
+    with open(window_name, 'w') as window_file:
+        window_file.write('1\t1\n2\t2\n3\t3\n')
+    out_name = str(tmp_path / 'out.counts')
+    with open(out_name, 'w') as outfile:
+        # The rows missing from the first window are only written once the
+        # second follows them.
+        missing = 0
+        for _ in range(2):
+            with open(window_name) as window_file:
+                missing = counts.write_window_rows(window_file, outfile,
+                        skip=1, n_rows=4, n_columns=2, missing=missing)
+            assert missing == 2
+    with open(out_name) as out_file:
+        assert out_file.read() == '2\t2\n3\t3\n0\t0\n0\t0\n2\t2\n3\t3\n'
+
+# A clipped SAM file (over 20 positions) with every kind of mutation, and the
+# counts of it by shapemapper_mutation_parser and shapemapper_mutation_counter,
+# which are made by make test/data/clipped.counts where shapemapper2 is built.
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+FIXTURE_NAME = os.path.join(DATA_DIR, 'clipped.sam')
+EXPECTED_NAME = os.path.join(DATA_DIR, 'clipped.counts')
+
+def load_counts(counts_name):
+    with open(counts_name) as counts_file:
+        header = counts_file.readline().split()
+        rows = [list(map(int, line.split())) for line in counts_file
+                if line.strip()]
+    return {column: [row[i] for row in rows]
+            for i, column in enumerate(header)}
+
+def test_counter_matches_shapemapper(tmp_path):
+    assert os.path.isfile(EXPECTED_NAME), 'No counts from the shapemapper2 ' \
+            'binaries; run make test/data/clipped.counts'
+    expected = load_counts(EXPECTED_NAME)
+    out_name = str(tmp_path / 'clipped.counts')
+    with open(FIXTURE_NAME, 'rb') as sam_file:
+        counter = counts.Counter(20, min_mapq=5, min_qual=5)
+        counter.count(sam.Line(line) for line in sam_file)
+    counter.write(out_name)
+    actual = load_counts(out_name)
+
+    assert set(counts.MUTATION_CLASSES + counts.DEPTH_COLUMNS) <= \
+            set(expected)
+    for column in counts.MUTATION_CLASSES + counts.DEPTH_COLUMNS:
+        # The counter writes no rows past the last position covered.
+        values = expected[column] + [0] * (20 - len(expected[column]))
+        assert actual[column] == values, column
+
+def test_fixture_has_every_kind_of_mutation():
+    with open(FIXTURE_NAME, 'rb') as sam_file:
+        counter = counts.Counter(20, min_mapq=5, min_qual=5)
+        counter.count(sam.Line(line) for line in sam_file)
+    kinds = ['multinuc_deletion', 'multinuc_insertion', 'multinuc_mismatch',
+            'complex_deletion', 'complex_insertion']
+    assert all(map(lambda k: get_column(counter, k) != [0] * 20, kinds))
+    assert get_column(counter, 'low_mapq_mapped_depth')[0] == 1
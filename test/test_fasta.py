@@ -0,0 +1,34 @@
+import os, sys
+import pytest
+
+sys.path.append(os.path.join(sys.path[0], '../src'))
+
+import fasta
+
+sequences = [('chr1', 'ACGTACGTAC' * 5 + 'GG'), ('chr2', 'TTTTGGGGCC')]
+
+@pytest.fixture
+def reference(tmp_path):
+    filename = str(tmp_path / 'reference.fa')
+    with open(filename, 'w') as fasta_file, \
+            open(filename + '.fai', 'w') as index_file:
+        for name, sequence in sequences:
+            fasta_file.write('>{} description\n'.format(name))
+            offset = fasta_file.tell()
+            for i in range(0, len(sequence), 8):
+                fasta_file.write(sequence[i:i+8] + '\n')
+            index_file.write('{}\t{}\t{}\t8\t9\n'.format(
+                    name, len(sequence), offset))
+    return fasta.Reference(filename)
+
+@pytest.mark.parametrize('rname,start,stop', [
+    ('chr1', 1, 52), ('chr1', 1, 1), ('chr1', 8, 9), ('chr1', 9, 16),
+    ('chr1', 17, 40), ('chr1', 45, 100), ('chr2', 3, 10)])
+def test_fetch(reference, rname, start, stop):
+    assert reference.fetch(rname, start, stop) == \
+            dict(sequences)[rname][start-1:stop]
+
+def test_get_reference_without_index(tmp_path):
+    filename = str(tmp_path / 'unindexed.fa')
+    open(filename, 'w').close()
+    assert fasta.get_reference(filename) == None
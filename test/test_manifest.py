@@ -0,0 +1,44 @@
+import os, sys
+import pytest
+
+sys.path.append(os.path.join(sys.path[0], '../src'))
+
+import manifest
+
+@pytest.fixture
+def inputs(tmp_path):
+    filenames = [str(tmp_path / 'reference.fa'), str(tmp_path / 'modified.bam')]
+    for filename in filenames:
+        with open(filename, 'w') as input_file:
+            input_file.write('input')
+    return filenames + [None]
+
+def test_get_region_key(inputs):
+    options = {'min_depth': 0}
+    key = manifest.get_region_key(inputs, 'chr1:1-100', options)
+    assert key == manifest.get_region_key(inputs, 'chr1:1-100', options)
+    assert key != manifest.get_region_key(inputs, 'chr1:1-101', options)
+    assert key != manifest.get_region_key(
+            inputs, 'chr1:1-100', {'min_depth': 1})
+
+    os.utime(inputs[1], ns=(0, 0))
+    assert key != manifest.get_region_key(inputs, 'chr1:1-100', options)
+
+def test_is_complete(tmp_path):
+    outputs = [str(tmp_path / 'chr1:1-100.profile')]
+    region_manifest = manifest.Manifest(str(tmp_path))
+    assert not region_manifest.is_complete('chr1:1-100', 'key', outputs)
+
+    region_manifest.record('chr1:1-100', 'key', outputs)
+    assert not region_manifest.is_complete('chr1:1-100', 'key', outputs)
+
+    open(outputs[0], 'w').close()
+    assert region_manifest.is_complete('chr1:1-100', 'key', outputs)
+    assert not region_manifest.is_complete('chr1:1-100', 'other', outputs)
+
+def test_manifest_is_reloaded(tmp_path):
+    outputs = [str(tmp_path / 'chr1:1-100.profile')]
+    open(outputs[0], 'w').close()
+    manifest.Manifest(str(tmp_path)).record('chr1:1-100', 'key', outputs)
+    assert manifest.Manifest(str(tmp_path)).is_complete(
+            'chr1:1-100', 'key', outputs)
@@ -0,0 +1,79 @@
+import os, sys
+import pytest
+
+sys.path.append(os.path.join(sys.path[0], '../src'))
+
+import numpy as np
+import norm, normalize_profiles
+from norm import NormError, calc_quartile, find_boxplot_factor
+
+def test_calc_quartile():
+    x = np.arange(1, 12, dtype=float)
+    assert calc_quartile(x, 0.25) == 3.5
+    assert calc_quartile(x, 0.75) == 8.5
+
+@pytest.mark.parametrize('length', [1, 2, 10, 11, 57, 100, 1001])
+@pytest.mark.parametrize('q', [0, 0.25, 0.5, 0.75, 1])
+def test_calc_quartile_matches_normalize_profiles(length, q):
+    x = np.sort(np.random.default_rng(length).gamma(0.6, 0.1, length))
+    assert calc_quartile(x, q) == normalize_profiles.calc_quartile(x, q)
+
+@pytest.mark.parametrize('length,seed', [
+    (11, 0), (57, 1), (99, 2), (100, 3), (1000, 4), (123457, 5)])
+def test_find_boxplot_factor_matches_loop(length, seed):
+    profile = np.random.default_rng(seed).gamma(0.6, 0.1, length)
+    profile[::13] = np.nan
+
+    x = np.sort(profile[np.isfinite(profile)])
+    ten_pct = len(x) // 10
+    q_limit = 1.5 * abs(calc_quartile(x, 0.25) - calc_quartile(x, 0.75))
+    limit = max(q_limit, x[len(x) - 1 - (ten_pct if len(x) >= 100 else
+            len(x) // 20)])
+    kept = [v for v in x if v < limit]
+    a = 0
+    for v in kept[-ten_pct:]:
+        a = v + a
+
+    assert find_boxplot_factor(profile) == a / ten_pct
+    assert find_boxplot_factor(profile) == \
+            normalize_profiles.find_boxplot_factor(profile)
+
+def test_find_boxplot_factor_raises_norm_error():
+    with pytest.raises(NormError):
+        find_boxplot_factor(np.array([1.0] * 9 + [np.nan] * 10))
+
+def write_profile(filename, length=20):
+    with open(filename, 'w') as profile_file:
+        profile_file.write('Nucleotide\tSequence\tHQ_profile\tHQ_stderr\n')
+        for i in range(length):
+            profile_file.write('{}\tA\t{}\t{}\n'.format(
+                    i + 1, 'nan' if i == 3 else i / 10, i / 100))
+
+def test_profile_table(tmp_path):
+    filename = str(tmp_path / 'in.profile')
+    write_profile(filename)
+    table = norm.ProfileTable(filename)
+    assert table.headers == ['Nucleotide', 'Sequence', 'HQ_profile',
+            'HQ_stderr']
+    assert len(table.rows) == 20 and table.rows[1] == ['2', 'A', '0.1', '0.01']
+    assert np.isnan(table.profile[3]) and table.profile[5] == 0.5
+    assert table.stderrs[19] == 0.19
+
+def test_write_norm_columns(tmp_path):
+    filename = str(tmp_path / 'in.profile')
+    write_profile(filename)
+    table = norm.ProfileTable(filename)
+
+    out_name = str(tmp_path / 'out' / 'out.profile')
+    table.write_norm_columns(out_name, 2)
+    with open(out_name) as outfile:
+        lines = outfile.read().split('\n')
+    assert lines[0] == \
+            'Nucleotide\tSequence\tHQ_profile\tHQ_stderr\tNorm_profile\tNorm_stderr'
+    assert lines[3] == '3\tA\t0.2\t0.02\t0.100000\t0.010000'
+    assert len(lines) == 21
+    # the table is left as it was
+    assert table.headers == ['Nucleotide', 'Sequence', 'HQ_profile',
+            'HQ_stderr']
+    assert table.rows[2] == ['3', 'A', '0.2', '0.02']
+
@@ -0,0 +1,46 @@
+import os, sys
+import pytest
+
+sys.path.append(os.path.join(sys.path[0], '../src'))
+
+import plot
+
+@pytest.fixture
+def profile_name(tmpdir):
+    profile_name = str(tmpdir.join('chr1:1-50.profile'))
+    with open(profile_name, 'w') as profile_file:
+        profile_file.write('Nucleotide\tSequence\tModified_effective_depth\t'
+                'HQ_profile\tHQ_stderr\tNorm_profile\tNorm_stderr\n')
+        for i in range(50):
+            reactivity = '' if i % 7 == 0 else str(i / 40)
+            profile_file.write('{}\tA\t{}\t{}\t0.01\t{}\t0.02\n'.format(
+                    i + 1, 1000 + i, reactivity, reactivity))
+    return profile_name
+
+def test_load_profile(profile_name):
+    columns = plot.load_profile(profile_name)
+    assert len(columns['Nucleotide']) == 50
+    assert list(columns['Sequence'][:2]) == ['A', 'A']
+    assert columns['Norm_profile'][1] == 1 / 40
+    assert all(map(lambda v: v != v, columns['Norm_profile'][::7]))
+
+def test_render(tmpdir, profile_name):
+    renderer = plot.Renderer(min_depth=1000)
+    pdf_name = str(tmpdir.join('figure.pdf'))
+    renderer.render(profile_name, pdf_name, 'chr1:1-50')
+    # The same figure is reused.
+    renderer.render(profile_name, pdf_name, 'chr1:1-50')
+    with open(pdf_name, 'rb') as pdf_file:
+        assert pdf_file.read(5) == b'%PDF-'
+
+    png_name = str(tmpdir.join('figure.png'))
+    plot.Renderer(raster=True, dpi=50).render(profile_name, png_name, 'x')
+    with open(png_name, 'rb') as png_file:
+        assert png_file.read(8) == b'\x89PNG\r\n\x1a\n'
+
+def test_render_pages(tmpdir, profile_name):
+    pdf_name = str(tmpdir.join('figures.pdf'))
+    plot.Renderer().render_pages([profile_name] * 3, pdf_name,
+            ['a', 'b', 'c'])
+    with open(pdf_name, 'rb') as pdf_file:
+        assert b'/Count 3' in pdf_file.read()
@@ -0,0 +1,161 @@
+import os, signal, subprocess, sys, tempfile
+import pytest
+
+# Ahead of the standard library, which has its own profile module.
+sys.path.insert(0, os.path.join(sys.path[0], '../src'))
+
+import profile
+
+# Reads over c:1-12, with mutations either side of the windows; the insertion
+# of r6 is between the windows of 4 positions.
+lines = [
+    b'r1\t0\tc\t1\t42\t6M\t*\t0\t0\tACTTAC\tIIIIII\tMD:Z:2G3',
+    b'r2\t0\tc\t3\t42\t2M1D3M\t*\t0\t0\tGTACG\tIIIII\tMD:Z:2^A3',
+    b'r3\t0\tc\t4\t42\t3M1I5M\t*\t0\t0\tTACGTACGT\tIIIIIIIII\tMD:Z:1C6',
+    b'r4\t0\tc\t8\t42\t5M\t*\t0\t0\tTACGA\tIIIII\tMD:Z:4T0',
+    b'r5\t0\tc\t5\t42\t2M2D4M\t*\t0\t0\tCGACGT\tIIIIII\tMD:Z:2^TA4',
+    b'r6\t0\tc\t1\t42\t4M1I4M\t*\t0\t0\tACGTAACGT\tIIIIIIIII\tMD:Z:8',
+]
+
+@pytest.fixture
+def tmpdir(tmp_path):
+    # As extracted by extract_batch
+    with open(str(tmp_path / 'modified.sam'), 'wb') as sam_file:
+        sam_file.write(b'\n'.join(lines) + b'\n')
+    return str(tmp_path)
+
+def read(filename):
+    with open(filename) as infile:
+        return infile.read()
+
+@pytest.mark.parametrize('window_length', [1, 3, 4, 5, 12])
+def test_windowed_counts_match(monkeypatch, tmpdir, window_length):
+    options = dict(min_mapq=0, tmpdir=tmpdir, extracted=True,
+            native_counts=True)
+    alignment = os.path.join(tmpdir, 'modified.sam')
+    expected = read(profile.count_sample(alignment, 'c:1-12',
+            out_name='whole.sam', **options))
+
+    monkeypatch.setattr(profile, 'WINDOW_OVERLAP', 3)
+    counts_name = profile.make_counts_windowed(alignment, 'c:1-12',
+            window_length=window_length, out_name='modified.sam', **options)
+    assert counts_name == os.path.join(tmpdir, 'modified.counts')
+    assert read(counts_name) == expected
+    assert sorted(os.listdir(tmpdir)) == \
+            ['modified.counts', 'modified.sam', 'whole.counts']
+
+def test_windowed_counts_need_overlap(monkeypatch, tmpdir):
+    options = dict(min_mapq=0, tmpdir=tmpdir, extracted=True,
+            native_counts=True)
+    alignment = os.path.join(tmpdir, 'modified.sam')
+    expected = read(profile.count_sample(alignment, 'c:1-12',
+            out_name='whole.sam', **options))
+
+    monkeypatch.setattr(profile, 'WINDOW_OVERLAP', 0)
+    assert read(profile.make_counts_windowed(alignment, 'c:1-12',
+            window_length=4, out_name='modified.sam', **options)) != expected
+
+def count_sample_trimmed(count_sample):
+    r"""
+    Wrap count_sample so that, as shapemapper_mutation_counter does, no rows
+    are written past the last position covered.
+    """
+    def wrapper(*args, **kwargs):
+        counts_name = count_sample(*args, **kwargs)
+        with open(counts_name) as counts_file:
+            rows = counts_file.readlines()
+        while len(rows) > 1 and set(rows[-1].split()) == {'0'}:
+            rows.pop()
+        with open(counts_name, 'w') as counts_file:
+            counts_file.writelines(rows)
+        return counts_name
+    return wrapper
+
+@pytest.mark.parametrize('window_length', [3, 4, 7, 20])
+def test_windowed_counts_match_without_trailing_rows(monkeypatch, tmpdir,
+        window_length):
+    monkeypatch.setattr(profile, 'count_sample',
+            count_sample_trimmed(profile.count_sample))
+    options = dict(min_mapq=0, tmpdir=tmpdir, extracted=True,
+            native_counts=True)
+    alignment = os.path.join(tmpdir, 'modified.sam')
+    # Past the last position covered, at 12
+    expected = read(profile.count_sample(alignment, 'c:1-20',
+            out_name='whole.sam', **options))
+    assert len(expected.splitlines()) == 13
+
+    monkeypatch.setattr(profile, 'WINDOW_OVERLAP', 3)
+    assert read(profile.make_counts_windowed(alignment, 'c:1-20',
+            window_length=window_length, out_name='modified.sam',
+            **options)) == expected
+
+STAND_INS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+        '../bench/stand_ins')
+
+@pytest.fixture
+def failing_bin(tmp_path_factory):
+    bin_name = str(tmp_path_factory.mktemp('bin') / 'fail')
+    with open(bin_name, 'w') as bin_file:
+        bin_file.write('#!/bin/sh\nexit 3\n')
+    os.chmod(bin_name, 0o755)
+    return bin_name
+
+@pytest.fixture
+def alarm():
+    # Fail, rather than hang, if the pipeline blocks.
+    def on_alarm(signum, frame):
+        raise TimeoutError
+    handler = signal.signal(signal.SIGALRM, on_alarm)
+    signal.alarm(20)
+    yield
+    signal.alarm(0)
+    signal.signal(signal.SIGALRM, handler)
+
+def make_counts_piped(tmpdir, n_copies):
+    alignment = os.path.join(tmpdir, 'modified.sam')
+    with open(alignment, 'wb') as sam_file:
+        sam_file.write(b'\n'.join(lines * n_copies) + b'\n')
+    return profile.make_counts_piped(alignment, 'c:1-12', min_mapq=0,
+            tmpdir=tmpdir, basename='modified', extracted=True)
+
+def test_piped_counts(monkeypatch, tmpdir, alarm):
+    monkeypatch.setattr(profile.constants, 'MUT_PARSER_BIN',
+            os.path.join(STAND_INS_DIR, 'shapemapper_mutation_parser'))
+    monkeypatch.setattr(profile.constants, 'MUT_COUNTER_BIN',
+            os.path.join(STAND_INS_DIR, 'shapemapper_mutation_counter'))
+    # Over the size of a pipe's buffer, so that writes wait on the parser.
+    counts_name = make_counts_piped(tmpdir, 5000)
+    assert read(counts_name).splitlines()[1:] == \
+            ['1\t10000', '3\t5000', '4\t5000', '5\t5000', '8\t5000']
+    assert sorted(os.listdir(tmpdir)) == ['modified.counts', 'modified.sam']
+
+@pytest.mark.parametrize('failing', ['parser', 'counter'])
+@pytest.mark.parametrize('n_copies', [1, 5000])
+def test_piped_counts_fail(monkeypatch, tmpdir, alarm, failing_bin, failing,
+        n_copies):
+    monkeypatch.setattr(profile.constants, 'MUT_PARSER_BIN', failing_bin
+            if failing == 'parser' else
+            os.path.join(STAND_INS_DIR, 'shapemapper_mutation_parser'))
+    monkeypatch.setattr(profile.constants, 'MUT_COUNTER_BIN', failing_bin
+            if failing == 'counter' else
+            os.path.join(STAND_INS_DIR, 'shapemapper_mutation_counter'))
+    with pytest.raises(subprocess.CalledProcessError) as error:
+        make_counts_piped(tmpdir, n_copies)
+    assert error.value.returncode == 3
+    assert sorted(os.listdir(tmpdir)) == ['modified.sam']
+
+@pytest.mark.parametrize('keep', [False, True])
+def test_extract_batches_fail(monkeypatch, tmp_path, failing_bin, keep):
+    # samtools, failing, on the PATH
+    monkeypatch.setenv('PATH', os.path.dirname(failing_bin) +
+            os.pathsep + os.environ['PATH'])
+    os.rename(failing_bin, os.path.join(os.path.dirname(failing_bin),
+            'samtools'))
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmp_path))
+    with pytest.raises(subprocess.CalledProcessError):
+        profile.extract_batches(['modified.bam', 'untreated.bam', None],
+                ['c:1-12', 'c:20-30'], keep=keep)
+    # The temp BED files are always removed, and the temp directories unless
+    # keep (without their random suffixes).
+    assert sorted(name[:-8] for name in os.listdir(str(tmp_path))) == (
+            ['bedshape-c:1-12-', 'bedshape-c:20-30-'] if keep else [])
@@ -0,0 +1,127 @@
+import io, itertools, os, sys
+import pytest
+
+sys.path.append(os.path.join(sys.path[0], '../src'))
+
+import sam
+
+sam_lines = [
+    b'r1\t0\tchr1\t65505695\t42\t11M1D73M2D65M\t*\t0\t0\t*\t*\tMD:Z:11^A73^AC65',
+    b'r2\t4\tchr1\t65505700\t0\t*\t*\t0\t0\t*\t*',
+    b'r3\t0\tchr1\t65505841\t42\t150M\t*\t0\t0\t*\t*\tMD:Z:150',
+    b'r4\t0\tchr1\t65500000\t42\t10M\t*\t0\t0\t*\t*\tMD:Z:10',
+]
+
+def test_stream_write():
+    outfile = io.BytesIO()
+    sam.Stream(sam_lines, 65505800, 65505900).write(outfile)
+    assert outfile.getvalue() == b'\n'.join([
+        b'r1\t0\tchr1:65505800-65505900\t1\t42\t102S47M\t*\t0\t0\t*\t*\tMD:Z:47',
+        b'r3\t0\tchr1:65505800-65505900\t42\t42\t60M90S\t*\t0\t0\t*\t*\tMD:Z:60'])
+
+def test_stream_counts():
+    stream = sam.Stream(sam_lines, 65505800, 65505900)
+    lines = list(stream)
+    assert len(lines) == 2
+    assert stream.total_lines == 4
+    assert stream.lines_unmapped == 1
+    assert stream.lines_clipped_out == 1
+
+def test_stream_matches_file():
+    sam_file = sam.File(sam_lines)
+    sam_file.soft_clip(65505800, 65505900)
+    outfile = io.BytesIO()
+    sam.Stream(sam_lines, 65505800, 65505900).write(outfile)
+    assert outfile.getvalue().decode() == str(sam_file)
+
+deep_lines = [
+    'd{}\t0\tchr1\t{}\t42\t20M\t*\t0\t0\t*\t*\tMD:Z:20'.format(
+        i, 100 + i // 10).encode()
+    for i in range(200)]
+
+def get_names(stream):
+    return [line.name for line in stream]
+
+def test_downsample_target_depth():
+    stream = sam.Stream(deep_lines, 100, 150,
+            downsampler=sam.Downsampler(target_depth=25))
+    names = get_names(stream)
+    depths = list(itertools.accumulate(stream.depth_changes[:-1]))
+    assert max(depths) == 25
+    assert stream.lines_downsampled == 200 - len(names)
+    assert stream.lines_clipped_out == 0
+
+def test_downsample_max_reads():
+    stream = sam.Stream(deep_lines, 100, 150,
+            downsampler=sam.Downsampler(max_reads=30))
+    names = get_names(stream)
+    assert len(names) == 30 and stream.lines_downsampled == 170
+    # Still sorted by position
+    assert names == sorted(names, key=lambda name: int(name[1:]))
+
+def test_downsample_is_deterministic():
+    def downsample(seed):
+        return get_names(sam.Stream(deep_lines, 100, 150,
+                downsampler=sam.Downsampler(max_reads=30, target_depth=25,
+                    seed=seed)))
+    assert downsample(0) == downsample(0)
+    assert downsample(0) != downsample(1)
+
+def test_downsample_passes_lines_outside_region():
+    stream = sam.Stream(sam_lines, 65505800, 65505900,
+            downsampler=sam.Downsampler(max_reads=1))
+    names = get_names(stream)
+    assert len(names) == 1
+    assert stream.lines_clipped_out == 1 and stream.lines_downsampled == 1
+
+header_lines = [b'@HD\tVN:1.6\tSO:coordinate', b'@SQ\tSN:chr1\tLN:248956422']
+
+@pytest.mark.parametrize('downsampler', [None,
+    sam.Downsampler(target_depth=25), sam.Downsampler(max_reads=30),
+    sam.Downsampler(max_reads=30, target_depth=25)])
+def test_stream_passes_header_lines(downsampler):
+    stream = sam.Stream(header_lines + deep_lines, 100, 150,
+            downsampler=downsampler)
+    lines = [bytes(line) for line in stream]
+    assert lines[:2] == header_lines
+    assert lines[2:] == [bytes(line) for line in sam.Stream(deep_lines, 100,
+            150, downsampler=downsampler)]
+
+def test_router_overlapping():
+    router = sam.Router([
+        ('chr1:100-200', 'chr1', 100, 200),
+        ('chr1:150-1000', 'chr1', 150, 1000),
+        ('chr1:300-400', 'chr1', 300, 400),
+        ('chr2:100-200', 'chr2', 100, 200)])
+    assert router.overlapping('chr1', 50, 99) == []
+    assert router.overlapping('chr1', 50, 100) == ['chr1:100-200']
+    assert router.overlapping('chr1', 190, 310) == \
+            ['chr1:100-200', 'chr1:150-1000', 'chr1:300-400']
+    assert router.overlapping('chr1', 500, 600) == ['chr1:150-1000']
+    assert router.overlapping('chr2', 201, 300) == []
+    assert router.overlapping('chr3', 1, 300) == []
+
+@pytest.mark.parametrize('line_string,clipped', [
+    (b'r1\t99\tchr1\t95\t42\t20M\t=\t300\t250\tACGT\tIIII\tNM:i:1\tMD:Z:10A9\tXS:i:0\n',
+        b'r1\t32\tchr1:100-200\t1\t42\t5S15M\t*\t0\t0\tACGT\tIIII\tNM:i:1\tMD:Z:5A9\tXS:i:0'),
+    (b'r2\t0\tchr1\t190\t42\t20M\t*\t0\t0\tACGT\tIIII\tMD:Z:2C17',
+        b'r2\t0\tchr1:100-200\t91\t42\t11M9S\t*\t0\t0\tACGT\tIIII\tMD:Z:2C8'),
+    (b'r3\t16\tchr1\t120\t42\t20M\t*\t0\t0\tACGT\tIIII\tMD:Z:0G19\tAS:i:-5',
+        b'r3\t16\tchr1:100-200\t21\t42\t20M\t*\t0\t0\tACGT\tIIII\tMD:Z:0G19\tAS:i:-5'),
+    (b'r4\t0\tchr1\t95\t42\t20M\t*\t0\t0\tAC GT\tII II\tMD:Z:20',
+        b'r4\t0\tchr1:100-200\t1\t42\t5S15M\t*\t0\t0\tAC GT\tII II\tMD:Z:15'),
+    # '=' and 'X' are written as 'M', and 'H' dropped, whether or not the read
+    # lies within the region.
+    (b'r5\t0\tchr1\t120\t42\t3H5=1X4=2H\t*\t0\t0\tACGT\tIIII\tMD:Z:5A4',
+        b'r5\t0\tchr1:100-200\t21\t42\t10M\t*\t0\t0\tACGT\tIIII\tMD:Z:5A4'),
+    (b'r6\t0\tchr1\t95\t42\t3H5=1X14=\t*\t0\t0\tACGT\tIIII\tMD:Z:5A14',
+        b'r6\t0\tchr1:100-200\t1\t42\t5S15M\t*\t0\t0\tACGT\tIIII\tMD:Z:A14')])
+def test_line_soft_clip(line_string, clipped):
+    line = sam.Line(line_string)
+    line.soft_clip(100, 200)
+    assert bytes(line) == clipped
+
+def test_line_without_md_tag():
+    line = sam.Line(b'r1\t0\tchr1\t95\t42\t20M\t*\t0\t0\tACGT\tIIII\tNM:i:1')
+    with pytest.raises(RuntimeError):
+        line.soft_clip(100, 200)
@@ -0,0 +1,51 @@
+import os, subprocess, sys
+import pytest
+
+sys.path.append(os.path.join(sys.path[0], '../src'))
+
+import scripts
+
+def write_script(tmp_path, name, source):
+    script = str(tmp_path / name)
+    with open(script, 'w') as script_file:
+        script_file.write(source)
+    return script
+
+def test_run_in_process(tmp_path):
+    out_name = str(tmp_path / 'out.txt')
+    script = write_script(tmp_path, 'echo.py',
+            'import sys\n'
+            'if __name__ == "__main__":\n'
+            '    with open(sys.argv[2], "w") as outfile:\n'
+            '        outfile.write(" ".join(sys.argv[3:]))\n')
+    argv = sys.argv[:]
+    scripts.run_in_process(script, ['--out', out_name, 'a', 'b'])
+    with open(out_name) as outfile:
+        assert outfile.read() == 'a b'
+    assert sys.argv == argv
+
+def test_run_in_process_raises_on_exit_status(tmp_path):
+    script = write_script(tmp_path, 'fail.py', 'import sys\nsys.exit(2)\n')
+    with pytest.raises(RuntimeError):
+        scripts.run_in_process(script, [])
+    scripts.run_in_process(
+            write_script(tmp_path, 'ok.py', 'import sys\nsys.exit(0)\n'), [])
+
+def test_run_falls_back_to_subprocess(tmp_path):
+    out_name = str(tmp_path / 'out.txt')
+    # Fails only when run in-process, by pytest.
+    script = write_script(tmp_path, 'picky.py',
+            'import sys\n'
+            'if "pytest" in sys.modules:\n'
+            '    raise ImportError("not here")\n'
+            'open(sys.argv[1], "w").close()\n')
+    assert scripts.run(script, [out_name], 'picky', in_process=True) == 0
+    assert os.path.isfile(out_name)
+
+def test_run_check(tmp_path):
+    script = write_script(tmp_path, 'fail.py', 'import sys\nsys.exit(2)\n')
+    assert scripts.run(script, [], 'fail') == 2
+    for in_process in (False, True):
+        with pytest.raises(subprocess.CalledProcessError):
+            scripts.run(script, [], 'fail', in_process=in_process,
+                    check=True)
@@ -0,0 +1,82 @@
+import json, os, subprocess, sys
+import pytest
+
+sys.path.append(os.path.join(sys.path[0], '../src'))
+
+import stages
+
+@pytest.fixture
+def records_name(tmp_path):
+    records_name = str(tmp_path / 'stages.jsonl')
+    stages.enable(records_name)
+    yield records_name
+    stages.enable(None)
+
+def test_stage(tmp_path, records_name):
+    out_name = str(tmp_path / 'out.txt')
+    token = stages.current_region.set('chr1:1-100')
+    try:
+        with stages.stage('write', sample='modified', outputs=[out_name]):
+            with open(out_name, 'w') as outfile:
+                outfile.write('x' * 10)
+        with stages.stage('pipe') as measured:
+            measured['bytes_out'] = 5
+    finally:
+        stages.current_region.reset(token)
+
+    write, pipe = stages.load_records(records_name)
+    assert write['region'] == 'chr1:1-100' and write['stage'] == 'write'
+    assert write['sample'] == 'modified'
+    assert write['bytes_in'] == None and write['bytes_out'] == 10
+    assert write['wall_time'] >= 0 and write['max_rss'] > 0
+    assert pipe['bytes_out'] == 5
+
+def test_run(tmp_path, records_name):
+    returncode = stages.run(
+            [sys.executable, '-c', 'import sys; sys.exit(3)'], 'exit')
+    assert returncode == 3
+    exit_record, = stages.load_records(records_name)
+    assert exit_record['stage'] == 'exit' and exit_record['cpu_time'] > 0
+
+def test_run_check(records_name):
+    with pytest.raises(subprocess.CalledProcessError):
+        stages.run([sys.executable, '-c', 'import sys; sys.exit(1)'], 'exit',
+                check=True)
+    # Failed stages are still recorded.
+    exit_record, = stages.load_records(records_name)
+    assert exit_record['stage'] == 'exit'
+    assert stages.run([sys.executable, '-c', ''], 'pass', check=True) == 0
+
+def test_wait_without_blocking(records_name):
+    process = subprocess.Popen([sys.executable, '-c',
+            'import sys; sys.stdin.read()'], stdin=subprocess.PIPE)
+    assert stages.wait(process, 'read', start=0, block=False) == None
+    assert not os.path.isfile(records_name)
+    process.stdin.close()
+    while stages.wait(process, 'read', start=0, block=False) == None:
+        pass
+    assert process.returncode == 0
+    read_record, = stages.load_records(records_name)
+    assert read_record['stage'] == 'read'
+
+def test_disabled_stages_are_not_recorded(tmp_path):
+    with stages.stage('nothing'):
+        pass
+    assert stages.get_records_name() == None
+
+def test_write_reports(tmp_path, records_name):
+    for region, stage, wall_time in [('chr1:1-100', 'clip', 2.0),
+            ('chr1:1-100', 'count', 1.0), ('chr2:1-100', 'clip', 0.5)]:
+        token = stages.current_region.set(region)
+        stages.record(stage, wall_time=wall_time, cpu_time=wall_time,
+                max_rss=1)
+        stages.current_region.reset(token)
+    stages.write_reports(records_name, str(tmp_path))
+
+    with open(str(tmp_path / 'chr1:1-100.stages.json')) as report_file:
+        report = json.load(report_file)
+    assert report['wall_time'] == 3.0 and len(report['stages']) == 2
+    with open(str(tmp_path / 'bedshape-stages.tsv')) as tsv_file:
+        lines = tsv_file.read().splitlines()
+    assert lines[0].split('\t') == stages.FIELDS
+    assert lines[3].split('\t')[:4] == ['chr2:1-100', 'clip', '', '0.5']